@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
 from datetime import datetime
@@ -8,7 +8,7 @@ router = APIRouter()
 class TaskRequest(BaseModel):
     task_type: str
     config: Dict[str, Any]
-    priority: Optional[int] = 1
+    priority: Optional[int] = None  # Número menor = más urgente; sin indicar, la prioridad por defecto
 
 class TaskResponse(BaseModel):
     task_id: str
@@ -16,38 +16,44 @@ class TaskResponse(BaseModel):
     message: str
     timestamp: datetime
 
+def get_automation_manager(request: Request):
+    """AutomationManager de la aplicación (main.py lo deja en app.state)"""
+    automation_manager = getattr(request.app.state, "automation_manager", None)
+    if automation_manager is None:
+        raise HTTPException(status_code=503, detail="Gestor de automatización no disponible")
+    return automation_manager
+
 @router.post("/tasks", response_model=TaskResponse)
-async def create_task(task_request: TaskRequest):
-    """Crear y ejecutar una nueva tarea"""
-    try:
-        # Aquí se conectará con el automation_manager real
-        task_id = f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        return TaskResponse(
-            task_id=task_id,
-            status="created",
-            message=f"Tarea {task_request.task_type} creada exitosamente",
-            timestamp=datetime.now()
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def create_task(task_request: TaskRequest, request: Request):
+    """Encolar una nueva tarea; se ejecuta en segundo plano"""
+    automation_manager = get_automation_manager(request)
+    result = automation_manager.submit_task(
+        task_request.task_type, task_request.config, task_request.priority
+    )
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error"))
+    
+    return TaskResponse(
+        task_id=result["task_id"],
+        status=result["status"],
+        message=f"Tarea {task_request.task_type} creada exitosamente",
+        timestamp=result["created_at"]
+    )
 
 @router.get("/tasks/{task_id}")
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, request: Request):
     """Obtener el estado de una tarea específica"""
-    # Placeholder - conectar con automation_manager
-    return {
-        "task_id": task_id,
-        "status": "running",
-        "progress": 50,
-        "timestamp": datetime.now()
-    }
+    task_info = get_automation_manager(request).get_task_status(task_id)
+    if task_info is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    return {**task_info, "task_id": task_id, "timestamp": datetime.now()}
 
 @router.get("/tasks")
-async def list_tasks():
-    """Listar todas las tareas"""
+async def list_tasks(request: Request, status: Optional[str] = None, limit: int = 100):
+    """Listar las tareas en cola, en ejecución y terminadas"""
+    tasks = get_automation_manager(request).list_tasks(status, limit)
     return {
-        "tasks": [],
-        "total": 0,
+        "tasks": tasks,
+        "total": len(tasks),
         "timestamp": datetime.now()
-    }
\ No newline at end of file
+    }
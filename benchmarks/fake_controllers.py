@@ -0,0 +1,181 @@
+import time
+import random
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+@dataclass(slots=True)
+class LatencyProfile:
+    """Latencia de una operación: mediana en segundos, dispersión lognormal y probabilidad de fallo"""
+    median: float
+    spread: float = 0.0
+    failure_rate: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LatencyProfile":
+        return cls(
+            median=float(data.get("median", 0.0)),
+            spread=float(data.get("spread", 0.0)),
+            failure_rate=float(data.get("failure_rate", 0.0))
+        )
+
+
+# Tiempos aproximados de las operaciones reales (ventana de Farmatic, webs de distribuidores, impresora)
+DEFAULT_PROFILES = {
+    "get_order_list": LatencyProfile(3.0, 0.2),
+    "manage_wallet": LatencyProfile(1.5, 0.3),
+    "check_wallet_result": LatencyProfile(2.0, 0.3),
+    "assign_supplier": LatencyProfile(1.0, 0.2),
+    "reload_and_send": LatencyProfile(1.5, 0.2),
+    "query_binary_dashboard": LatencyProfile(0.4, 0.5, 0.01),
+    "query_binary_dashboard_bulk": LatencyProfile(1.0, 0.3),
+    "search_by_cn": LatencyProfile(2.5, 0.6, 0.03),
+    "register_product_binary": LatencyProfile(0.5, 0.4),
+    "purchase_actibios": LatencyProfile(4.0, 0.4, 0.02),
+    "print_promofarma_label": LatencyProfile(0.8, 0.2, 0.01)
+}
+
+
+class LatencyInjector:
+    """Simula la duración y los fallos de cada operación de forma reproducible"""
+
+    def __init__(self, profiles: Dict[str, LatencyProfile] = None, time_scale: float = 1.0, seed: int = 0):
+        self.profiles = {**DEFAULT_PROFILES, **(profiles or {})}
+        self.time_scale = time_scale
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.failures = {}
+
+    def __call__(self, operation: str) -> bool:
+        """Esperar lo que tardaría la operación; devuelve False si debe fallar"""
+        profile = self.profiles.get(operation)
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if profile is None:
+                return True
+            factor = self.random.lognormvariate(0.0, profile.spread) if profile.spread else 1.0
+            failed = self.random.random() < profile.failure_rate
+            if failed:
+                self.failures[operation] = self.failures.get(operation, 0) + 1
+
+        delay = profile.median * factor * self.time_scale
+        if delay > 0:
+            time.sleep(delay)
+        return not failed
+
+    def keyed_random(self, *key) -> random.Random:
+        """Generador propio de una clave: el mismo producto da el mismo resultado en cualquier modo u orden"""
+        return random.Random("|".join(str(part) for part in (self.seed, *key)))
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {"calls": dict(self.calls), "failures": dict(self.failures)}
+
+
+def _failure(operation: str) -> Dict:
+    return {"success": False, "error": f"Fallo simulado en {operation}"}
+
+
+class FakeFarmaticController:
+    """FarmaticController sin ventana: devuelve la lista de pedidos dada y tarda lo configurado"""
+
+    SUPPLIERS = ["promofarma", "cofares", "alliance", "hefame", "bidafarma"]
+
+    def __init__(self, orders: List[Dict], injector: LatencyInjector):
+        self.orders = orders
+        self.injector = injector
+
+    def get_order_list(self, config: Dict) -> Dict:
+        if not self.injector("get_order_list"):
+            return _failure("get_order_list")
+        return {"success": True, "orders": [dict(order) for order in self.orders]}
+
+    def manage_wallet(self, config: Dict) -> Dict:
+        if not self.injector("manage_wallet"):
+            return _failure("manage_wallet")
+        return {"success": True}
+
+    def check_wallet_result(self, config: Dict) -> Dict:
+        if not self.injector("check_wallet_result"):
+            return _failure("check_wallet_result")
+        rng = self.injector.keyed_random("wallet", config.get("cn"))
+        suppliers = [
+            {"name": name, "price": round(rng.uniform(5, 60), 2), "margin": round(rng.uniform(0.05, 0.25), 3)}
+            for name in rng.sample(self.SUPPLIERS, rng.randint(1, 3))
+        ]
+        return {"success": True, "suppliers": suppliers}
+
+    def assign_supplier(self, order_id: str, supplier: Dict) -> Dict:
+        if not self.injector("assign_supplier"):
+            return _failure("assign_supplier")
+        return {"success": True}
+
+    def reload_and_send(self, order_id: str) -> Dict:
+        if not self.injector("reload_and_send"):
+            return _failure("reload_and_send")
+        return {"success": True}
+
+
+class FakeWebController:
+    """WebController sin navegador: Binary Dashboard y distribuidores simulados"""
+
+    def __init__(self, stock_by_ean: Dict[str, int], injector: LatencyInjector, found_rate: float = 0.7):
+        self.stock_by_ean = stock_by_ean
+        self.injector = injector
+        self.found_rate = found_rate
+
+    def _product_info(self, ean: str) -> Dict:
+        return {
+            "ean": ean, "own_stock": self.stock_by_ean.get(ean, 0), "cn": ean[-6:],
+            "description": f"Producto {ean}", "iva": 21, "laboratory": "Lab", "family": "Medicamentos"
+        }
+
+    def query_binary_dashboard(self, config: Dict) -> Dict:
+        if not self.injector("query_binary_dashboard"):
+            return _failure("query_binary_dashboard")
+        return {"success": True, "product_info": self._product_info(config["ean"])}
+
+    def query_binary_dashboard_bulk(self, eans: List[str], fields: List[str] = None,
+                                    chunk_size: int = None) -> Dict:
+        if not self.injector("query_binary_dashboard_bulk"):
+            return {"success": False, "products": {}, "not_found": [],
+                    "errors": [_failure("query_binary_dashboard_bulk")]}
+        return {"success": True, "products": {ean: self._product_info(ean) for ean in eans},
+                "not_found": [], "errors": []}
+
+    def cached_search_by_cn(self, distributor: str, cn: str) -> Optional[Dict]:
+        # Sin caché: cada búsqueda simulada ocupa un navegador
+        return None
+
+    def distributor_unavailable(self, distributor: str) -> Optional[Dict]:
+        return None
+
+    def search_by_cn(self, distributor: str, cn: str, attempt: int = None) -> Dict:
+        if not self.injector("search_by_cn"):
+            return _failure("search_by_cn")
+        found = self.injector.keyed_random("distributor", distributor, cn).random() < self.found_rate
+        return {"success": True, "found": found, "price": 25.0 if found else None}
+
+    def register_product_binary(self, data: Dict) -> Dict:
+        if not self.injector("register_product_binary"):
+            return _failure("register_product_binary")
+        return {"success": True}
+
+    def purchase_actibios(self, ean: str, quantity: int) -> Dict:
+        if not self.injector("purchase_actibios"):
+            return _failure("purchase_actibios")
+        return {"success": True}
+
+
+class FakePrinterManager:
+    """PrinterManager sin impresora"""
+
+    def __init__(self, injector: LatencyInjector):
+        self.injector = injector
+
+    def print_promofarma_label(self, label_data: Dict) -> Dict:
+        if not self.injector("print_promofarma_label"):
+            return _failure("print_promofarma_label")
+        return {"success": True}
@@ -0,0 +1,215 @@
+"""Rendimiento de una traza completa sin Farmatic, navegador ni impresora.
+
+Ejemplos (desde la raíz del repositorio):
+    python -m benchmarks.trace_throughput --orders 500 --time-scale 0.01
+    python -m benchmarks.trace_throughput --orders-file pedidos.json --modes pipeline --json resultado.json
+"""
+import os
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+from config.settings import settings
+from core.excel_manager import ExcelManager
+from core.trace_manager import TraceManager
+from benchmarks.fake_controllers import (
+    LatencyInjector, LatencyProfile, FakeFarmaticController, FakeWebController, FakePrinterManager
+)
+
+# Configuración de traza de cada modo de procesamiento
+MODES = {
+    "sequential": {"pipeline": False, "max_workers": 1},
+    "threaded": {"pipeline": False},
+    "pipeline": {"pipeline": True}
+}
+
+# Stock propio -> peso: 0 va a distribuidores, 1 requiere intervención humana, >1 se completa directamente
+DEFAULT_STOCK_WEIGHTS = {0: 0.6, 1: 0.1, 3: 0.3}
+
+
+def generate_orders(count: int, distinct_products: int = None, stock_weights: Dict[int, float] = None,
+                    seed: int = 0) -> Tuple[List[Dict], Dict[str, int]]:
+    """Pedidos sintéticos y el stock propio de cada EAN"""
+    rng = random.Random(seed)
+    distinct_products = max(1, distinct_products or count)
+    stock_weights = stock_weights or DEFAULT_STOCK_WEIGHTS
+    eans = [f"847{index:010d}" for index in range(distinct_products)]
+    stock_by_ean = {
+        ean: rng.choices(list(stock_weights), weights=list(stock_weights.values()))[0] for ean in eans
+    }
+    orders = [
+        {"id": f"PED{index:06d}", "ean": rng.choice(eans), "quantity": rng.randint(1, 3)}
+        for index in range(count)
+    ]
+    return orders, stock_by_ean
+
+
+def load_orders(path: str, seed: int = 0) -> Tuple[List[Dict], Dict[str, int]]:
+    """Pedidos grabados en JSON (lista o {"orders", "stock"}) o CSV con columnas id, ean, quantity[, stock]"""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        orders = [
+            {"id": row["id"], "ean": row["ean"], "quantity": int(row.get("quantity") or 1)} for row in rows
+        ]
+        stock_by_ean = {row["ean"]: int(row["stock"]) for row in rows if row.get("stock") not in (None, "")}
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        orders = data["orders"] if isinstance(data, dict) else data
+        stock_by_ean = {
+            str(ean): int(stock) for ean, stock in (data.get("stock", {}) if isinstance(data, dict) else {}).items()
+        }
+
+    # EAN sin stock grabado: se sortea con el reparto por defecto
+    rng = random.Random(seed)
+    for order in orders:
+        ean = str(order.get("ean"))
+        if ean not in stock_by_ean:
+            stock_by_ean[ean] = rng.choices(
+                list(DEFAULT_STOCK_WEIGHTS), weights=list(DEFAULT_STOCK_WEIGHTS.values())
+            )[0]
+    return orders, stock_by_ean
+
+
+def load_profiles(path: str) -> Dict[str, LatencyProfile]:
+    """Perfiles de latencia en JSON: {"search_by_cn": {"median": 2.5, "spread": 0.6, "failure_rate": 0.03}, ...}"""
+    with open(path, encoding="utf-8") as f:
+        return {operation: LatencyProfile.from_dict(data) for operation, data in json.load(f).items()}
+
+
+def run_benchmark(orders: List[Dict], stock_by_ean: Dict[str, int], mode: str = "pipeline",
+                  profiles: Dict[str, LatencyProfile] = None, time_scale: float = 0.01, seed: int = 0,
+                  max_workers: int = 4, found_rate: float = 0.7, track_memory: bool = True) -> Dict:
+    """Ejecutar una traza completa con controladores simulados en un directorio temporal"""
+    injector = LatencyInjector(profiles, time_scale=time_scale, seed=seed)
+    config = {"max_workers": max_workers, **MODES[mode]}
+    previous_dir = os.getcwd()
+    previous_database_url = settings.DATABASE_URL
+
+    with tempfile.TemporaryDirectory(prefix="autofarma_bench_") as work_dir:
+        # Libro, Excel, alertas y puntos de control nuevos en cada ejecución
+        os.chdir(work_dir)
+        settings.DATABASE_URL = "sqlite:///./autofarma.db"
+        if track_memory:
+            tracemalloc.start()
+        try:
+            automation_manager = SimpleNamespace(
+                farmatic_controller=FakeFarmaticController(orders, injector),
+                web_controller=FakeWebController(stock_by_ean, injector, found_rate),
+                excel_manager=ExcelManager(),
+                printer_manager=FakePrinterManager(injector)
+            )
+            trace_manager = TraceManager(automation_manager)
+
+            started = time.perf_counter()
+            result = trace_manager.start_full_trace(config)
+            elapsed = time.perf_counter() - started
+
+            peak_bytes = tracemalloc.get_traced_memory()[1] if track_memory else None
+            timings = trace_manager.get_trace_timings(result.get("trace_id")) or {"steps": {}}
+
+            trace_manager.alert_log.close()
+            if trace_manager.checkpoints:
+                trace_manager.checkpoints.close()
+            automation_manager.excel_manager.close()
+        finally:
+            if track_memory:
+                tracemalloc.stop()
+            settings.DATABASE_URL = previous_database_url
+            os.chdir(previous_dir)
+
+    summary = result.get("initial_result") or {}
+    return {
+        "mode": mode,
+        "orders": len(orders),
+        "distinct_products": len({order.get("ean") for order in orders}),
+        "time_scale": time_scale,
+        "success": result.get("success", False) and summary.get("success", True),
+        "error": result.get("error") or summary.get("error"),
+        "elapsed_seconds": round(elapsed, 3),
+        "orders_per_minute": round(len(orders) / elapsed * 60, 1) if elapsed else 0.0,
+        "results": {
+            key: summary.get(key, 0) for key in ("processed", "failed", "human_intervention", "skipped")
+        },
+        "peak_memory_mb": round(peak_bytes / (1024 * 1024), 2) if peak_bytes is not None else None,
+        "steps": timings["steps"],
+        "simulated": injector.get_stats()
+    }
+
+
+def format_report(report: Dict) -> str:
+    """Resumen legible de una ejecución"""
+    results = report["results"]
+    lines = [
+        f"== {report['mode']}: {report['orders']} pedidos ({report['distinct_products']} productos), "
+        f"escala de tiempo {report['time_scale']}",
+        f"   {report['orders_per_minute']} pedidos/min en {report['elapsed_seconds']} s | "
+        f"completados {results['processed']}, fallidos {results['failed']}, "
+        f"humanos {results['human_intervention']}, omitidos {results['skipped']}",
+    ]
+    if report["peak_memory_mb"] is not None:
+        lines.append(f"   pico de memoria (tracemalloc): {report['peak_memory_mb']} MB")
+    if report["error"]:
+        lines.append(f"   error: {report['error']}")
+
+    lines.append(f"   {'paso':<32}{'n':>7}{'total s':>10}{'media':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for step, stats in report["steps"].items():
+        lines.append(
+            f"   {step:<32}{stats['count']:>7}{stats['total']:>10.3f}{stats['mean']:>9.4f}"
+            f"{stats['p50']:>9.4f}{stats['p95']:>9.4f}{stats['p99']:>9.4f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> List[Dict]:
+    parser = argparse.ArgumentParser(description="Rendimiento de trazas con controladores simulados")
+    parser.add_argument("--orders", type=int, default=200, help="Pedidos sintéticos a generar")
+    parser.add_argument("--distinct-products", type=int, default=None,
+                        help="EAN distintos entre los pedidos sintéticos (por defecto, uno por pedido)")
+    parser.add_argument("--orders-file", help="Lista de pedidos grabada (JSON o CSV) en lugar de generarla")
+    parser.add_argument("--profiles", help="JSON con perfiles de latencia por operación")
+    parser.add_argument("--time-scale", type=float, default=0.01,
+                        help="Factor aplicado a las latencias simuladas (1 = tiempo real)")
+    parser.add_argument("--found-rate", type=float, default=0.7,
+                        help="Probabilidad de que un distribuidor encuentre el CN")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--max-workers", type=int, default=4, help="Hilos del modo threaded")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="No medir memoria (tracemalloc ralentiza)")
+    parser.add_argument("--json", dest="json_path", help="Guardar los resultados en este fichero JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.orders_file:
+        orders, stock_by_ean = load_orders(args.orders_file, seed=args.seed)
+    else:
+        orders, stock_by_ean = generate_orders(args.orders, args.distinct_products, seed=args.seed)
+    profiles = load_profiles(args.profiles) if args.profiles else None
+
+    reports = []
+    for mode in args.modes:
+        report = run_benchmark(
+            orders, stock_by_ean, mode=mode, profiles=profiles, time_scale=args.time_scale,
+            seed=args.seed, max_workers=args.max_workers, found_rate=args.found_rate,
+            track_memory=not args.no_memory
+        )
+        print(format_report(report))
+        reports.append(report)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2, default=str)
+    return reports
+
+
+if __name__ == "__main__":
+    main()
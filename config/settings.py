@@ -11,10 +11,22 @@ class Settings:
     
     # Configuración de base de datos
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./autofarma.db")
+    # Entradas del índice de pedidos que se mantienen en memoria (el resto se lee de SQLite)
+    ORDER_INDEX_CACHE_ENTRIES = int(os.getenv("ORDER_INDEX_CACHE_ENTRIES", 10000))
     
     # Configuración de Redis
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
     
+    # Trabajadores Celery (en pruebas: broker "memory://" y backend "cache+memory://", o modo eager)
+    CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+    CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
+    CELERY_ALWAYS_EAGER = os.getenv("CELERY_ALWAYS_EAGER", "False").lower() == "true"
+    # Recursos de este puesto: decide qué colas consume su trabajador
+    WORKER_RESOURCES = [
+        resource.strip() for resource in
+        os.getenv("WORKER_RESOURCES", "browser,excel,farmatic,printer").split(",") if resource.strip()
+    ]
+    
     # Configuración de seguridad
     SECRET_KEY = os.getenv("SECRET_KEY", "tu-clave-secreta-muy-segura")
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -23,8 +35,104 @@ class Settings:
     SELENIUM_TIMEOUT = 10
     PYAUTOGUI_PAUSE = 0.5
     
+    # Concurrencia de trazas: pedidos en paralelo y plazas por recurso compartido
+    TRACE_MAX_WORKERS = int(os.getenv("TRACE_MAX_WORKERS", 1))
+    TRACE_COALESCE_PRODUCTS = os.getenv("TRACE_COALESCE_PRODUCTS", "True").lower() == "true"
+    TRACE_CHECKPOINTS = os.getenv("TRACE_CHECKPOINTS", "True").lower() == "true"
+    TRACE_RETENTION_MAX_TRACES = int(os.getenv("TRACE_RETENTION_MAX_TRACES", 100))
+    TRACE_RETENTION_MAX_AGE = float(os.getenv("TRACE_RETENTION_MAX_AGE", 86400))  # segundos
+    # Puntos de control y trazas archivadas en disco que se borran al arrancar y al terminar trazas (0 = nunca)
+    TRACE_HISTORY_MAX_AGE = float(os.getenv("TRACE_HISTORY_MAX_AGE", 7 * 86400))  # segundos
+    # Cada cuánto se recogen trazas remotas terminadas y se caducan las antiguas (0 = sin barrido)
+    TRACE_SWEEP_SECONDS = float(os.getenv("TRACE_SWEEP_SECONDS", 60))
+    TASK_HISTORY_MAX = int(os.getenv("TASK_HISTORY_MAX", 500))
+    # Procesamiento por etapas (opcional; por defecto se mantiene el secuencial): trabajadores de cada etapa
+    TRACE_PIPELINE = os.getenv("TRACE_PIPELINE", "False").lower() == "true"
+    TRACE_STAGE_WORKERS = {
+        "lookup": int(os.getenv("TRACE_LOOKUP_WORKERS", 4)),
+        "distributors": int(os.getenv("TRACE_DISTRIBUTOR_WORKERS", 2)),
+        "farmatic": int(os.getenv("TRACE_FARMATIC_WORKERS", 1)),
+        "excel": int(os.getenv("TRACE_EXCEL_WORKERS", 1)),
+        "print": int(os.getenv("TRACE_PRINT_WORKERS", 1))
+    }
+    TRACE_BACKGROUND_WORKERS = int(os.getenv("TRACE_BACKGROUND_WORKERS", 2))
+    # "local" (hilos de este proceso) o "celery" (etapas de los pedidos en trabajadores remotos)
+    TRACE_DISPATCH = os.getenv("TRACE_DISPATCH", "local")
+    TRACE_DISPATCH_INFLIGHT = int(os.getenv("TRACE_DISPATCH_INFLIGHT", 16))  # pedidos en curso a la vez
+    TRACE_DISPATCH_TIMEOUT = float(os.getenv("TRACE_DISPATCH_TIMEOUT", 600))  # segundos por etapa
+    # Segundos que Redis espera la confirmación de una etapa antes de entregarla a otro trabajador
+    CELERY_VISIBILITY_TIMEOUT = float(os.getenv("CELERY_VISIBILITY_TIMEOUT", 7200))
+    # Prioridad de pedidos, trazas y tareas: número menor = más urgente
+    ORDER_PRIORITY_URGENT = int(os.getenv("ORDER_PRIORITY_URGENT", 0))
+    ORDER_PRIORITY_DEFAULT = int(os.getenv("ORDER_PRIORITY_DEFAULT", 5))
+    PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", 30))  # espera que equivale a subir un nivel
+    FARMATIC_SLOTS = 1  # La GUI de Farmatic solo admite un usuario a la vez
+    BROWSER_SESSIONS = int(os.getenv("BROWSER_SESSIONS", 1))
+    BINARY_HTTP_SLOTS = int(os.getenv("BINARY_HTTP_SLOTS", 4))
+    PRINTER_SLOTS = int(os.getenv("PRINTER_SLOTS", 1))
+    
+    # Búsqueda de CN en distribuidores: en paralelo, con plazo y petición duplicada opcional
+    DISTRIBUTOR_FANOUT = os.getenv("DISTRIBUTOR_FANOUT", "True").lower() == "true"
+    DISTRIBUTOR_FANOUT_WORKERS = int(os.getenv("DISTRIBUTOR_FANOUT_WORKERS", 8))
+    DISTRIBUTOR_TIMEOUT = float(os.getenv("DISTRIBUTOR_TIMEOUT", 30))
+    DISTRIBUTOR_HEDGE_SECONDS = float(os.getenv("DISTRIBUTOR_HEDGE_SECONDS", 0))  # 0 = sin duplicar
+    
+    # Circuito por distribuidor: tras N fallos (o respuestas lentas) seguidos no se le llama durante el enfriamiento
+    DISTRIBUTOR_BREAKER_FAILURES = int(os.getenv("DISTRIBUTOR_BREAKER_FAILURES", 5))
+    DISTRIBUTOR_BREAKER_COOLDOWN = float(os.getenv("DISTRIBUTOR_BREAKER_COOLDOWN", 30))  # segundos
+    DISTRIBUTOR_SLOW_CALL_SECONDS = float(os.getenv("DISTRIBUTOR_SLOW_CALL_SECONDS", SELENIUM_TIMEOUT))
+    # Reintentos: como mucho N por búsqueda y, en total, una fracción de las búsquedas
+    DISTRIBUTOR_MAX_RETRIES = int(os.getenv("DISTRIBUTOR_MAX_RETRIES", 2))
+    DISTRIBUTOR_RETRY_RATIO = float(os.getenv("DISTRIBUTOR_RETRY_RATIO", 0.2))
+    DISTRIBUTOR_RETRY_BURST = float(os.getenv("DISTRIBUTOR_RETRY_BURST", 10))
+    DISTRIBUTOR_BACKOFF_BASE = float(os.getenv("DISTRIBUTOR_BACKOFF_BASE", 0.5))
+    DISTRIBUTOR_BACKOFF_MAX = float(os.getenv("DISTRIBUTOR_BACKOFF_MAX", 5))
+    
+    # Prioridades de proveedores y márgenes mínimos
+    SUPPLIER_CONFIG_PATH = os.getenv(
+        "SUPPLIER_CONFIG_PATH", os.path.join(os.path.dirname(__file__), "supplier_priorities.py")
+    )
+    
+    # Binary Dashboard
+    BINARY_DASHBOARD_URL = os.getenv("BINARY_DASHBOARD_URL", "http://localhost:3000/api/products")
+    BINARY_DASHBOARD_TIMEOUT = float(os.getenv("BINARY_DASHBOARD_TIMEOUT", 10))
+    BINARY_BULK_CHUNK_SIZE = int(os.getenv("BINARY_BULK_CHUNK_SIZE", 200))
+    BINARY_PREFETCH = os.getenv("BINARY_PREFETCH", "True").lower() == "true"
+    
+    # Caché de consultas a Binary Dashboard (segundos)
+    BINARY_CACHE_MAX_ENTRIES = int(os.getenv("BINARY_CACHE_MAX_ENTRIES", 5000))
+    BINARY_CACHE_STOCK_TTL = float(os.getenv("BINARY_CACHE_STOCK_TTL", 60))
+    BINARY_CACHE_STATIC_TTL = float(os.getenv("BINARY_CACHE_STATIC_TTL", 86400))
+    
+    # Caché de búsquedas por CN en distribuidores (segundos)
+    CN_CACHE_MAX_ENTRIES = int(os.getenv("CN_CACHE_MAX_ENTRIES", 20000))
+    CN_CACHE_POSITIVE_TTL = float(os.getenv("CN_CACHE_POSITIVE_TTL", 3600))
+    CN_CACHE_NEGATIVE_TTL = float(os.getenv("CN_CACHE_NEGATIVE_TTL", 600))
+    CN_CACHE_PATH = os.getenv("CN_CACHE_PATH", "./output/cn_cache.json")
+    CN_CACHE_SAVE_EVERY = int(os.getenv("CN_CACHE_SAVE_EVERY", 50))
+    
+    # Alertas de factor humano
+    ALERT_LOG_DIR = os.getenv("ALERT_LOG_DIR", "./logs")
+    ALERT_LOG_MAX_MB = float(os.getenv("ALERT_LOG_MAX_MB", 10))
+    ALERT_LOG_BACKUPS = int(os.getenv("ALERT_LOG_BACKUPS", 5))
+    ALERT_FLUSH_SECONDS = float(os.getenv("ALERT_FLUSH_SECONDS", 1))
+    
     # Configuración de Excel
     EXCEL_OUTPUT_DIR = os.getenv("EXCEL_OUTPUT_DIR", "./output")
+    EXCEL_APPEND_BATCH_ROWS = int(os.getenv("EXCEL_APPEND_BATCH_ROWS", 50))
+    EXCEL_APPEND_FLUSH_SECONDS = float(os.getenv("EXCEL_APPEND_FLUSH_SECONDS", 5))
+    # Intentos por lote antes de pasar las filas a <libro>.pendientes.jsonl, y espera máxima al vaciar/cerrar
+    EXCEL_WRITE_ATTEMPTS = int(os.getenv("EXCEL_WRITE_ATTEMPTS", 3))
+    EXCEL_WRITER_TIMEOUT = float(os.getenv("EXCEL_WRITER_TIMEOUT", 30))
+    # Además del libro SQLite, mantener pedidos_procesados.xlsx al día pedido a pedido
+    EXCEL_LIVE_LEDGER = os.getenv("EXCEL_LIVE_LEDGER", "False").lower() == "true"
+    # Rotación de libros acumulativos: "daily" o "none", más límites opcionales (0 = sin límite)
+    EXCEL_ROTATION = os.getenv("EXCEL_ROTATION", "daily")
+    EXCEL_ROTATION_MAX_ROWS = int(os.getenv("EXCEL_ROTATION_MAX_ROWS", 0))
+    EXCEL_ROTATION_MAX_MB = float(os.getenv("EXCEL_ROTATION_MAX_MB", 0))
+    EXCEL_ROTATED_FILES = os.getenv(
+        "EXCEL_ROTATED_FILES", "pedidos_procesados.xlsx,productos_consultados.xlsx"
+    ).split(",")
     
     # Configuración de impresora
     DEFAULT_PRINTER = os.getenv("DEFAULT_PRINTER", None)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
+
+from config.settings import settings
+from .database import connect
+
+class AlertLog:
+    """Alertas de factor humano: JSON por líneas con rotación y tabla SQLite para consultarlas.
+    Un hilo propio escribe por lotes, así registrar una alerta nunca bloquea el pedido."""
+
+    _STOP = object()
+
+    def __init__(self, log_dir: str = None, base_name: str = "human_factor_alerts",
+                 database_url: str = None, max_bytes: int = None, backup_count: int = None,
+                 flush_interval: float = None, max_batch: int = 100):
+        self.logger = logging.getLogger(__name__)
+        self.log_dir = os.path.abspath(log_dir or settings.ALERT_LOG_DIR)
+        self.file_path = os.path.join(self.log_dir, f"{base_name}.jsonl")
+        self.max_bytes = int(settings.ALERT_LOG_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.backup_count = settings.ALERT_LOG_BACKUPS if backup_count is None else backup_count
+        self.flush_interval = settings.ALERT_FLUSH_SECONDS if flush_interval is None else flush_interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+
+        self.connection = connect(database_url)
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS human_alerts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    trace_id TEXT,
+                    order_id TEXT,
+                    product_code TEXT,
+                    reason TEXT,
+                    payload TEXT NOT NULL
+                )
+            """)
+            for column in ("timestamp", "order_id", "product_code"):
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_human_alerts_{column} ON human_alerts ({column})"
+                )
+            self.connection.commit()
+
+        self.thread = threading.Thread(target=self._run, name="alert-log", daemon=True)
+        self.thread.start()
+
+    def record(self, alert: Dict):
+        """Encolar una alerta (no bloquea)"""
+        self.queue.put(("alert", alert, None))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Esperar a que las alertas encoladas estén en disco"""
+        if not self.thread.is_alive():
+            return False
+        future = Future()
+        self.queue.put(("flush", None, future))
+        return future.result(timeout)
+
+    def close(self, timeout: float = None):
+        """Guardar lo pendiente y detener el hilo escritor"""
+        if self.thread.is_alive():
+            self.queue.put((self._STOP, None, None))
+            self.thread.join(timeout)
+
+    def _run(self):
+        pending = []
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            try:
+                items = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                items = []
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            waiters = []
+            for kind, alert, future in items:
+                if kind is self._STOP:
+                    stopping = True
+                elif kind == "flush":
+                    waiters.append(future)
+                else:
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_interval
+                    pending.append(alert)
+
+            if pending and (stopping or waiters or len(pending) >= self.max_batch
+                            or time.monotonic() >= deadline):
+                self._write_batch(pending)
+                pending = []
+
+            for future in waiters:
+                future.set_result(True)
+
+        with self.lock:
+            self.connection.close()
+
+    def _write_batch(self, alerts: List[Dict]):
+        """Añadir un lote al fichero JSON y a la tabla de consulta"""
+        try:
+            # Marca de tiempo ISO: así se ordena y filtra como texto en SQLite
+            alerts = [
+                {**alert, "timestamp": alert["timestamp"].isoformat()}
+                if hasattr(alert.get("timestamp"), "isoformat") else alert
+                for alert in alerts
+            ]
+            lines = [json.dumps(alert, ensure_ascii=False, default=str) for alert in alerts]
+            self._rotate_if_needed()
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT INTO human_alerts (timestamp, trace_id, order_id, product_code, reason, payload) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (str(alert.get("timestamp")), alert.get("trace_id"),
+                         None if alert.get("order_id") is None else str(alert.get("order_id")),
+                         None if alert.get("product_code") is None else str(alert.get("product_code")),
+                         alert.get("reason"), line)
+                        for alert, line in zip(alerts, lines)
+                    ]
+                )
+                self.connection.commit()
+        except Exception as e:
+            self.logger.error(f"Error guardando {len(alerts)} alertas: {e}")
+
+    def _rotate_if_needed(self):
+        """Rotar como RotatingFileHandler: .jsonl -> .jsonl.1 -> ... -> .jsonl.N"""
+        if not self.max_bytes or not os.path.exists(self.file_path):
+            return
+        if os.path.getsize(self.file_path) < self.max_bytes:
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.file_path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.file_path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.file_path, f"{self.file_path}.1")
+        else:
+            os.remove(self.file_path)
+
+    def query(self, date_from: str = None, date_to: str = None, order_id: str = None,
+              product_code: str = None, limit: int = 100, offset: int = 0) -> List[Dict]:
+        """Buscar alertas por fecha (ISO, date_to inclusive), pedido o producto; las más recientes primero"""
+        self.flush()
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("timestamp >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("timestamp <= ?")
+            # Una fecha sin hora incluye el día completo
+            params.append(date_to if "T" in date_to else f"{date_to}T23:59:59.999999")
+        if order_id:
+            conditions.append("order_id = ?")
+            params.append(str(order_id))
+        if product_code:
+            conditions.append("product_code = ?")
+            params.append(str(product_code))
+
+        sql = "SELECT payload FROM human_alerts"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
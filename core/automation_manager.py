@@ -1,9 +1,14 @@
 import logging
+import itertools
+import threading
 import psutil
 from datetime import datetime
 from typing import Dict, List, Optional
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from config.settings import settings
+from .trace_checkpoints import strip_credentials
+from .priority_scheduler import PriorityExecutor
 
 # Importar los controladores especializados
 from .farmatic_controller import FarmaticController
@@ -12,11 +17,27 @@ from .excel_manager import ExcelManager
 from .printer_manager import PrinterManager
 
 class AutomationManager:
+    # Tipo de tarea -> método que la ejecuta
+    TASK_HANDLERS = {
+        "farmatic_search": "_execute_farmatic_search",
+        "web_data_collection": "_execute_web_data_collection",
+        "excel_update": "_execute_excel_update",
+        "print_labels": "_execute_print_labels",
+        "full_workflow": "_execute_full_workflow",
+        "inventory_sync": "_execute_inventory_sync"
+    }
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # Tareas en cola o en ejecución (las terminadas pasan a task_history)
         self.running_tasks = {}
-        self.task_history = []
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.task_futures = {}
+        self.tasks_lock = threading.Lock()
+        self.task_counter = itertools.count(1)
+        # Historial acotado de tareas terminadas (sin credenciales ni resultados voluminosos)
+        self.task_history = deque(maxlen=settings.TASK_HISTORY_MAX)
+        # Las tareas más urgentes (prioridad menor) se atienden antes, con envejecimiento
+        self.executor = PriorityExecutor(max_workers=4, thread_name_prefix="task")
         
         # Inicializar controladores especializados
         self.farmatic_controller = FarmaticController()
@@ -84,41 +105,64 @@ class AutomationManager:
             self.logger.error(f"Error obteniendo estado del sistema: {e}")
             return {"error": str(e)}
     
-    def execute_task(self, task_type: str, task_config: Dict) -> Dict:
-        """Ejecutar una tarea de automatización"""
-        task_id = f"task_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    def submit_task(self, task_type: str, task_config: Dict, priority: int = None) -> Dict:
+        """Encolar una tarea y devolver su identificador sin esperar a que se ejecute"""
+        if task_type not in self.TASK_HANDLERS:
+            return {"success": False, "error": f"Tipo de tarea no soportado: {task_type}"}
         
-        try:
+        task_id = self._register_task(task_type, task_config, priority, "queued")
+        task_info = self.running_tasks[task_id]
+        future = self.executor.submit_with_priority(
+            task_info["priority"], self._run_task, task_id, task_type, task_config
+        )
+        with self.tasks_lock:
+            # Si ya terminó, _archive_task se adelantó y no hay nada que guardar
+            if task_id in self.running_tasks:
+                self.task_futures[task_id] = future
+        
+        return {"success": True, "task_id": task_id, "status": "queued", "created_at": task_info["created_at"]}
+    
+    def execute_task(self, task_type: str, task_config: Dict, priority: int = None) -> Dict:
+        """Ejecutar una tarea de automatización en el hilo actual"""
+        task_id = self._register_task(task_type, task_config, priority, "running")
+        return self._run_task(task_id, task_type, task_config)
+    
+    def _register_task(self, task_type: str, task_config: Dict, priority: Optional[int], status: str) -> str:
+        """Dar de alta una tarea con un identificador único"""
+        now = datetime.now()
+        task_id = f"task_{now.strftime('%Y%m%d_%H%M%S_%f')}_{next(self.task_counter)}"
+        with self.tasks_lock:
             self.running_tasks[task_id] = {
                 "type": task_type,
-                "config": task_config,
-                "status": "running",
-                "start_time": datetime.now(),
+                "config": strip_credentials(task_config),
+                "priority": settings.ORDER_PRIORITY_DEFAULT if priority is None else priority,
+                "status": status,
+                "created_at": now,
+                "start_time": now,
                 "progress": 0
             }
+        return task_id
+    
+    def _run_task(self, task_id: str, task_type: str, task_config: Dict) -> Dict:
+        """Ejecutar una tarea ya registrada y pasarla al historial"""
+        task_info = self.running_tasks[task_id]
+        try:
+            task_info["status"] = "running"
+            task_info["start_time"] = datetime.now()
             
             # Ejecutar según el tipo de tarea
-            if task_type == "farmatic_search":
-                result = self._execute_farmatic_search(task_config)
-            elif task_type == "web_data_collection":
-                result = self._execute_web_data_collection(task_config)
-            elif task_type == "excel_update":
-                result = self._execute_excel_update(task_config)
-            elif task_type == "print_labels":
-                result = self._execute_print_labels(task_config)
-            elif task_type == "full_workflow":
-                result = self._execute_full_workflow(task_config)
-            elif task_type == "inventory_sync":
-                result = self._execute_inventory_sync(task_config)
-            else:
+            handler = self.TASK_HANDLERS.get(task_type)
+            if handler is None:
                 raise ValueError(f"Tipo de tarea no soportado: {task_type}")
+            result = getattr(self, handler)(task_config)
             
-            self.running_tasks[task_id]["status"] = "completed"
-            self.running_tasks[task_id]["result"] = result
-            self.running_tasks[task_id]["end_time"] = datetime.now()
+            task_info["status"] = "completed"
+            task_info["result"] = result
+            task_info["progress"] = 100
+            task_info["end_time"] = datetime.now()
             
             # Agregar a historial
-            self.task_history.append(self.running_tasks[task_id].copy())
+            self._archive_task(task_id)
             
             return {
                 "task_id": task_id,
@@ -128,9 +172,10 @@ class AutomationManager:
             
         except Exception as e:
             self.logger.error(f"Error ejecutando tarea {task_id}: {e}")
-            self.running_tasks[task_id]["status"] = "failed"
-            self.running_tasks[task_id]["error"] = str(e)
-            self.running_tasks[task_id]["end_time"] = datetime.now()
+            task_info["status"] = "failed"
+            task_info["error"] = str(e)
+            task_info["end_time"] = datetime.now()
+            self._archive_task(task_id)
             
             return {
                 "task_id": task_id,
@@ -226,12 +271,19 @@ class AutomationManager:
             data = config.get('data')
             report_name = config.get('report_name')
             
+            if config.get('streaming'):
+                return self.excel_manager.create_pharmacy_report_streaming(
+                    data, report_name, columns=config.get('columns')
+                )
+            
             return self.excel_manager.create_pharmacy_report(data, report_name)
             
         elif operation == 'update_inventory':
             product_updates = config.get('product_updates')
             
-            return self.excel_manager.update_inventory_excel(product_updates)
+            return self.excel_manager.update_inventory_excel(
+                product_updates, diff_snapshot=config.get('diff_snapshot', True)
+            )
         
         else:
             raise ValueError(f"Operación Excel no soportada: {operation}")
@@ -370,9 +422,43 @@ class AutomationManager:
         
         return row_data
     
+    def _archive_task(self, task_id: str):
+        """Pasar una tarea terminada al historial con su resultado resumido"""
+        with self.tasks_lock:
+            task_info = self.running_tasks.pop(task_id, None)
+            self.task_futures.pop(task_id, None)
+        if task_info is None:
+            return
+        
+        record = {key: value for key, value in task_info.items() if key != "result"}
+        record["task_id"] = task_id
+        result = task_info.get("result")
+        if isinstance(result, dict):
+            # Solo los valores simples (éxito, mensajes, rutas, recuentos)
+            record["result"] = {
+                key: value for key, value in result.items()
+                if isinstance(value, (str, int, float, bool)) or value is None
+            }
+        self.task_history.append(record)
+    
     def get_task_status(self, task_id: str) -> Optional[Dict]:
         """Obtener el estado de una tarea"""
-        return self.running_tasks.get(task_id)
+        task_info = self.running_tasks.get(task_id)
+        if task_info is not None:
+            return task_info
+        for record in reversed(self.task_history):
+            if record["task_id"] == task_id:
+                return record
+        return None
+    
+    def list_tasks(self, status: str = None, limit: int = 100) -> List[Dict]:
+        """Tareas en cola, en ejecución y terminadas, de la más reciente a la más antigua"""
+        with self.tasks_lock:
+            active = [{**task_info, "task_id": task_id} for task_id, task_info in self.running_tasks.items()]
+        tasks = active[::-1] + list(reversed(self.task_history))
+        if status:
+            tasks = [task for task in tasks if task["status"] == status]
+        return tasks[:limit]
     
     def get_running_tasks(self) -> Dict:
         """Obtener todas las tareas en ejecución"""
@@ -384,6 +470,13 @@ class AutomationManager:
     
     def cancel_task(self, task_id: str) -> Dict:
         """Cancelar una tarea en ejecución"""
+        future = self.task_futures.get(task_id)
+        if future is not None and future.cancel():
+            # Aún en cola: no llegará a ejecutarse
+            self.running_tasks[task_id]["status"] = "cancelled"
+            self.running_tasks[task_id]["end_time"] = datetime.now()
+            self._archive_task(task_id)
+            return {"success": True, "message": f"Tarea {task_id} cancelada"}
         if task_id in self.running_tasks:
             self.running_tasks[task_id]["status"] = "cancelled"
             self.running_tasks[task_id]["end_time"] = datetime.now()
@@ -395,7 +488,7 @@ class AutomationManager:
         """Limpiar tareas completadas del historial"""
         # Mantener solo las tareas más recientes
         if len(self.task_history) > max_history:
-            self.task_history = self.task_history[-max_history:]
+            self.task_history = deque(list(self.task_history)[-max_history:], maxlen=self.task_history.maxlen)
         
         # Limpiar tareas completadas de running_tasks
         completed_tasks = [
@@ -0,0 +1,173 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+class TTLCache:
+    """Caché LRU acotada con caducidad por entrada y contadores de uso"""
+
+    def __init__(self, max_entries: int = 1024, default_ttl: float = 300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # clave -> (valor, caduca_en)
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Devolver el valor vigente o None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self.entries[key]
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """Guardar un valor, desalojando el menos usado si se supera el límite"""
+        ttl = self.default_ttl if ttl is None else ttl
+        with self.lock:
+            self.entries[key] = (value, self.clock() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Eliminar una entrada"""
+        with self.lock:
+            if self.entries.pop(key, None) is None:
+                return False
+            self.counters["invalidations"] += 1
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.counters["invalidations"] += len(self.entries)
+            self.entries.clear()
+
+    def dump(self) -> List:
+        """Entradas vigentes como [clave, valor, caduca_en] (para persistir con reloj de pared)"""
+        now = self.clock()
+        with self.lock:
+            return [[key, value, expires_at] for key, (value, expires_at) in self.entries.items()
+                    if expires_at > now]
+
+    def load(self, entries: List):
+        """Restaurar entradas volcadas con dump(), descartando las caducadas"""
+        now = self.clock()
+        with self.lock:
+            for key, value, expires_at in entries:
+                if expires_at > now:
+                    self.entries[key] = (value, expires_at)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """Contadores de aciertos, fallos y desalojos"""
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class BinaryProductCache:
+    """Caché de fichas de Binary por EAN con caducidad distinta para cada campo"""
+
+    def __init__(self, field_ttls: Dict[str, float], default_ttl: float,
+                 max_entries: int = 5000, clock=time.monotonic):
+        self.field_ttls = field_ttls
+        self.default_ttl = default_ttl
+        self.clock = clock
+        # Cada entrada guarda {campo: (valor, caduca_en)}; la entrada vive lo que su campo más duradero
+        self.cache = TTLCache(max_entries, max(list(field_ttls.values()) + [default_ttl]), clock)
+        self.cache.counters["partial_hits"] = 0
+
+    def _ttl(self, field: str) -> float:
+        return self.field_ttls.get(field, self.default_ttl)
+
+    def get(self, ean: str, fields: List[str]) -> Dict:
+        """Devolver los campos vigentes y la lista de los que hay que volver a consultar"""
+        now = self.clock()
+        product_info = {"ean": ean}
+        missing = []
+        with self.cache.lock:
+            entry = self.cache.entries.get(ean)
+            if entry is not None and entry[1] <= now:
+                del self.cache.entries[ean]
+                self.cache.counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.cache.counters["misses"] += 1
+                return {"product_info": {}, "missing": list(fields)}
+
+            self.cache.entries.move_to_end(ean)
+            for field in fields:
+                cached = entry[0].get(field)
+                if cached is None or cached[1] <= now:
+                    missing.append(field)
+                else:
+                    product_info[field] = cached[0]
+
+            # Acierto parcial: la ficha está pero algún campo (p. ej. el stock) ha caducado
+            self.cache.counters["partial_hits" if missing else "hits"] += 1
+        return {"product_info": product_info, "missing": missing}
+
+    def missing_fields(self, ean: str, fields: List[str]) -> List[str]:
+        """Campos sin valor vigente, sin contar como consulta ni alterar el orden LRU"""
+        now = self.clock()
+        with self.cache.lock:
+            entry = self.cache.entries.get(ean)
+            if entry is None or entry[1] <= now:
+                return list(fields)
+            return [field for field in fields
+                    if entry[0].get(field) is None or entry[0][field][1] <= now]
+
+    def put(self, ean: str, product_info: Dict, fields: List[str] = None):
+        """Guardar (o completar) la ficha de un EAN"""
+        now = self.clock()
+        fields = fields or [field for field in product_info if field != "ean"]
+        with self.cache.lock:
+            existing = self.cache.entries.get(ean)
+            fields_cache = dict(existing[0]) if existing else {}
+        for field in fields:
+            if field in product_info:
+                fields_cache[field] = (product_info[field], now + self._ttl(field))
+        self.cache.set(ean, fields_cache)
+
+    def invalidate(self, ean: str, fields: List[str] = None) -> bool:
+        """Invalidar la ficha completa o solo algunos campos"""
+        if fields is None:
+            return self.cache.invalidate(ean)
+
+        with self.cache.lock:
+            existing = self.cache.entries.get(ean)
+            if existing is None:
+                return False
+            fields_cache, expires_at = existing
+            self.cache.entries[ean] = (
+                {field: value for field, value in fields_cache.items() if field not in fields},
+                expires_at
+            )
+            self.cache.counters["invalidations"] += 1
+        return True
+
+    def get_stats(self) -> Dict:
+        return self.cache.get_stats()
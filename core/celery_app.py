@@ -0,0 +1,133 @@
+"""Trabajadores Celery para repartir trazas y etapas de pedidos entre puestos.
+
+Cada puesto arranca su trabajador declarando los recursos que tiene, por ejemplo:
+    WORKER_RESOURCES=farmatic,printer celery -A core.celery_app worker --concurrency 1
+y solo consume las colas de las tareas que puede ejecutar.
+"""
+import json
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from celery import Celery
+from kombu import Queue
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PREFIX = "autofarma"
+
+# Recursos que necesita cada etapa de un pedido (los de TraceManager.resources más el Excel del puesto)
+STAGE_RESOURCES = {
+    "lookup": (),
+    "distributors": ("browser",),
+    "farmatic": ("farmatic",),
+    "excel": ("excel",),
+    "print": ("printer",)
+}
+# Una traza completa empieza leyendo la lista de pedidos de Farmatic y los procesa en el mismo puesto
+TRACE_RESOURCES = ("browser", "excel", "farmatic", "printer")
+
+celery_app = Celery(
+    "autofarma",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND
+)
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    task_default_queue=QUEUE_PREFIX,
+    # Un puesto con Farmatic no debe reservar trabajo que otro puesto libre podría hacer ya
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_always_eager=settings.CELERY_ALWAYS_EAGER,
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "queue_order_strategy": "priority",
+        # Una etapa sin confirmar se reparte de nuevo pasado este plazo: nunca antes de que la API deje de esperarla
+        "visibility_timeout": max(settings.CELERY_VISIBILITY_TIMEOUT, 2 * settings.TRACE_DISPATCH_TIMEOUT)
+    }
+)
+
+
+def queue_for(resources: Iterable[str]) -> str:
+    """Cola de las tareas que necesitan exactamente estos recursos"""
+    resources = sorted(set(resources))
+    return f"{QUEUE_PREFIX}.{'+'.join(resources)}" if resources else QUEUE_PREFIX
+
+
+def worker_queues(resources: Iterable[str]) -> List[str]:
+    """Colas que puede consumir un trabajador con estos recursos"""
+    available = set(resources)
+    requirements = list(STAGE_RESOURCES.values()) + [TRACE_RESOURCES]
+    return sorted({queue_for(needed) for needed in requirements if set(needed) <= available})
+
+
+# Un trabajador solo escucha las colas de sus recursos declarados
+celery_app.conf.task_queues = [Queue(name) for name in worker_queues(settings.WORKER_RESOURCES)]
+
+
+def _celery_priority(priority: Optional[float]) -> int:
+    """Prioridad de pedido (número menor = más urgente) en la escala 0-9 del broker"""
+    if priority is None:
+        priority = settings.ORDER_PRIORITY_DEFAULT
+    return int(min(9, max(0, priority)))
+
+
+def json_safe(value):
+    """Copia serializable en JSON (fechas y enumerados como texto)"""
+    return json.loads(json.dumps(value, ensure_ascii=False, default=lambda item: getattr(item, "value", str(item))))
+
+
+# TraceManager del proceso trabajador (se crea al recibir la primera tarea)
+_worker_trace_manager = None
+
+
+def configure_worker(trace_manager):
+    """Usar este TraceManager para las tareas de este proceso"""
+    global _worker_trace_manager
+    _worker_trace_manager = trace_manager
+
+
+def get_worker_trace_manager():
+    global _worker_trace_manager
+    if _worker_trace_manager is None:
+        # Importación diferida: los controladores solo existen en los puestos con Farmatic/impresora
+        from .automation_manager import AutomationManager
+        from .trace_manager import TraceManager
+        _worker_trace_manager = TraceManager(AutomationManager())
+    return _worker_trace_manager
+
+
+@celery_app.task(name="autofarma.run_order_stage")
+def run_order_stage(trace_id: str, config: Dict, state: Dict, stage: str) -> Dict:
+    """Ejecutar una etapa de un pedido y devolver su estado y la etapa siguiente"""
+    return get_worker_trace_manager().run_remote_stage(trace_id, config, state, stage)
+
+
+# Una traza completa puede durar más que cualquier plazo de visibilidad: si se confirmara al final,
+# Redis la entregaría a otro puesto, que repetiría los envíos a Farmatic. Si el puesto cae, se reanuda allí
+# desde sus puntos de control
+@celery_app.task(name="autofarma.run_trace", acks_late=False)
+def run_trace(trace_id: str, config: Dict) -> Dict:
+    """Ejecutar una traza completa en este puesto"""
+    return get_worker_trace_manager().run_remote_trace(trace_id, config)
+
+
+def dispatch_order_stage(trace_id: str, config: Dict, state: Dict, stage: str):
+    """Enviar una etapa a la cola de los puestos que tienen sus recursos"""
+    return run_order_stage.apply_async(
+        args=[trace_id, json_safe(config), json_safe(state), stage],
+        queue=queue_for(STAGE_RESOURCES[stage]),
+        priority=_celery_priority(state.get("priority"))
+    )
+
+
+def dispatch_trace(trace_id: str, config: Dict):
+    """Enviar una traza completa a un puesto con Farmatic"""
+    return run_trace.apply_async(
+        args=[trace_id, json_safe(config)],
+        queue=queue_for(TRACE_RESOURCES),
+        priority=_celery_priority(config.get("priority"))
+    )
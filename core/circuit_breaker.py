@@ -0,0 +1,126 @@
+import time
+import random
+import threading
+from enum import Enum
+from typing import Dict
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Corta las llamadas a un servicio tras varios fallos seguidos y lo vuelve a probar pasado un tiempo"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.stats = {"calls": 0, "successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        """¿Se puede llamar ahora? Con el circuito abierto responde al instante que no"""
+        with self.lock:
+            if self.state is BreakerState.OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    self.stats["rejected"] += 1
+                    return False
+                # Pasado el enfriamiento se deja pasar una prueba
+                self.state = BreakerState.HALF_OPEN
+                self.half_open_calls = 0
+
+            if self.state is BreakerState.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    self.stats["rejected"] += 1
+                    return False
+                self.half_open_calls += 1
+
+            self.stats["calls"] += 1
+            return True
+
+    def fail_fast(self) -> bool:
+        """¿Abierto y todavía enfriándose? Sirve para rechazar antes de reservar recursos para la llamada"""
+        with self.lock:
+            if self.state is BreakerState.OPEN and self.clock() - self.opened_at < self.reset_timeout:
+                self.stats["rejected"] += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.stats["successes"] += 1
+            self.consecutive_failures = 0
+            self.state = BreakerState.CLOSED
+            self.opened_at = None
+
+    def record_failure(self):
+        """Fallo o respuesta demasiado lenta"""
+        with self.lock:
+            self.stats["failures"] += 1
+            self.consecutive_failures += 1
+            if self.state is BreakerState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state is not BreakerState.OPEN:
+                    self.stats["opened"] += 1
+                self.state = BreakerState.OPEN
+                self.opened_at = self.clock()
+
+    def get_status(self) -> Dict:
+        with self.lock:
+            retry_in = None
+            if self.state is BreakerState.OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (self.clock() - self.opened_at)), 3)
+            return {
+                "state": self.state.value,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in_seconds": retry_in,
+                **self.stats
+            }
+
+
+class RetryBudget:
+    """Reintentos limitados a una fracción de las llamadas, con espera exponencial aleatoria entre ellos"""
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0, backoff_base: float = 0.5,
+                 backoff_max: float = 5.0, rng: random.Random = None):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.random = rng or random.Random()
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self):
+        """Cada llamada original aporta una fracción de reintento"""
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Consumir un reintento si queda presupuesto"""
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.denied += 1
+            return False
+
+    def backoff(self, attempt: int) -> float:
+        """Espera antes del reintento número attempt (desde 1): aleatoria entre 0 y el tope exponencial"""
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        with self.lock:
+            return self.random.uniform(0, ceiling)
+
+    def get_status(self) -> Dict:
+        with self.lock:
+            return {"tokens": round(self.tokens, 2), "retries": self.retries, "denied": self.denied}
@@ -0,0 +1,25 @@
+import os
+import sqlite3
+
+from config.settings import settings
+
+def sqlite_path_from_url(database_url: str = None) -> str:
+    """Obtener la ruta del fichero SQLite a partir de una URL sqlite:///"""
+    database_url = database_url or settings.DATABASE_URL
+    prefix = "sqlite:///"
+    if not database_url.startswith(prefix):
+        raise ValueError(f"Solo se admiten URLs SQLite: {database_url}")
+    return database_url[len(prefix):] or ":memory:"
+
+def connect(database_url: str = None) -> sqlite3.Connection:
+    """Abrir una conexión SQLite compartible entre hilos y en modo WAL"""
+    path = sqlite_path_from_url(database_url)
+    if path != ":memory:":
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+    
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
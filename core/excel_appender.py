@@ -0,0 +1,98 @@
+import openpyxl
+from datetime import datetime
+import os
+import threading
+import logging
+from typing import List, Any
+
+class ExcelAppender:
+    """Mantiene un libro Excel abierto; las filas añadidas se guardan al llamar a flush (lo decide el escritor)"""
+
+    def __init__(self, file_path: str, sheet_name: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.file_path = file_path
+        self.sheet_name = sheet_name
+        self.lock = threading.RLock()
+
+        self.workbook = None
+        self.worksheet = None
+        self.next_row = None
+        self.pending_rows = 0
+        self.file_signature = None
+
+    def _file_signature(self):
+        """Firma (mtime, tamaño) del fichero para detectar cambios externos"""
+        try:
+            stat = os.stat(self.file_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _open(self):
+        """Cargar el libro una sola vez y situarse en la próxima fila vacía"""
+        if os.path.exists(self.file_path):
+            self.workbook = openpyxl.load_workbook(self.file_path)
+        else:
+            self.workbook = openpyxl.Workbook()
+
+        if self.sheet_name and self.sheet_name in self.workbook.sheetnames:
+            self.worksheet = self.workbook[self.sheet_name]
+        else:
+            self.worksheet = self.workbook.active
+            if self.sheet_name:
+                self.worksheet.title = self.sheet_name
+
+        # max_row solo se consulta al abrir; después se lleva la cuenta en memoria
+        self.next_row = self.worksheet.max_row + 1
+        self.file_signature = self._file_signature()
+
+    def reload_if_changed(self) -> bool:
+        """Recargar el libro si otro proceso lo ha guardado desde nuestra última escritura"""
+        with self.lock:
+            if self.workbook is None or self.pending_rows:
+                return False
+            if self._file_signature() == self.file_signature:
+                return False
+            self._open()
+            return True
+
+    def append(self, row_data: List[Any]) -> int:
+        """Añadir una fila al búfer y devolver el número de fila asignado"""
+        with self.lock:
+            if self.workbook is None:
+                self._open()
+
+            row_number = self.next_row
+            for col_num, value in enumerate(row_data, 1):
+                cell = self.worksheet.cell(row=row_number, column=col_num)
+                cell.value = value
+
+                # Aplicar formato básico
+                if isinstance(value, (int, float)):
+                    cell.number_format = '#,##0.00'
+                elif isinstance(value, datetime):
+                    cell.number_format = 'DD/MM/YYYY HH:MM'
+
+            self.next_row += 1
+            self.pending_rows += 1
+            return row_number
+
+    def flush(self) -> bool:
+        """Guardar en disco las filas pendientes"""
+        with self.lock:
+            if self.workbook is None or not self.pending_rows:
+                return False
+
+            self.workbook.save(self.file_path)
+            self.file_signature = self._file_signature()
+            self.logger.debug(f"{self.pending_rows} filas guardadas en {self.file_path}")
+            self.pending_rows = 0
+            return True
+
+    def close(self):
+        """Guardar pendientes y liberar el libro"""
+        with self.lock:
+            self.flush()
+            self.workbook = None
+            self.worksheet = None
+            self.next_row = None
@@ -1,16 +1,36 @@
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Border, Side
+from openpyxl.utils import get_column_letter
 import pandas as pd
-from datetime import datetime
+import numpy as np
+from datetime import datetime, date
+from itertools import chain, islice
 import os
 import logging
-from typing import Dict, List, Any
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Any, Iterable
+
+from config.settings import settings
+from .excel_writer import ExcelWriterService, FileLock
+from .excel_rotation import RotationPolicy, ShardManifest
+from .inventory_engine import InventoryEngine
 
 class ExcelManager:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.output_dir = "./output"
         self.ensure_output_dir()
+        self.inventory_engine = InventoryEngine(os.path.join(self.output_dir, "inventario_snapshot.pkl"))
+        
+        # Un hilo escritor por libro: las filas se encolan y se guardan por lotes
+        self.writer = ExcelWriterService(
+            max_batch_rows=settings.EXCEL_APPEND_BATCH_ROWS,
+            flush_interval=settings.EXCEL_APPEND_FLUSH_SECONDS,
+            rotation_resolver=self.get_rotation_policy,
+            max_attempts=settings.EXCEL_WRITE_ATTEMPTS,
+            timeout=settings.EXCEL_WRITER_TIMEOUT
+        )
         
     def ensure_output_dir(self):
         """Crear directorio de salida si no existe"""
@@ -24,46 +44,101 @@ class ExcelManager:
     def insert_row_data(self, file_path: str, row_data: List[Any], sheet_name: str = None) -> Dict:
         """Insertar una serie de datos en una nueva fila"""
         try:
-            # Verificar si el archivo existe
-            if os.path.exists(file_path):
-                workbook = openpyxl.load_workbook(file_path)
-            else:
-                workbook = openpyxl.Workbook()
-                
-            # Seleccionar hoja
-            if sheet_name and sheet_name in workbook.sheetnames:
-                worksheet = workbook[sheet_name]
-            else:
-                worksheet = workbook.active
-                if sheet_name:
-                    worksheet.title = sheet_name
-            
-            # Encontrar la próxima fila vacía
-            next_row = worksheet.max_row + 1
-            
-            # Insertar datos
-            for col_num, value in enumerate(row_data, 1):
-                cell = worksheet.cell(row=next_row, column=col_num)
-                cell.value = value
-                
-                # Aplicar formato básico
-                if isinstance(value, (int, float)):
-                    cell.number_format = '#,##0.00'
-                elif isinstance(value, datetime):
-                    cell.number_format = 'DD/MM/YYYY HH:MM'
+            # El hilo escritor del libro serializa las escrituras concurrentes
+            future = self.writer.submit(file_path, row_data, sheet_name, urgent=True)
+            return future.result(self.writer.timeout)
             
-            # Guardar archivo
-            workbook.save(file_path)
+        except FutureTimeoutError:
+            self.logger.error(f"El escritor de {file_path} no guardó la fila en {self.writer.timeout}s")
+            return {
+                "success": False,
+                "error": f"Tiempo de espera agotado guardando en {file_path}; la fila sigue en cola",
+                "queued": True
+            }
+        except Exception as e:
+            self.logger.error(f"Error insertando datos en Excel: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def enqueue_row(self, file_path: str, row_data: List[Any], sheet_name: str = None) -> Future:
+        """Encolar una fila sin bloquear; el futuro devuelve el número de fila asignado"""
+        return self.writer.submit(file_path, row_data, sheet_name)
+    
+    def append_row(self, file_path: str, row_data: List[Any], sheet_name: str = None) -> Dict:
+        """Añadir una fila sin esperar al guardado (se guarda en lotes)"""
+        try:
+            self.enqueue_row(file_path, row_data, sheet_name)
             
             return {
                 "success": True,
-                "message": f"Datos insertados en fila {next_row}",
+                "message": "Datos encolados para guardado por lotes",
                 "file_path": file_path,
-                "row_number": next_row
+                "queued": True
             }
             
         except Exception as e:
-            self.logger.error(f"Error insertando datos en Excel: {e}")
+            self.logger.error(f"Error añadiendo datos en Excel: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def flush_appenders(self) -> Dict:
+        """Guardar todas las filas encoladas y esperar a que estén en disco"""
+        return self.writer.flush()
+    
+    def close(self) -> Dict:
+        """Guardar pendientes y detener los escritores (llamar al apagar)"""
+        return self.writer.close()
+    
+    def get_rotation_policy(self, file_path: str):
+        """Política de rotación de un libro (None si no se fragmenta)"""
+        if os.path.basename(file_path) not in settings.EXCEL_ROTATED_FILES:
+            return None
+        return RotationPolicy.from_settings(settings)
+    
+    def list_shards(self, file_path: str) -> List[str]:
+        """Fragmentos de un libro lógico (o el propio fichero si no rota)"""
+        policy = self.get_rotation_policy(file_path)
+        if policy is None:
+            return [file_path] if os.path.exists(file_path) else []
+        return [path for path in ShardManifest(file_path, policy).shard_paths() if os.path.exists(path)]
+    
+    def iter_logical_rows(self, file_path: str, sheet_name: str = None) -> Iterable:
+        """Recorrer las filas de todos los fragmentos de un libro en orden"""
+        for shard_path in self.list_shards(file_path):
+            workbook = openpyxl.load_workbook(shard_path, read_only=True)
+            try:
+                if sheet_name and sheet_name in workbook.sheetnames:
+                    worksheet = workbook[sheet_name]
+                else:
+                    worksheet = workbook.active
+                for row in worksheet.iter_rows(values_only=True):
+                    # Saltar filas vacías (la primera fila de cada fragmento queda libre)
+                    if any(value is not None for value in row):
+                        yield row
+            finally:
+                workbook.close()
+    
+    def export_logical_file(self, file_path: str, report_name: str = None,
+                            columns: List[str] = None) -> Dict:
+        """Unir todos los fragmentos de un libro en un único reporte"""
+        self.flush_appenders()
+        return self.create_pharmacy_report_streaming(
+            self.iter_logical_rows(file_path), report_name, columns=columns
+        )
+    
+    def archive_shards(self, file_path: str, before: str) -> Dict:
+        """Archivar los fragmentos cerrados anteriores a una fecha (YYYYMMDD)"""
+        try:
+            policy = self.get_rotation_policy(file_path)
+            if policy is None:
+                return {"success": False, "error": f"{file_path} no tiene rotación configurada"}
+            
+            with FileLock(file_path + ".lock"):
+                archived = ShardManifest(file_path, policy).archive(
+                    before, os.path.join(self.output_dir, "archivo")
+                )
+            return {"success": True, "archived": archived}
+            
+        except Exception as e:
+            self.logger.error(f"Error archivando fragmentos: {e}")
             return {"success": False, "error": str(e)}
     
     def create_pharmacy_report(self, data: List[Dict], report_name: str = None) -> Dict:
@@ -120,28 +195,117 @@ class ExcelManager:
             self.logger.error(f"Error creando reporte: {e}")
             return {"success": False, "error": str(e)}
     
-    def update_inventory_excel(self, product_updates: List[Dict]) -> Dict:
+    def create_pharmacy_report_streaming(self, rows: Iterable, report_name: str = None,
+                                         columns: List[str] = None,
+                                         column_widths: Dict[str, float] = None,
+                                         sample_size: int = 100) -> Dict:
+        """Crear un reporte escribiendo las filas en streaming (memoria constante)"""
+        try:
+            if not report_name:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                report_name = f"reporte_farmacia_{timestamp}.xlsx"
+            
+            file_path = os.path.join(self.output_dir, report_name)
+            
+            # Muestrear las primeras filas para deducir columnas y anchos
+            rows = iter(rows)
+            sample = list(islice(rows, sample_size))
+            
+            if columns is None:
+                columns = self._infer_columns(sample)
+            
+            widths = self._estimate_column_widths(columns, sample)
+            if column_widths:
+                widths.update(column_widths)
+            
+            workbook = openpyxl.Workbook(write_only=True)
+            worksheet = workbook.create_sheet('Reporte')
+            
+            # En modo solo-escritura los anchos deben fijarse antes de la primera fila
+            for col_num, column in enumerate(columns, 1):
+                worksheet.column_dimensions[get_column_letter(col_num)].width = widths[column]
+            
+            header_font = Font(bold=True, color="FFFFFF")
+            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+            header = []
+            for column in columns:
+                cell = WriteOnlyCell(worksheet, value=column)
+                cell.font = header_font
+                cell.fill = header_fill
+                header.append(cell)
+            worksheet.append(header)
+            
+            records_count = 0
+            for row in chain(sample, rows):
+                if isinstance(row, dict):
+                    values = [row.get(column) for column in columns]
+                else:
+                    values = list(row)
+                worksheet.append([self._to_cell_value(value) for value in values])
+                records_count += 1
+            
+            workbook.save(file_path)
+            
+            return {
+                "success": True,
+                "message": "Reporte creado exitosamente",
+                "file_path": file_path,
+                "records_count": records_count
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error creando reporte en streaming: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def _infer_columns(self, sample: List) -> List[str]:
+        """Deducir las columnas a partir de las filas de muestra"""
+        columns = []
+        for row in sample:
+            if isinstance(row, dict):
+                for key in row:
+                    if key not in columns:
+                        columns.append(key)
+            elif len(row) > len(columns):
+                columns.extend(f"Columna_{i}" for i in range(len(columns) + 1, len(row) + 1))
+        return columns
+    
+    def _estimate_column_widths(self, columns: List[str], sample: List) -> Dict[str, float]:
+        """Calcular anchos de columna sobre la muestra (máximo 50)"""
+        widths = {column: len(str(column)) for column in columns}
+        for row in sample:
+            values = [row.get(c) for c in columns] if isinstance(row, dict) else row
+            for column, value in zip(columns, values):
+                widths[column] = max(widths[column], len(str(value)))
+        return {column: min(width + 2, 50) for column, width in widths.items()}
+    
+    def _to_cell_value(self, value: Any) -> Any:
+        """Convertir a un valor que openpyxl pueda escribir"""
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is None or isinstance(value, (str, int, float, bool, datetime, date)):
+            return value
+        return str(value)
+    
+    def update_inventory_excel(self, product_updates: Any, diff_snapshot: bool = True) -> Dict:
         """Actualizar inventario en Excel"""
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            inventory_file = os.path.join(self.output_dir, f"inventario_actualizado_{timestamp}.xlsx")
-            
-            # Crear estructura de datos para inventario
-            inventory_data = []
-            for update in product_updates:
-                inventory_data.append({
-                    'Código': update.get('code', ''),
-                    'Nombre': update.get('name', ''),
-                    'Stock_Anterior': update.get('old_stock', 0),
-                    'Stock_Nuevo': update.get('new_stock', 0),
-                    'Diferencia': update.get('new_stock', 0) - update.get('old_stock', 0),
-                    'Precio': update.get('price', 0),
-                    'Proveedor': update.get('supplier', ''),
-                    'Fecha_Actualización': datetime.now()
-                })
-            
-            return self.create_pharmacy_report(inventory_data, f"inventario_actualizado_{timestamp}.xlsx")
+            report_name = f"inventario_actualizado_{timestamp}.xlsx"
+            
+            # Diferencias, estados y totales calculados por columnas
+            inventory = self.inventory_engine.process(product_updates, diff_snapshot=diff_snapshot)
+            df = inventory["inventory"]
+            
+            result = self.create_pharmacy_report_streaming(
+                df.itertuples(index=False, name=None),
+                report_name,
+                columns=list(df.columns)
+            )
+            if result["success"]:
+                result["supplier_totals"] = inventory["supplier_totals"].to_dict("records")
+            
+            return result
             
         except Exception as e:
             self.logger.error(f"Error actualizando inventario: {e}")
-            return {"success": False, "error": str(e)}
\ No newline at end of file
+            return {"success": False, "error": str(e)}
@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+class RotationPolicy:
+    """Cuándo abrir un nuevo fragmento: por día, por número de filas o por tamaño"""
+
+    def __init__(self, daily: bool = True, max_rows: int = 0, max_bytes: int = 0):
+        self.daily = daily
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_settings(cls, settings) -> Optional["RotationPolicy"]:
+        """Construir la política configurada (None si la rotación está desactivada)"""
+        policy = cls(
+            daily=settings.EXCEL_ROTATION == "daily",
+            max_rows=settings.EXCEL_ROTATION_MAX_ROWS,
+            max_bytes=int(settings.EXCEL_ROTATION_MAX_MB * 1024 * 1024)
+        )
+        return policy if policy.is_enabled() else None
+
+    def is_enabled(self) -> bool:
+        return self.daily or self.max_rows > 0 or self.max_bytes > 0
+
+    def period(self, now: datetime = None) -> Optional[str]:
+        """Periodo al que pertenece una escritura (día) o None sin rotación diaria"""
+        if not self.daily:
+            return None
+        return (now or datetime.now()).strftime("%Y%m%d")
+
+    def needs_rotation(self, shard: Dict, now: datetime = None) -> bool:
+        """Verificar si el fragmento actual ya no admite más filas"""
+        if shard.get("closed"):
+            return True
+        if self.daily and shard.get("period") != self.period(now):
+            return True
+        if self.max_rows and shard.get("rows", 0) >= self.max_rows:
+            return True
+        if self.max_bytes and os.path.exists(shard["path"]):
+            return os.path.getsize(shard["path"]) >= self.max_bytes
+        return False
+
+    def to_dict(self) -> Dict:
+        return {"daily": self.daily, "max_rows": self.max_rows, "max_bytes": self.max_bytes}
+
+
+class ShardManifest:
+    """Manifiesto JSON con los fragmentos de un libro lógico"""
+
+    def __init__(self, logical_path: str, policy: RotationPolicy):
+        self.logger = logging.getLogger(__name__)
+        self.logical_path = logical_path
+        self.policy = policy
+        base, _ = os.path.splitext(logical_path)
+        self.manifest_path = f"{base}.manifest.json"
+        self.shards = []
+        self.load()
+
+    def load(self):
+        """Releer el manifiesto (otro proceso puede haber rotado)"""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.shards = json.load(f).get("shards", [])
+        elif os.path.exists(self.logical_path):
+            # Libro de antes de activar la rotación: sus filas siguen siendo parte del libro lógico
+            self.shards = [self._legacy_shard()]
+        else:
+            self.shards = []
+
+    def _legacy_shard(self) -> Dict:
+        """Fragmento cerrado para el libro sin fragmentar que ya existía"""
+        modified = datetime.fromtimestamp(os.path.getmtime(self.logical_path))
+        return {
+            "path": self.logical_path,
+            "period": None,
+            "created": modified.isoformat(),
+            "closed": True,
+            "legacy": True
+        }
+
+    def save(self):
+        """Guardar el manifiesto de forma atómica"""
+        data = {
+            "logical_path": self.logical_path,
+            "policy": self.policy.to_dict(),
+            "updated": datetime.now().isoformat(),
+            "shards": self.shards
+        }
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def current_shard(self, now: datetime = None) -> Dict:
+        """Fragmento en el que escribir, abriendo uno nuevo si toca rotar"""
+        if self.shards and not self.policy.needs_rotation(self.shards[-1], now):
+            return self.shards[-1]
+
+        if self.shards:
+            self.shards[-1]["closed"] = True
+
+        period = self.policy.period(now)
+        sequence = sum(1 for shard in self.shards if shard.get("period") == period) + 1
+        base, extension = os.path.splitext(self.logical_path)
+        name_parts = [base]
+        if period:
+            name_parts.append(period)
+        if sequence > 1 or not period:
+            name_parts.append(f"{sequence:03d}")
+
+        shard = {
+            "path": "_".join(name_parts) + extension,
+            "period": period,
+            "created": (now or datetime.now()).isoformat(),
+            "rows": 0,
+            "closed": False
+        }
+        self.shards.append(shard)
+        self.logger.info(f"Nuevo fragmento para {self.logical_path}: {shard['path']}")
+        return shard
+
+    def shard_paths(self) -> List[str]:
+        """Rutas de todos los fragmentos en orden de creación"""
+        return [shard["path"] for shard in self.shards]
+
+    def archive(self, before: str, archive_dir: str = None) -> List[str]:
+        """Mover a archivo los fragmentos cerrados anteriores a una fecha (YYYYMMDD)"""
+        archive_dir = archive_dir or os.path.join(os.path.dirname(self.logical_path) or ".", "archivo")
+        if not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+
+        archived = []
+        for shard in self.shards:
+            period = shard.get("period") or shard["created"][:10].replace("-", "")
+            if not shard.get("closed") or shard.get("archived") or period >= before:
+                continue
+            if os.path.exists(shard["path"]):
+                target = os.path.join(archive_dir, os.path.basename(shard["path"]))
+                shutil.move(shard["path"], target)
+                shard["path"] = target
+            shard["archived"] = True
+            archived.append(shard["path"])
+
+        if archived:
+            self.save()
+        return archived
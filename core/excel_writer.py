@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Dict, List, Any
+
+from .excel_appender import ExcelAppender
+from .excel_rotation import RotationPolicy, ShardManifest
+
+class FileLock:
+    """Bloqueo entre procesos mediante un fichero .lock creado de forma exclusiva"""
+
+    def __init__(self, path: str, timeout: float = 30.0, stale_after: float = 120.0):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return
+            except FileExistsError:
+                # Un bloqueo abandonado por un proceso caído no debe parar la escritura
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"No se pudo bloquear {self.path}")
+                time.sleep(0.05)
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class _WorkbookWriter(threading.Thread):
+    """Hilo propietario de un libro: agrupa la cola en guardados por lotes"""
+
+    _STOP = object()
+
+    def __init__(self, file_path: str, max_batch_rows: int, flush_interval: float,
+                 rotation_policy: RotationPolicy = None, max_attempts: int = 3):
+        super().__init__(name=f"excel-writer-{os.path.basename(file_path)}", daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.file_path = file_path
+        self.max_batch_rows = max_batch_rows
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        # Filas que no se pudieron guardar tras todos los intentos; se reintentan al arrancar el escritor
+        self.spill_path = file_path + ".pendientes.jsonl"
+        self.queue = queue.Queue()
+        self.appenders = {}
+        self.manifest = ShardManifest(file_path, rotation_policy) if rotation_policy else None
+
+    def submit(self, row_data: List[Any], sheet_name: str = None, urgent: bool = False) -> Future:
+        future = Future()
+        self.queue.put(("row", (list(row_data), sheet_name, urgent), future))
+        return future
+
+    def flush(self) -> Future:
+        future = Future()
+        self.queue.put(("flush", None, future))
+        return future
+
+    def stop(self):
+        self.queue.put((self._STOP, None, None))
+
+    def run(self):
+        # (fila, futuro, intentos fallidos)
+        pending = self._load_spilled()
+        waiters = []
+        deadline = time.monotonic() if pending else None
+        stopping = False
+
+        while not stopping:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            try:
+                items = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                items = []
+
+            # Tomar todo lo que ya esté encolado sin esperar
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            force = False
+            for kind, payload, future in items:
+                if kind is self._STOP:
+                    stopping = True
+                    force = True
+                elif kind == "flush":
+                    waiters.append(future)
+                    force = True
+                else:
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_interval
+                    pending.append((payload, future, 0))
+                    force = force or payload[2]
+
+            if pending and (force or len(pending) >= self.max_batch_rows
+                            or time.monotonic() >= deadline):
+                # Si el guardado falla, las filas vuelven a la cola para el siguiente lote
+                pending = self._write_batch(pending)
+                if pending:
+                    deadline = time.monotonic() + self.flush_interval
+
+            for future in waiters:
+                future.set_result(not pending)
+            waiters = []
+
+        if pending:
+            self._spill(pending, "escritor detenido con filas sin guardar")
+        for appender in self.appenders.values():
+            appender.close()
+
+    def _write_batch(self, batch: List) -> List:
+        """Escribir y guardar un lote con el fichero bloqueado; devuelve las filas que hay que reintentar"""
+        results = []
+        # Filas del lote ya guardadas en disco (al cambiar de fragmento se guarda el anterior)
+        saved = 0
+        try:
+            with FileLock(self.file_path + ".lock"):
+                if self.manifest:
+                    self.manifest.load()
+
+                current = None
+                for (row_data, sheet_name, _), future, _ in batch:
+                    shard = self.manifest.current_shard() if self.manifest else None
+                    target_path = shard["path"] if shard else self.file_path
+
+                    appender = self._get_appender(target_path, sheet_name)
+                    if appender is not current:
+                        if current is not None:
+                            self._save(current)
+                            saved = len(results)
+                        self._release_other_shards(target_path)
+                        appender.reload_if_changed()
+                        current = appender
+
+                    row_number = appender.append(row_data)
+                    if shard:
+                        shard["rows"] = row_number - 1
+                    results.append((future, target_path, row_number))
+                self._save(current)
+                saved = len(results)
+
+            self.logger.debug(f"{len(batch)} filas guardadas en {self.file_path}")
+            return []
+
+        except Exception as e:
+            # Descartar el estado en memoria: el siguiente lote recarga desde disco
+            for appender in self.appenders.values():
+                appender.pending_rows = 0
+                appender.workbook = None
+            # Las filas ya guardadas no se repiten
+            failed = batch[saved:]
+            retry = [(payload, future, attempts + 1) for payload, future, attempts in failed
+                     if attempts + 1 < self.max_attempts]
+            exhausted = [item for item in failed if item[2] + 1 >= self.max_attempts]
+            self.logger.error(
+                f"Error guardando lote en {self.file_path}: {e} "
+                f"({saved} filas guardadas, {len(retry)} se reintentarán, {len(exhausted)} pasan a {self.spill_path})"
+            )
+            if exhausted:
+                self._spill(exhausted, str(e))
+            return retry
+
+        finally:
+            for future, target_path, row_number in results[:saved]:
+                future.set_result({
+                    "success": True,
+                    "message": f"Datos insertados en fila {row_number}",
+                    "file_path": target_path,
+                    "row_number": row_number
+                })
+
+    def _save(self, appender: ExcelAppender):
+        """Guardar el libro de un fragmento y, con él, el manifiesto"""
+        appender.flush()
+        if self.manifest:
+            self.manifest.save()
+    
+    def _spill(self, rows: List, error: str):
+        """Guardar en el fichero de pendientes las filas que no se pudieron escribir en el libro"""
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for (row_data, sheet_name, _), _, _ in rows:
+                    f.write(json.dumps(
+                        {"row": row_data, "sheet_name": sheet_name, "error": error,
+                         "failed_at": datetime.now().isoformat()},
+                        ensure_ascii=False, default=str
+                    ) + "\n")
+            self.logger.error(f"{len(rows)} filas de {self.file_path} guardadas en {self.spill_path}")
+            result = {"success": False, "error": error, "spilled_to": self.spill_path}
+        except Exception as e:
+            self.logger.critical(f"Filas de {self.file_path} perdidas, no se pudo escribir {self.spill_path}: {e}")
+            result = {"success": False, "error": f"{error}; {e}"}
+        for _, future, _ in rows:
+            if future is not None and not future.done():
+                future.set_result(result)
+    
+    def _load_spilled(self) -> List:
+        """Recuperar las filas de un fallo anterior para volver a intentarlas las primeras"""
+        if not os.path.exists(self.spill_path):
+            return []
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            os.remove(self.spill_path)
+        except Exception as e:
+            self.logger.error(f"Error leyendo filas pendientes de {self.spill_path}: {e}")
+            return []
+        if entries:
+            self.logger.warning(f"Reintentando {len(entries)} filas pendientes de {self.file_path}")
+        return [((entry["row"], entry.get("sheet_name"), False), Future(), 0) for entry in entries]
+
+    def _get_appender(self, file_path: str, sheet_name: str = None) -> ExcelAppender:
+        key = (file_path, sheet_name)
+        appender = self.appenders.get(key)
+        if appender is None:
+            # El hilo decide cuándo guardar; el anexador nunca guarda por su cuenta
+            appender = ExcelAppender(file_path, sheet_name)
+            self.appenders[key] = appender
+        return appender
+
+    def _release_other_shards(self, file_path: str):
+        """Cerrar los libros de fragmentos ya rotados para liberar memoria"""
+        for key in [key for key in self.appenders if key[0] != file_path]:
+            self.appenders.pop(key).close()
+
+
+class ExcelWriterService:
+    """Servicio de escritura única: un hilo escritor por libro de salida"""
+
+    def __init__(self, max_batch_rows: int = 50, flush_interval: float = 5.0,
+                 rotation_resolver=None, max_attempts: int = 3, timeout: float = 30.0):
+        self.logger = logging.getLogger(__name__)
+        self.max_batch_rows = max_batch_rows
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        # Espera máxima de flush y close (al apagar no se puede quedar colgado)
+        self.timeout = timeout
+        # Función ruta -> RotationPolicy (o None) para los libros que se fragmentan
+        self.rotation_resolver = rotation_resolver
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def _get_writer(self, file_path: str) -> _WorkbookWriter:
+        key = os.path.abspath(file_path)
+        with self.lock:
+            writer = self.writers.get(key)
+            if writer is None or not writer.is_alive():
+                rotation_policy = self.rotation_resolver(file_path) if self.rotation_resolver else None
+                writer = _WorkbookWriter(
+                    file_path, self.max_batch_rows, self.flush_interval, rotation_policy, self.max_attempts
+                )
+                writer.start()
+                self.writers[key] = writer
+            return writer
+
+    def submit(self, file_path: str, row_data: List[Any], sheet_name: str = None,
+               urgent: bool = False) -> Future:
+        """Encolar una fila sin bloquear; el futuro devuelve la fila asignada tras guardar"""
+        return self._get_writer(file_path).submit(row_data, sheet_name, urgent)
+
+    def flush(self, timeout: float = None) -> Dict:
+        """Forzar el guardado de todo lo encolado y esperar a que termine (como mucho timeout segundos)"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            writers = list(self.writers.values())
+        flushes = [(writer, writer.flush()) for writer in writers if writer.is_alive()]
+        unsaved = []
+        for writer, future in flushes:
+            try:
+                if not future.result(max(0.0, deadline - time.monotonic())):
+                    unsaved.append(writer.file_path)
+            except FutureTimeoutError:
+                unsaved.append(writer.file_path)
+        if unsaved:
+            self.logger.error(f"Libros con filas sin guardar tras {timeout}s: {unsaved}")
+            return {"success": False, "error": f"Filas sin guardar en {unsaved}", "unsaved_files": unsaved}
+        return {"success": True, "flushed_files": [writer.file_path for writer in writers]}
+
+    def close(self, timeout: float = None) -> Dict:
+        """Guardar pendientes y detener los hilos escritores (como mucho timeout segundos)"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            writers = list(self.writers.values())
+            self.writers.clear()
+        for writer in writers:
+            writer.stop()
+        for writer in writers:
+            writer.join(max(0.0, deadline - time.monotonic()))
+        unsaved = [writer.file_path for writer in writers if writer.is_alive()]
+        if unsaved:
+            self.logger.error(f"Escritores de Excel sin terminar tras {timeout}s: {unsaved}")
+            return {"success": False, "error": f"Filas sin guardar en {unsaved}", "unsaved_files": unsaved}
+        return {"success": True, "flushed_files": [writer.file_path for writer in writers]}
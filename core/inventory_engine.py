@@ -0,0 +1,131 @@
+import pandas as pd
+import numpy as np
+from datetime import datetime
+import os
+import logging
+from typing import Dict, List, Any, Optional, Union
+
+# Campo de entrada -> columna del reporte de inventario
+INVENTORY_COLUMNS = {
+    'code': 'Código',
+    'name': 'Nombre',
+    'old_stock': 'Stock_Anterior',
+    'new_stock': 'Stock_Nuevo',
+    'price': 'Precio',
+    'supplier': 'Proveedor'
+}
+
+INVENTORY_DEFAULTS = {
+    'code': '',
+    'name': '',
+    'old_stock': 0,
+    'new_stock': 0,
+    'price': 0,
+    'supplier': ''
+}
+
+# Orden de columnas del reporte de inventario; las columnas añadidas por el motor van al final
+REPORT_COLUMNS = [
+    'Código', 'Nombre', 'Stock_Anterior', 'Stock_Nuevo', 'Diferencia',
+    'Precio', 'Proveedor', 'Fecha_Actualización'
+]
+
+SNAPSHOT_COLUMNS = ['Código', 'Stock_Nuevo', 'Precio', 'Proveedor']
+
+class InventoryEngine:
+    """Cálculo vectorizado de diferencias de inventario sobre catálogos completos"""
+
+    def __init__(self, snapshot_path: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.snapshot_path = snapshot_path or "./output/inventario_snapshot.pkl"
+
+    def to_frame(self, product_updates: Union[pd.DataFrame, Dict[str, List], List[Dict]]) -> pd.DataFrame:
+        """Convertir la entrada (columnar, registros o DataFrame) al esquema del inventario"""
+        if isinstance(product_updates, pd.DataFrame):
+            df = product_updates.copy()
+        elif isinstance(product_updates, dict):
+            df = pd.DataFrame(product_updates)
+        else:
+            df = pd.DataFrame.from_records(product_updates)
+
+        # Mantener si la entrada traía stock anterior antes de rellenar con el valor por defecto
+        has_old_stock = df['old_stock'].notna() if 'old_stock' in df else pd.Series(False, index=df.index)
+
+        for field, default in INVENTORY_DEFAULTS.items():
+            if field not in df:
+                df[field] = default
+            else:
+                df[field] = df[field].fillna(default)
+
+        df = df[list(INVENTORY_COLUMNS)].rename(columns=INVENTORY_COLUMNS)
+        df['Código'] = df['Código'].astype(str)
+        for column in ('Stock_Anterior', 'Stock_Nuevo', 'Precio'):
+            df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0)
+        df['_tiene_stock_anterior'] = has_old_stock.to_numpy()
+        return df
+
+    def compute(self, df: pd.DataFrame, previous: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Calcular diferencias, estado y valoración en operaciones por columna"""
+        if previous is not None and not previous.empty:
+            snapshot_stock = previous.set_index('Código')['Stock_Nuevo']
+            snapshot_stock = snapshot_stock[~snapshot_stock.index.duplicated(keep='last')]
+            df['Stock_Snapshot'] = df['Código'].map(snapshot_stock)
+
+            # Sin stock anterior explícito se toma el de la última sincronización
+            use_snapshot = ~df['_tiene_stock_anterior'] & df['Stock_Snapshot'].notna()
+            df['Stock_Anterior'] = df['Stock_Anterior'].where(~use_snapshot, df['Stock_Snapshot'])
+            df['Nuevo_Producto'] = df['Stock_Snapshot'].isna()
+            df['Stock_Snapshot'] = df['Stock_Snapshot'].fillna(0)
+
+        df = df.drop(columns='_tiene_stock_anterior')
+        df['Diferencia'] = df['Stock_Nuevo'] - df['Stock_Anterior']
+        df['Valor_Diferencia'] = df['Diferencia'] * df['Precio']
+        df['Estado'] = np.select(
+            [df['Stock_Nuevo'] <= 0, df['Diferencia'] > 0, df['Diferencia'] < 0],
+            ['agotado', 'sube', 'baja'],
+            default='sin_cambio'
+        )
+        # Una sola marca de tiempo para toda la sincronización
+        df['Fecha_Actualización'] = datetime.now()
+        return df[REPORT_COLUMNS + [column for column in df.columns if column not in REPORT_COLUMNS]]
+
+    def supplier_totals(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Totales por proveedor"""
+        return df.groupby('Proveedor', sort=True).agg(
+            Productos=('Código', 'size'),
+            Stock_Nuevo=('Stock_Nuevo', 'sum'),
+            Diferencia=('Diferencia', 'sum'),
+            Valor_Diferencia=('Valor_Diferencia', 'sum'),
+            Agotados=('Estado', lambda estado: int((estado == 'agotado').sum()))
+        ).reset_index()
+
+    def load_snapshot(self) -> Optional[pd.DataFrame]:
+        """Cargar el inventario de la sincronización anterior"""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            return pd.read_pickle(self.snapshot_path)
+        except Exception as e:
+            self.logger.error(f"Error cargando snapshot de inventario: {e}")
+            return None
+
+    def save_snapshot(self, df: pd.DataFrame, previous: Optional[pd.DataFrame] = None):
+        """Guardar el inventario actual como referencia para la próxima sincronización;
+        los productos que no vienen en esta actualización conservan su fila anterior"""
+        directory = os.path.dirname(self.snapshot_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        snapshot = df[SNAPSHOT_COLUMNS]
+        if previous is not None and not previous.empty:
+            kept = previous[~previous['Código'].isin(snapshot['Código'])]
+            snapshot = pd.concat([kept[SNAPSHOT_COLUMNS], snapshot], ignore_index=True)
+        snapshot.drop_duplicates('Código', keep='last').to_pickle(self.snapshot_path)
+
+    def process(self, product_updates: Any, diff_snapshot: bool = True) -> Dict[str, pd.DataFrame]:
+        """Procesar una sincronización (completa o parcial) y actualizar el snapshot"""
+        df = self.to_frame(product_updates)
+        previous = self.load_snapshot()
+        df = self.compute(df, previous if diff_snapshot else None)
+        totals = self.supplier_totals(df)
+        self.save_snapshot(df, previous)
+        return {"inventory": df, "supplier_totals": totals}
@@ -0,0 +1,201 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Iterator, Optional
+
+from config.settings import settings
+from .cache import TTLCache
+from .database import connect
+
+# Columnas del libro de pedidos procesados (mismo orden que _compile_order_data_for_excel)
+LEDGER_COLUMNS = [
+    "Fecha", "Pedido", "Cantidad", "EAN", "CN", "Descripción",
+    "Tipo", "Proveedor", "Precio", "Observaciones"
+]
+
+class OrderLedger:
+    """Registro de pedidos procesados en SQLite con exportación a Excel bajo demanda"""
+
+    def __init__(self, database_url: str = None, index_cache_entries: int = None):
+        self.logger = logging.getLogger(__name__)
+        self.database_url = database_url
+        self.lock = threading.Lock()
+        self.connection = connect(database_url)
+        self._create_schema()
+        
+        # Entradas recientes de order_index (pedido, EAN) -> ubicación y estado; el resto se consulta
+        # por clave primaria, así la memoria no crece con el histórico de pedidos
+        self.index = TTLCache(
+            max_entries=settings.ORDER_INDEX_CACHE_ENTRIES if index_cache_entries is None else index_cache_entries,
+            default_ttl=float("inf")
+        )
+
+    def _create_schema(self):
+        """Crear la tabla del libro si no existe"""
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS processed_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    processed_at TEXT NOT NULL,
+                    order_id TEXT,
+                    quantity NUMERIC,
+                    ean TEXT,
+                    cn TEXT,
+                    description TEXT,
+                    completion_type TEXT,
+                    supplier TEXT,
+                    price NUMERIC,
+                    notes TEXT
+                )
+            """)
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_processed_orders_date ON processed_orders (processed_at)"
+            )
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS order_index (
+                    order_id TEXT NOT NULL,
+                    ean TEXT NOT NULL,
+                    ledger_id INTEGER,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (order_id, ean)
+                )
+            """)
+            self.connection.commit()
+
+    def _index_entry(self, key: tuple) -> Optional[Dict]:
+        """Entrada del índice desde la caché o, si no está, desde order_index (llamar con el lock tomado)"""
+        entry = self.index.get(key)
+        if entry is None:
+            row = self.connection.execute(
+                "SELECT ledger_id, status, updated_at FROM order_index WHERE order_id = ? AND ean = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            entry = {"ledger_id": row[0], "status": row[1], "updated_at": row[2]}
+            self.index.set(key, entry)
+        return entry
+
+    def _upsert_index(self, order_id: str, ean: str, ledger_id: Optional[int], status: str):
+        """Actualizar la entrada del índice (llamar con el lock tomado)"""
+        updated_at = datetime.now().isoformat()
+        self.connection.execute(
+            "INSERT INTO order_index (order_id, ean, ledger_id, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (order_id, ean) DO UPDATE SET "
+            "ledger_id = COALESCE(excluded.ledger_id, ledger_id), "
+            "status = excluded.status, updated_at = excluded.updated_at",
+            (order_id, ean, ledger_id, status, updated_at)
+        )
+        entry = self._index_entry((order_id, ean)) or {}
+        self.index.set((order_id, ean), {
+            "ledger_id": ledger_id if ledger_id is not None else entry.get("ledger_id"),
+            "status": status,
+            "updated_at": updated_at
+        })
+
+    def append(self, row_data: List[Any], ean: str = None) -> Dict:
+        """Añadir una fila al libro (coste constante) y marcar el pedido como completado"""
+        try:
+            values = list(row_data) + [None] * (len(LEDGER_COLUMNS) - len(row_data))
+            if isinstance(values[0], datetime):
+                values[0] = values[0].isoformat()
+
+            with self.lock:
+                cursor = self.connection.execute(
+                    "INSERT INTO processed_orders (processed_at, order_id, quantity, ean, cn, "
+                    "description, completion_type, supplier, price, notes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values[:len(LEDGER_COLUMNS)]
+                )
+                ledger_id = cursor.lastrowid
+                order_id = values[1]
+                if order_id:
+                    self._upsert_index(str(order_id), str(ean or values[3] or ""), ledger_id, "completed")
+                self.connection.commit()
+
+            return {"success": True, "ledger_id": ledger_id}
+
+        except Exception as e:
+            self.logger.error(f"Error registrando pedido en el libro: {e}")
+            return {"success": False, "error": str(e)}
+
+    def record_status(self, order_id: str, ean: str, status: str) -> Dict:
+        """Registrar en el índice el resultado de un pedido que no llegó al libro"""
+        try:
+            key = (str(order_id), str(ean or ""))
+            with self.lock:
+                # Un pedido completado no vuelve atrás por un reintento fallido
+                if (self._index_entry(key) or {}).get("status") == "completed":
+                    return {"success": True, "status": "completed"}
+                self._upsert_index(key[0], key[1], None, status)
+                self.connection.commit()
+            return {"success": True, "status": status}
+
+        except Exception as e:
+            self.logger.error(f"Error actualizando índice de pedidos: {e}")
+            return {"success": False, "error": str(e)}
+
+    def lookup(self, order_id: str, ean: str = None) -> Optional[Dict]:
+        """Consultar el índice para un pedido (y EAN)"""
+        with self.lock:
+            entry = self._index_entry((str(order_id), str(ean or "")))
+        return dict(entry) if entry is not None else None
+
+    def is_completed(self, order_id: str, ean: str = None) -> bool:
+        """Indicar si un pedido ya quedó procesado en una traza anterior"""
+        entry = self.lookup(order_id, ean)
+        return entry is not None and entry["status"] == "completed"
+
+    def iter_rows(self, date_from: str = None, date_to: str = None) -> Iterator[List[Any]]:
+        """Recorrer las filas del libro en orden de inserción (fechas ISO, date_to inclusive)"""
+        query = ("SELECT processed_at, order_id, quantity, ean, cn, description, "
+                 "completion_type, supplier, price, notes FROM processed_orders")
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("processed_at >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("processed_at <= ?")
+            # Una fecha sin hora incluye el día completo, como en las alertas
+            params.append(date_to if "T" in date_to else f"{date_to}T23:59:59.999999")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id"
+
+        # Conexión propia para no bloquear las inserciones mientras se exporta
+        connection = connect(self.database_url)
+        try:
+            for row in connection.execute(query, params):
+                row = list(row)
+                try:
+                    row[0] = datetime.fromisoformat(row[0])
+                except (TypeError, ValueError):
+                    pass
+                yield row
+        finally:
+            connection.close()
+
+    def count(self) -> int:
+        """Número de pedidos registrados"""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM processed_orders").fetchone()[0]
+
+    def export_to_excel(self, excel_manager, report_name: str = None,
+                        date_from: str = None, date_to: str = None) -> Dict:
+        """Generar el Excel de pedidos procesados en una sola pasada"""
+        if not report_name:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            report_name = f"pedidos_procesados_{timestamp}.xlsx"
+
+        return excel_manager.create_pharmacy_report_streaming(
+            self.iter_rows(date_from, date_to),
+            report_name,
+            columns=LEDGER_COLUMNS
+        )
+
+    def close(self):
+        """Cerrar la conexión"""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,123 @@
+import time
+import heapq
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from config.settings import settings
+
+class AgingPriorityQueue:
+    """Cola por prioridad (número menor = más urgente) en la que esperar también cuenta:
+    cada PRIORITY_AGING_SECONDS en cola equivalen a subir un nivel, así nada se queda sin atender"""
+
+    def __init__(self, aging_seconds: float = None, clock=time.monotonic):
+        self.aging_seconds = settings.PRIORITY_AGING_SECONDS if aging_seconds is None else aging_seconds
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def sort_key(self, priority: float, enqueued_at: float = None) -> float:
+        """Instante de llegada adelantado según la prioridad: la clave no cambia mientras espera"""
+        if priority == float("inf"):
+            return priority
+        enqueued_at = self.clock() if enqueued_at is None else enqueued_at
+        return enqueued_at + priority * self.aging_seconds
+
+    def put(self, item: Any, priority: float = None, enqueued_at: float = None):
+        priority = settings.ORDER_PRIORITY_DEFAULT if priority is None else priority
+        with self.condition:
+            # El contador desempata por orden de llegada sin comparar los elementos
+            heapq.heappush(self.heap, (self.sort_key(priority, enqueued_at), next(self.counter), item))
+            self.condition.notify()
+
+    def get(self, block: bool = True, timeout: float = None) -> Any:
+        with self.condition:
+            if not block:
+                if not self.heap:
+                    raise queue.Empty
+            elif not self.condition.wait_for(lambda: self.heap, timeout):
+                raise queue.Empty
+            return heapq.heappop(self.heap)[2]
+
+    def get_nowait(self) -> Any:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        with self.condition:
+            return len(self.heap)
+
+
+class PriorityExecutor:
+    """ThreadPoolExecutor que atiende primero el trabajo más urgente (con envejecimiento)"""
+
+    _STOP = object()
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "priority", aging_seconds: float = None):
+        self.max_workers = max(1, max_workers)
+        self.thread_name_prefix = thread_name_prefix
+        self.queue = AgingPriorityQueue(aging_seconds)
+        self.threads = []
+        self.idle = 0
+        self.lock = threading.Lock()
+        self.shutting_down = False
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Encolar con la prioridad por defecto (compatible con ThreadPoolExecutor.submit)"""
+        return self.submit_with_priority(None, fn, *args, **kwargs)
+
+    def submit_with_priority(self, priority: float, fn: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        with self.lock:
+            if self.shutting_down:
+                raise RuntimeError("No se pueden encolar tareas tras apagar el ejecutor")
+            self.queue.put((future, fn, args, kwargs), priority)
+            # Como ThreadPoolExecutor: se crean hilos bajo demanda hasta el máximo
+            if self.idle == 0 and len(self.threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._worker, name=f"{self.thread_name_prefix}_{len(self.threads)}", daemon=True
+                )
+                self.threads.append(thread)
+                thread.start()
+            else:
+                self.idle = max(0, self.idle - 1)
+        return future
+
+    def _worker(self):
+        while True:
+            work = self.queue.get()
+            if work is self._STOP:
+                return
+            future, fn, args, kwargs = work
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self.lock:
+                self.idle += 1
+
+    def pending(self) -> int:
+        """Trabajos en cola sin empezar"""
+        return self.queue.qsize()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        with self.lock:
+            self.shutting_down = True
+            threads = list(self.threads)
+        if cancel_futures:
+            while True:
+                try:
+                    work = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if work is not self._STOP:
+                    work[0].cancel()
+        for _ in threads:
+            # Detrás de todo lo pendiente: prioridad infinita
+            self.queue.put(self._STOP, float("inf"))
+        if wait:
+            for thread in threads:
+                thread.join()
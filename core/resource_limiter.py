@@ -0,0 +1,82 @@
+import time
+import heapq
+import itertools
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict
+
+from config.settings import settings
+
+class _ResourceSlots:
+    """Plazas de un recurso y cola de espera ordenada por prioridad"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.waiters = []  # (clave de prioridad, turno)
+        self.condition = threading.Condition()
+
+class ResourceLimiter:
+    """Limita cuántos hilos usan a la vez cada recurso compartido (GUI, navegador, HTTP...).
+    Cuando hay espera, la plaza libre va al más urgente (número menor), con envejecimiento"""
+
+    def __init__(self, limits: Dict[str, int], aging_seconds: float = None, clock=time.monotonic):
+        self.logger = logging.getLogger(__name__)
+        self.limits = dict(limits)
+        self.slots = {name: _ResourceSlots(limit) for name, limit in limits.items()}
+        self.aging_seconds = settings.PRIORITY_AGING_SECONDS if aging_seconds is None else aging_seconds
+        self.clock = clock
+        self.turns = itertools.count()
+        # Prioridad del trabajo que ejecuta cada hilo
+        self.context = threading.local()
+
+    @contextmanager
+    def priority(self, value: float):
+        """Las plazas pedidas dentro del bloque usan esta prioridad"""
+        previous = getattr(self.context, "priority", None)
+        self.context.priority = value
+        try:
+            yield
+        finally:
+            self.context.priority = previous
+
+    def current_priority(self) -> float:
+        """Prioridad del trabajo del hilo actual"""
+        priority = getattr(self.context, "priority", None)
+        return settings.ORDER_PRIORITY_DEFAULT if priority is None else priority
+
+    @contextmanager
+    def acquire(self, resource: str, priority: float = None):
+        """Ocupar una plaza del recurso mientras dura el bloque"""
+        slots = self.slots.get(resource)
+        if slots is None:
+            # Recurso sin límite configurado
+            yield
+            return
+
+        if priority is None:
+            priority = self.current_priority()
+
+        with slots.condition:
+            ticket = (self.clock() + priority * self.aging_seconds, next(self.turns))
+            heapq.heappush(slots.waiters, ticket)
+            slots.condition.wait_for(lambda: slots.in_use < slots.limit and slots.waiters[0] == ticket)
+            heapq.heappop(slots.waiters)
+            slots.in_use += 1
+            # Si quedan plazas, que el siguiente en la cola lo compruebe
+            slots.condition.notify_all()
+        try:
+            yield
+        finally:
+            with slots.condition:
+                slots.in_use -= 1
+                slots.condition.notify_all()
+
+    def get_status(self) -> Dict:
+        """Plazas configuradas, ocupadas y en espera por recurso"""
+        status = {}
+        for name, slots in self.slots.items():
+            with slots.condition:
+                status[name] = {"limit": slots.limit, "in_use": slots.in_use, "waiting": len(slots.waiters)}
+        return status
@@ -0,0 +1,137 @@
+import time
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .priority_scheduler import AgingPriorityQueue
+
+class StagePipeline:
+    """Etapas encadenadas, cada una con su cola y sus trabajadores: mientras un elemento
+    ocupa una etapa, el siguiente ya avanza por las anteriores"""
+
+    _STOP = object()
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Optional[str]], int]],
+                 on_done: Callable[[Any], None] = None, name: str = "pipeline",
+                 priority: Callable[[Any], float] = None):
+        # stages: (nombre, función, trabajadores); la función devuelve la siguiente etapa o None al terminar
+        self.stages = stages
+        self.on_done = on_done
+        self.name = name
+        # Con prioridad, cada etapa atiende antes lo más urgente (contando lo que lleva esperando)
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.stats = {
+            stage_name: {"workers": workers, "items": 0, "busy_seconds": 0.0, "max_queue": 0}
+            for stage_name, _, workers in stages
+        }
+
+    def run(self, items: List[Any]) -> Dict:
+        """Pasar todos los elementos por las etapas y esperar a que terminen"""
+        if not items:
+            return self.get_stats(0.0)
+
+        if self.priority:
+            queues = {stage_name: AgingPriorityQueue() for stage_name, _, _ in self.stages}
+        else:
+            queues = {stage_name: queue.Queue() for stage_name, _, _ in self.stages}
+        remaining = [len(items)]
+        finished = threading.Event()
+        failure = []
+        started = time.monotonic()
+        # La espera se cuenta desde la entrada en la primera etapa
+        entered_at = {}
+        
+        def enqueue(stage_name, item):
+            if self.priority:
+                queues[stage_name].put(item, self.priority(item), entered_at[id(item)])
+            else:
+                queues[stage_name].put(item)
+
+        def complete(item, processed=True):
+            try:
+                if self.on_done and processed:
+                    self.on_done(item)
+            except BaseException as e:
+                with self.lock:
+                    failure.append(e)
+            finally:
+                with self.lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        finished.set()
+
+        def worker(stage_name, func):
+            stage_queue = queues[stage_name]
+            while True:
+                item = stage_queue.get()
+                if item is self._STOP:
+                    return
+                # Tras un fallo grave no se empieza trabajo nuevo; solo se vacían las colas
+                if failure:
+                    complete(item, processed=False)
+                    continue
+
+                busy_from = time.monotonic()
+                try:
+                    next_stage = func(item)
+                except BaseException as e:
+                    with self.lock:
+                        failure.append(e)
+                    complete(item, processed=False)
+                    continue
+                finally:
+                    with self.lock:
+                        stats = self.stats[stage_name]
+                        stats["items"] += 1
+                        stats["busy_seconds"] += time.monotonic() - busy_from
+
+                if next_stage:
+                    enqueue(next_stage, item)
+                    with self.lock:
+                        stats = self.stats[next_stage]
+                        stats["max_queue"] = max(stats["max_queue"], queues[next_stage].qsize())
+                else:
+                    complete(item)
+
+        threads = []
+        for stage_name, func, workers in self.stages:
+            for index in range(max(1, workers)):
+                thread = threading.Thread(
+                    target=worker, args=(stage_name, func),
+                    name=f"{self.name}-{stage_name}-{index}", daemon=True
+                )
+                thread.start()
+                threads.append((stage_name, thread))
+
+        first_stage = self.stages[0][0]
+        for item in items:
+            entered_at[id(item)] = time.monotonic()
+            enqueue(first_stage, item)
+
+        finished.wait()
+        for stage_name, _ in threads:
+            queues[stage_name].put(self._STOP)
+        for _, thread in threads:
+            thread.join()
+
+        if failure:
+            raise failure[0]
+        return self.get_stats(time.monotonic() - started)
+
+    def get_stats(self, elapsed: float) -> Dict:
+        """Elementos, tiempo ocupado y ocupación de cada etapa"""
+        with self.lock:
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "stages": {
+                    stage_name: {
+                        **stats,
+                        "busy_seconds": round(stats["busy_seconds"], 3),
+                        # Fracción del tiempo en que los trabajadores de la etapa estuvieron ocupados
+                        "utilization": round(stats["busy_seconds"] / (elapsed * stats["workers"]), 3)
+                        if elapsed else 0.0
+                    }
+                    for stage_name, stats in self.stats.items()
+                }
+            }
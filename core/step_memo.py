@@ -0,0 +1,40 @@
+import copy
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+class StepMemo:
+    """Resultados de pasos compartidos por producto dentro de una misma traza"""
+
+    def __init__(self):
+        self.results = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.counters = {"computed": 0, "reused": 0}
+
+    def _key_lock(self, key: Hashable) -> threading.Lock:
+        with self.lock:
+            key_lock = self.key_locks.get(key)
+            if key_lock is None:
+                key_lock = self.key_locks[key] = threading.Lock()
+            return key_lock
+
+    def run(self, key: Hashable, func: Callable[[], Dict]) -> Dict:
+        """Ejecutar el paso una vez por clave; los demás pedidos reciben una copia del resultado"""
+        # Un pedido con la misma clave en otro hilo espera a que termine el primero
+        with self._key_lock(key):
+            if key in self.results:
+                with self.lock:
+                    self.counters["reused"] += 1
+                return copy.deepcopy(self.results[key])
+
+            result = func()
+            with self.lock:
+                self.counters["computed"] += 1
+            # Los fallos no se comparten: el siguiente pedido vuelve a intentarlo
+            if result.get("success"):
+                self.results[key] = copy.deepcopy(result)
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.counters, "keys": len(self.results)}
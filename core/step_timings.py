@@ -0,0 +1,79 @@
+import math
+import threading
+from typing import Dict
+
+class LatencyHistogram:
+    """Histograma de latencias con cubetas logarítmicas: memoria fija y percentiles con ~5% de error"""
+
+    MIN_SECONDS = 0.0001
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.buckets = {}  # índice de cubeta -> número de muestras
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.min = None
+
+    def _bucket(self, seconds: float) -> int:
+        if seconds <= self.MIN_SECONDS:
+            return 0
+        return int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1
+
+    def _bucket_value(self, index: int) -> float:
+        """Punto medio (geométrico) de la cubeta"""
+        if index == 0:
+            return self.MIN_SECONDS
+        return self.MIN_SECONDS * self.GROWTH ** (index - 0.5)
+
+    def record(self, seconds: float):
+        index = self._bucket(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.min = seconds if self.min is None else min(self.min, seconds)
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Nunca fuera del rango realmente observado
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "p99": round(self.percentile(99), 4),
+            "max": round(self.max, 4),
+            "total": round(self.total, 4)
+        }
+
+
+class StepTimings:
+    """Latencias por paso de la traza (segundos)"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, step: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(step)
+            if histogram is None:
+                histogram = self.histograms[step] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Resumen por paso, del más costoso en tiempo total al menos"""
+        with self.lock:
+            summaries = {step: histogram.summary() for step, histogram in self.histograms.items()}
+        return dict(sorted(summaries.items(), key=lambda item: -item[1]["total"]))
@@ -0,0 +1,88 @@
+import os
+import time
+import runpy
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from config.settings import settings
+
+class SupplierRanker:
+    """Elección de proveedor por prioridad y margen mínimo (config/supplier_priorities.py)"""
+
+    UNKNOWN_PRIORITY = 999
+
+    def __init__(self, config_path: str = None, check_interval: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.config_path = config_path or settings.SUPPLIER_CONFIG_PATH
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.config_signature = None
+        self.next_check = 0.0
+        self.priorities = {}
+        self.minimum_margins = {}
+        self.reload()
+
+    def _signature(self):
+        stat = os.stat(self.config_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self) -> bool:
+        """Cargar prioridades y márgenes; si el fichero no es válido se conserva la tabla anterior"""
+        try:
+            signature = self._signature()
+            config = runpy.run_path(self.config_path)
+            priorities = dict(config.get("SUPPLIER_PRIORITIES", {}))
+            minimum_margins = {name: float(margin) for name, margin in config.get("MINIMUM_MARGINS", {}).items()}
+            names = set(priorities) | set(minimum_margins)
+        except Exception as e:
+            self.logger.error(f"Error cargando prioridades de proveedores: {e}")
+            return False
+
+        # Se sustituyen las referencias de una vez; los rankings en curso usan la tabla anterior
+        with self.lock:
+            self.priorities = priorities
+            self.minimum_margins = minimum_margins
+            self.config_signature = signature
+        self.logger.info(f"Prioridades de proveedores cargadas: {len(names)} proveedores")
+        return True
+
+    def _maybe_reload(self):
+        """Recargar si el fichero de configuración ha cambiado (como mucho una comprobación por intervalo)"""
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.check_interval
+        try:
+            changed = self._signature() != self.config_signature
+        except OSError:
+            return
+        if changed:
+            self.reload()
+
+    def rank(self, suppliers: List[Dict]) -> Optional[Dict]:
+        """Mejor proveedor de un pedido: margen mínimo cumplido, menor prioridad y mayor margen"""
+        self._maybe_reload()
+        priorities = self.priorities
+        minimum_margins = self.minimum_margins
+
+        eligible = [
+            supplier for supplier in suppliers or []
+            if (supplier.get("margin") or 0) >= minimum_margins.get(supplier.get("name", ""), 0)
+        ]
+        return min(
+            eligible,
+            key=lambda supplier: (
+                priorities.get(supplier.get("name", ""), self.UNKNOWN_PRIORITY),
+                -(supplier.get("margin") or 0)
+            ),
+            default=None
+        )
+
+    def get_status(self) -> Dict:
+        """Configuración cargada actualmente"""
+        return {
+            "config_path": self.config_path,
+            "priorities": dict(self.priorities),
+            "minimum_margins": dict(self.minimum_margins)
+        }
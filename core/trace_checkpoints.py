@@ -0,0 +1,240 @@
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from .database import connect
+
+# Claves de configuración que nunca se guardan en disco
+CREDENTIAL_MARKERS = ("password", "passwd", "credential", "secret", "token", "api_key", "apikey")
+
+# Estados de pedido que no se repiten al reanudar una traza
+FINISHED_ORDER_STATUSES = ("completed", "requires_human_intervention")
+
+def strip_credentials(value: Any) -> Any:
+    """Copia de una configuración sin usuarios, contraseñas ni tokens"""
+    if isinstance(value, dict):
+        return {
+            key: strip_credentials(item) for key, item in value.items()
+            if not any(marker in str(key).lower() for marker in CREDENTIAL_MARKERS)
+        }
+    if isinstance(value, (list, tuple)):
+        return [strip_credentials(item) for item in value]
+    return value
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+class TraceCheckpointStore:
+    """Puntos de control de trazas en SQLite: pasos por pedido y resultados reutilizables"""
+
+    def __init__(self, database_url: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.connection = connect(database_url)
+        # (trace_id, order_key) -> (paso en curso, hora): se escriben en el siguiente commit
+        self._pending_steps = {}
+        self._create_schema()
+
+    def _create_schema(self):
+        """Crear las tablas de puntos de control si no existen"""
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS trace_runs (
+                    trace_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    orders TEXT,
+                    started_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS trace_orders (
+                    trace_id TEXT NOT NULL,
+                    order_key TEXT NOT NULL,
+                    current_step TEXT,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (trace_id, order_key)
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS trace_step_results (
+                    trace_id TEXT NOT NULL,
+                    order_key TEXT NOT NULL,
+                    step TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    recorded_at TEXT NOT NULL,
+                    PRIMARY KEY (trace_id, order_key, step)
+                )
+            """)
+            self.connection.commit()
+
+    def start_trace(self, trace_id: str, config: Dict, status: str):
+        """Registrar (o reabrir al reanudar) una traza con su configuración sin credenciales"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO trace_runs (trace_id, status, config, started_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (trace_id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                (trace_id, status, _dumps(strip_credentials(config)), now, now)
+            )
+            self.connection.commit()
+
+    def save_orders(self, trace_id: str, orders: List[Dict]):
+        """Guardar la lista de pedidos para no volver a pedirla a Farmatic al reanudar"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE trace_runs SET orders = ?, updated_at = ? WHERE trace_id = ?",
+                (_dumps(orders), datetime.now().isoformat(), trace_id)
+            )
+            self.connection.commit()
+
+    def finish_trace(self, trace_id: str, status: str):
+        with self.lock:
+            self._write_pending_steps()
+            self.connection.execute(
+                "UPDATE trace_runs SET status = ?, updated_at = ? WHERE trace_id = ?",
+                (status, datetime.now().isoformat(), trace_id)
+            )
+            self.connection.commit()
+
+    def record_step(self, trace_id: str, order_key: str, step: str):
+        """Anotar el paso en curso de un pedido (se guarda con el siguiente resultado o estado final)"""
+        with self.lock:
+            self._pending_steps[(trace_id, order_key)] = (step, datetime.now().isoformat())
+
+    def _write_pending_steps(self):
+        """Escribir en la transacción actual los pasos en curso anotados (con el lock tomado)"""
+        if not self._pending_steps:
+            return
+        self.connection.executemany(
+            "INSERT INTO trace_orders (trace_id, order_key, current_step, status, updated_at) "
+            "VALUES (?, ?, ?, 'in_progress', ?) "
+            "ON CONFLICT (trace_id, order_key) DO UPDATE SET "
+            "current_step = excluded.current_step, updated_at = excluded.updated_at",
+            [(trace_id, order_key, step, updated_at)
+             for (trace_id, order_key), (step, updated_at) in self._pending_steps.items()]
+        )
+        self._pending_steps.clear()
+
+    def flush(self):
+        """Guardar los pasos en curso pendientes"""
+        with self.lock:
+            if self._pending_steps:
+                self._write_pending_steps()
+                self.connection.commit()
+
+    def save_step_result(self, trace_id: str, order_key: str, step: str, result: Dict):
+        """Guardar el resultado de un paso terminado para no repetirlo al reanudar"""
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO trace_step_results (trace_id, order_key, step, result, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (trace_id, order_key, step, _dumps(result), datetime.now().isoformat())
+            )
+            self._write_pending_steps()
+            self.connection.commit()
+
+    def finish_order(self, trace_id: str, order_key: str, status: str, result: Dict):
+        """Guardar el estado final de un pedido"""
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO trace_orders (trace_id, order_key, status, result, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (trace_id, order_key) DO UPDATE SET "
+                "status = excluded.status, result = excluded.result, updated_at = excluded.updated_at",
+                (trace_id, order_key, status, _dumps(result), datetime.now().isoformat())
+            )
+            self._write_pending_steps()
+            self.connection.commit()
+
+    def load_trace(self, trace_id: str) -> Optional[Dict]:
+        """Recuperar lo necesario para reanudar una traza"""
+        self.flush()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, config, orders, started_at, updated_at FROM trace_runs WHERE trace_id = ?",
+                (trace_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            order_rows = self.connection.execute(
+                "SELECT order_key, current_step, status, result FROM trace_orders WHERE trace_id = ?",
+                (trace_id,)
+            ).fetchall()
+            step_rows = self.connection.execute(
+                "SELECT order_key, step, result FROM trace_step_results WHERE trace_id = ?",
+                (trace_id,)
+            ).fetchall()
+
+        status, config, orders, started_at, updated_at = row
+        step_results = {}
+        for order_key, step, result in step_rows:
+            step_results.setdefault(order_key, {})[step] = json.loads(result)
+
+        return {
+            "trace_id": trace_id,
+            "status": status,
+            "config": json.loads(config),
+            "orders": json.loads(orders) if orders else None,
+            "started_at": started_at,
+            "updated_at": updated_at,
+            "order_states": {
+                order_key: {
+                    "current_step": current_step,
+                    "status": order_status,
+                    "result": json.loads(result) if result else None
+                }
+                for order_key, current_step, order_status, result in order_rows
+            },
+            "step_results": step_results
+        }
+
+    def list_traces(self, exclude_status: str = None) -> List[Dict]:
+        """Trazas registradas con su avance por pedido"""
+        self.flush()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT r.trace_id, r.status, r.started_at, r.updated_at, "
+                "SUM(CASE WHEN o.status IN (?, ?) THEN 1 ELSE 0 END), COUNT(o.order_key) "
+                "FROM trace_runs r LEFT JOIN trace_orders o ON o.trace_id = r.trace_id "
+                "WHERE r.status != ? GROUP BY r.trace_id ORDER BY r.started_at",
+                (*FINISHED_ORDER_STATUSES, exclude_status or "")
+            ).fetchall()
+        return [
+            {
+                "trace_id": trace_id,
+                "status": status,
+                "started_at": started_at,
+                "updated_at": updated_at,
+                "finished_orders": finished or 0,
+                "started_orders": started
+            }
+            for trace_id, status, started_at, updated_at, finished, started in rows
+        ]
+
+    def purge(self, max_age_seconds: float, keep: List[str] = ()) -> int:
+        """Borrar las trazas (con sus pedidos y pasos) sin cambios desde hace más de max_age_seconds"""
+        cutoff = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        with self.lock:
+            expired = [
+                trace_id for (trace_id,) in self.connection.execute(
+                    "SELECT trace_id FROM trace_runs WHERE updated_at < ?", (cutoff,)
+                ) if trace_id not in keep
+            ]
+            for table in ("trace_step_results", "trace_orders", "trace_runs"):
+                self.connection.executemany(
+                    f"DELETE FROM {table} WHERE trace_id = ?", [(trace_id,) for trace_id in expired]
+                )
+            self.connection.commit()
+        return len(expired)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
@@ -1,7 +1,24 @@
 import logging
+import threading
+import time
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config.settings import settings
+from .order_ledger import OrderLedger
+from .resource_limiter import ResourceLimiter
+from .cache import BinaryProductCache
+from .step_memo import StepMemo
+from .step_timings import StepTimings
+from .supplier_ranker import SupplierRanker
+from .stage_pipeline import StagePipeline
+from .alert_log import AlertLog
+from .priority_scheduler import PriorityExecutor
+from .celery_app import dispatch_order_stage, dispatch_trace, json_safe
+from .trace_checkpoints import TraceCheckpointStore, FINISHED_ORDER_STATUSES, strip_credentials
+from .trace_retention import OrderOutcome, TraceSummary, TraceRetention
 
 class TraceStatus(Enum):
     PENDING = "pending"
@@ -17,6 +34,7 @@ class TraceStep(Enum):
     CHECK_OWN_STOCK = "check_own_stock"
     CHECK_STOCK_LEVEL = "check_stock_level"
     CHECK_CN_EXISTS = "check_cn_exists"
+    ACTIBIOS_PURCHASE = "actibios_purchase"
     SEARCH_DISTRIBUTORS = "search_distributors"
     REGISTER_PRODUCT_FARMATIC = "register_product_farmatic"
     ADD_PROMOFARMA_WALLET = "add_promofarma_wallet"
@@ -29,31 +47,228 @@ class TraceStep(Enum):
     PRINT_DOCUMENTS = "print_documents"
 
 class TraceManager:
+    BINARY_FIELDS = ["own_stock", "cn", "description", "iva", "laboratory", "family"]
+    OUTCOME_LISTS = ("processed_orders", "failed_orders", "human_intervention_required", "skipped_orders")
+    # Datos de diagnóstico que se conservan en el resumen de una traza terminada
+    SUMMARY_DETAILS = ("run_start_time", "prefetch", "coalesced", "resumed_from", "pipeline", "remote_task_id")
+    # Etapas de un pedido: consulta, web, Farmatic, registro e impresión
+    ORDER_STAGES = ("lookup", "distributors", "farmatic", "excel", "print")
+    
     def __init__(self, automation_manager):
         self.logger = logging.getLogger(__name__)
         self.automation_manager = automation_manager
         self.active_traces = {}
-        self.completed_traces = []
-        self.supplier_priorities = {}  # Se cargará desde configuración
+        # Trazas terminadas, compactas y acotadas; las antiguas se guardan en disco
+        self.completed_traces = TraceRetention(
+            max_traces=settings.TRACE_RETENTION_MAX_TRACES,
+            max_age_seconds=settings.TRACE_RETENTION_MAX_AGE
+        )
+        # Prioridades y márgenes mínimos de config/supplier_priorities.py (se recargan al cambiar)
+        self.supplier_ranker = SupplierRanker()
+        self.order_ledger = OrderLedger()
         
-    def start_full_trace(self, config: Dict) -> Dict:
-        """Iniciar una traza completa desde lista de pedidos"""
-        trace_id = f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        # Plazas por recurso compartido entre los pedidos que se procesan en paralelo
+        self.resources = ResourceLimiter({
+            "farmatic": settings.FARMATIC_SLOTS,
+            "browser": settings.BROWSER_SESSIONS,
+            "binary_http": settings.BINARY_HTTP_SLOTS,
+            "printer": settings.PRINTER_SLOTS
+        })
+        
+        # Fichas de Binary: el stock caduca pronto, los datos maestros tardan en cambiar
+        static_ttl = settings.BINARY_CACHE_STATIC_TTL
+        self.binary_cache = BinaryProductCache(
+            field_ttls={
+                "own_stock": settings.BINARY_CACHE_STOCK_TTL,
+                "cn": static_ttl, "description": static_ttl, "iva": static_ttl,
+                "laboratory": static_ttl, "family": static_ttl
+            },
+            default_ttl=settings.BINARY_CACHE_STOCK_TTL,
+            max_entries=settings.BINARY_CACHE_MAX_ENTRIES
+        )
+        
+        # Consultas simultáneas a distribuidores (cada una ocupa una sesión de navegador)
+        self.distributor_executor = PriorityExecutor(
+            max_workers=settings.DISTRIBUTOR_FANOUT_WORKERS, thread_name_prefix="distributor"
+        )
+        
+        # Las trazas lanzadas desde la API se ejecutan en segundo plano, las más urgentes primero
+        self.trace_executor = PriorityExecutor(
+            max_workers=settings.TRACE_BACKGROUND_WORKERS, thread_name_prefix="trace"
+        )
+        self.progress_lock = threading.Lock()
+        # (trace_data, order) del pedido que procesa cada hilo, para marcar pasos
+        self._order_context = threading.local()
+        # Pasos compartidos por EAN/CN de cada traza en curso
+        self._trace_memos = {}
+        
+        # Puntos de control en disco para reanudar trazas interrumpidas
+        self.checkpoints = TraceCheckpointStore() if settings.TRACE_CHECKPOINTS else None
+        # trace_id -> pedidos terminados y resultados de pasos recuperados al reanudar
+        self._resume_states = {}
+        
+        # Alertas de factor humano (escritura en segundo plano, consultables por fecha, pedido o producto)
+        self.alert_log = AlertLog()
+        
+        # Latencias por paso: globales y por traza
+        self.step_timings = StepTimings()
+        self.trace_timings = {}
+        
+        # Sin esta purga los puntos de control y el archivo de trazas crecen sin límite
+        self.purge_trace_history()
+        # Barrido periódico: recoger trazas remotas terminadas y caducar las antiguas aunque no lleguen nuevas
+        self._sweep_stop = threading.Event()
+        self._sweep_thread = None
+        if settings.TRACE_SWEEP_SECONDS > 0:
+            self._sweep_thread = threading.Thread(target=self._run_sweeps, name="trace-sweep", daemon=True)
+            self._sweep_thread.start()
         
+    def _create_trace(self, config: Dict, status: TraceStatus, trace_id: str = None) -> Dict:
+        """Registrar una nueva traza en active_traces"""
+        trace_id = trace_id or f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        trace_data = {
+            "trace_id": trace_id,
+            "status": status,
+            "start_time": datetime.now(),
+            "current_step": TraceStep.GET_ORDER_LIST,
+            "orders": [],
+            "processed_orders": [],
+            "failed_orders": [],
+            "human_intervention_required": [],
+            "skipped_orders": [],
+            "progress": {"total": 0, "done": 0},
+            "config": config
+        }
+        self.active_traces[trace_id] = trace_data
+        self.trace_timings[trace_id] = StepTimings()
+        return trace_data
+    
+    def start_trace_async(self, config: Dict) -> Dict:
+        """Lanzar una traza en segundo plano y devolver su identificador al momento"""
         try:
-            trace_data = {
+            trace_data = self._create_trace(config, TraceStatus.PENDING)
+            trace_id = trace_data["trace_id"]
+            trace_data["future"] = self.trace_executor.submit_with_priority(
+                self._trace_priority(trace_data), self._process_trace, trace_id
+            )
+            
+            return {
+                "success": True,
+                "trace_id": trace_id,
+                "status": TraceStatus.PENDING.value
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error lanzando traza: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def start_trace_remote(self, config: Dict) -> Dict:
+        """Enviar una traza completa a un trabajador Celery con Farmatic; el estado se recoge al consultarla"""
+        trace_id = None
+        try:
+            trace_data = self._create_trace(config, TraceStatus.PENDING)
+            trace_id = trace_data["trace_id"]
+            trace_data["remote"] = dispatch_trace(trace_id, config)
+            trace_data["remote_task_id"] = trace_data["remote"].id
+            
+            return {
+                "success": True,
                 "trace_id": trace_id,
-                "status": TraceStatus.IN_PROGRESS,
-                "start_time": datetime.now(),
-                "current_step": TraceStep.GET_ORDER_LIST,
-                "orders": [],
-                "processed_orders": [],
-                "failed_orders": [],
-                "human_intervention_required": [],
-                "config": config
+                "task_id": trace_data["remote_task_id"],
+                "status": TraceStatus.PENDING.value
             }
             
-            self.active_traces[trace_id] = trace_data
+        except Exception as e:
+            if trace_id:
+                self.active_traces.pop(trace_id, None)
+            self.logger.error(f"Error enviando traza a un trabajador: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def run_remote_trace(self, trace_id: str, config: Dict) -> Dict:
+        """Ejecutar en este trabajador una traza enviada con start_trace_remote"""
+        # Los pedidos se procesan aquí mismo: esperar a otras tareas desde una tarea puede bloquear la cola
+        self._create_trace({**config, "dispatch": "local"}, TraceStatus.IN_PROGRESS, trace_id=trace_id)
+        result = self._process_trace(trace_id)
+        return json_safe({
+            "result": result,
+            "trace": self.get_trace_status(trace_id),
+            "timings": (self.get_trace_timings(trace_id) or {}).get("steps", {})
+        })
+    
+    def run_remote_stage(self, trace_id: str, config: Dict, state: Dict, stage: str) -> Dict:
+        """Ejecutar en este trabajador una etapa de un pedido repartido por _process_orders_distributed;
+        los pasos, sus tiempos y sus resultados vuelven a la API en lugar de quedarse en este puesto"""
+        trace_data = {"trace_id": trace_id, "config": config, "current_step": TraceStep.GET_ORDER_LIST}
+        report = {"timings": [], "step_results": {}, "current_step": None,
+                  "resumed_steps": state.get("resumed_steps") or {}}
+        self._order_context.remote = report
+        try:
+            next_stage = self._run_order_stage(trace_data, state, stage)
+        finally:
+            self._order_context.remote = None
+        
+        return json_safe({
+            "state": state,
+            "next_stage": next_stage,
+            "timings": report["timings"],
+            "step_results": report["step_results"],
+            "current_step": report["current_step"]
+        })
+    
+    def _merge_remote_stage(self, trace_data: Dict, order: Dict, reply: Dict):
+        """Incorporar a la traza de la API lo que un trabajador hizo en una etapa: tiempos, paso y puntos de control"""
+        trace_id = trace_data["trace_id"]
+        for step, seconds in reply.get("timings", []):
+            self._record_timing(trace_id, TraceStep(step), seconds)
+        
+        current_step = reply.get("current_step")
+        if current_step:
+            trace_data["current_step"] = TraceStep(current_step)
+        
+        if self.checkpoints:
+            order_key = self._order_key(order)
+            for step, result in reply.get("step_results", {}).items():
+                self.checkpoints.save_step_result(trace_id, order_key, step, result)
+            if current_step:
+                self.checkpoints.record_step(trace_id, order_key, current_step)
+    
+    def _collect_remote_trace(self, trace_id: str):
+        """Incorporar el resultado de una traza remota cuando su trabajador la termina"""
+        trace_data = self.active_traces.get(trace_id)
+        remote = trace_data.get("remote") if trace_data else None
+        if remote is None or not remote.ready():
+            return
+        
+        # La consulta de estado y el barrido periódico pueden llegar a la vez: solo uno la recoge
+        if trace_data.pop("remote", None) is None:
+            return
+        timings = None
+        try:
+            reply = remote.get(timeout=0)
+            trace = reply["trace"] or {}
+            timings = reply.get("timings")
+            trace_data["status"] = TraceStatus(trace.get("status", TraceStatus.FAILED.value))
+            trace_data["error"] = trace.get("error")
+            for key in self.OUTCOME_LISTS:
+                trace_data[key] = [OrderOutcome(**outcome) for outcome in trace.get(key, [])]
+            progress = trace.get("progress", {})
+            trace_data["progress"] = {"total": progress.get("total", 0), "done": progress.get("done", 0)}
+            if progress.get("current_step"):
+                trace_data["current_step"] = TraceStep(progress["current_step"])
+            if trace.get("end_time"):
+                trace_data["end_time"] = datetime.fromisoformat(trace["end_time"])
+        except Exception as e:
+            trace_data["status"] = TraceStatus.FAILED
+            trace_data["error"] = str(e)
+            trace_data["end_time"] = datetime.now()
+        # Los tiempos por paso se midieron en el trabajador; llegan ya resumidos
+        self._retire_trace(trace_id, timings=timings)
+    
+    def start_full_trace(self, config: Dict) -> Dict:
+        """Iniciar una traza completa desde lista de pedidos"""
+        try:
+            trace_data = self._create_trace(config, TraceStatus.IN_PROGRESS)
+            trace_id = trace_data["trace_id"]
             
             # Iniciar procesamiento
             result = self._process_trace(trace_id)
@@ -68,120 +283,635 @@ class TraceManager:
             self.logger.error(f"Error iniciando traza: {e}")
             return {"success": False, "error": str(e)}
     
+    def resume_trace(self, trace_id: str, config_overrides: Dict = None, run_async: bool = True) -> Dict:
+        """Reanudar una traza interrumpida desde sus puntos de control"""
+        try:
+            if not self.checkpoints:
+                return {"success": False, "error": "Los puntos de control están desactivados"}
+            
+            active = self.active_traces.get(trace_id)
+            if active and active["status"] in (TraceStatus.PENDING, TraceStatus.IN_PROGRESS):
+                return {"success": False, "error": f"La traza {trace_id} sigue en curso"}
+            
+            saved = self.checkpoints.load_trace(trace_id)
+            if saved is None:
+                return {"success": False, "error": f"Traza {trace_id} no encontrada"}
+            if saved["status"] == TraceStatus.COMPLETED.value:
+                return {"success": False, "error": f"La traza {trace_id} ya está completada"}
+            
+            # Las credenciales no se guardan: el llamante las vuelve a aportar si hacen falta
+            config = {**saved["config"], **(config_overrides or {})}
+            self._resume_states[trace_id] = {
+                "orders": saved["orders"],
+                "finished": {
+                    order_key: state["result"] for order_key, state in saved["order_states"].items()
+                    if state["status"] in FINISHED_ORDER_STATUSES and state["result"]
+                },
+                "step_results": saved["step_results"],
+                # Pedidos que empezaron en esta traza: el índice puede darlos por hechos antes de imprimir
+                "started": set(saved["order_states"]) | set(saved["step_results"])
+            }
+            
+            trace_data = self._create_trace(config, TraceStatus.PENDING, trace_id=trace_id)
+            trace_data["resumed_from"] = saved["updated_at"]
+            
+            if run_async:
+                trace_data["future"] = self.trace_executor.submit_with_priority(
+                    self._trace_priority(trace_data), self._process_trace, trace_id
+                )
+                return {"success": True, "trace_id": trace_id, "status": TraceStatus.PENDING.value}
+            
+            result = self._process_trace(trace_id)
+            return {"success": True, "trace_id": trace_id, "initial_result": result}
+            
+        except Exception as e:
+            self._resume_states.pop(trace_id, None)
+            self.logger.error(f"Error reanudando traza {trace_id}: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def list_resumable_traces(self) -> List[Dict]:
+        """Trazas con puntos de control que no llegaron a completarse"""
+        if not self.checkpoints:
+            return []
+        return [
+            trace for trace in self.checkpoints.list_traces(exclude_status=TraceStatus.COMPLETED.value)
+            if trace["trace_id"] not in self.active_traces
+            or self.active_traces[trace["trace_id"]]["status"] not in (TraceStatus.PENDING, TraceStatus.IN_PROGRESS)
+        ]
+    
     def _process_trace(self, trace_id: str) -> Dict:
         """Procesar una traza completa"""
         trace_data = self.active_traces[trace_id]
+        trace_data["status"] = TraceStatus.IN_PROGRESS
+        trace_data["run_start_time"] = datetime.now()
+        resume_state = self._resume_states.get(trace_id)
+        if self.checkpoints:
+            self.checkpoints.start_trace(trace_id, trace_data["config"], TraceStatus.IN_PROGRESS.value)
         
         try:
-            # Paso 1: Obtener lista de pedidos
-            orders_result = self._get_order_list(trace_data)
+            # Paso 1: Obtener lista de pedidos (al reanudar, la guardada en el punto de control)
+            if resume_state and resume_state["orders"] is not None:
+                orders_result = {"success": True, "orders": resume_state["orders"]}
+            else:
+                started = time.perf_counter()
+                orders_result = self._get_order_list(trace_data)
+                self._record_timing(trace_id, TraceStep.GET_ORDER_LIST, time.perf_counter() - started)
             if not orders_result["success"]:
+                trace_data["status"] = TraceStatus.FAILED
+                trace_data["error"] = orders_result.get("error")
+                trace_data["end_time"] = datetime.now()
+                self._finish_checkpoint(trace_id, TraceStatus.FAILED)
                 return orders_result
             
             trace_data["orders"] = orders_result["orders"]
+            if self.checkpoints and not resume_state:
+                self.checkpoints.save_orders(trace_id, trace_data["orders"])
+            skip_processed = trace_data["config"].get("skip_processed", True)
             
-            # Procesar cada pedido
+            pending_orders = []
             for order in trace_data["orders"]:
-                order_result = self._process_single_order(trace_data, order)
-                
-                if order_result["status"] == "completed":
-                    trace_data["processed_orders"].append(order_result)
-                elif order_result["status"] == "failed":
-                    trace_data["failed_orders"].append(order_result)
-                elif order_result["status"] == "requires_human_intervention":
-                    trace_data["human_intervention_required"].append(order_result)
+                order_key = self._order_key(order)
+                finished = resume_state["finished"].get(order_key) if resume_state else None
+                if finished:
+                    # Terminado antes de la interrupción: se conserva su resultado
+                    self._record_order_result(trace_data, order, finished)
+                elif resume_state and order_key in resume_state["started"]:
+                    # A medias: repite los pasos guardados y hace los que faltan
+                    pending_orders.append(order)
+                elif skip_processed and self._is_already_processed(order):
+                    ean = self._extract_ean_from_order(order)
+                    index_entry = self.order_ledger.lookup(order.get("id"), ean) or {}
+                    trace_data["skipped_orders"].append(OrderOutcome(
+                        order_id=order.get("id"), ean=ean, status="skipped", quantity=order.get("quantity"),
+                        reason="already_processed", ledger_id=index_entry.get("ledger_id")
+                    ))
+                else:
+                    pending_orders.append(order)
+            
+            trace_data["progress"]["total"] = len(pending_orders)
+            # Urgentes primero; a igual prioridad se respeta el orden de Farmatic
+            pending_orders.sort(key=lambda order: self._order_priority(trace_data, order))
+            
+            # Resolver en bloque las fichas de Binary antes de decidir pedido a pedido
+            if trace_data["config"].get("prefetch_binary", settings.BINARY_PREFETCH):
+                trace_data["prefetch"] = self._prefetch_binary_products(pending_orders)
+            
+            # Agrupar pedidos del mismo producto para hacer una sola vez los pasos comunes
+            if trace_data["config"].get("coalesce_products", settings.TRACE_COALESCE_PRODUCTS):
+                self._trace_memos[trace_id] = StepMemo()
+                eans = [self._extract_ean_from_order(order) for order in pending_orders]
+                trace_data["coalesced"] = {
+                    "orders": len(pending_orders),
+                    "products": len(set(ean for ean in eans if ean))
+                }
+            
+            # Procesar cada pedido (en paralelo si la configuración lo permite)
+            max_workers = trace_data["config"].get("max_workers", settings.TRACE_MAX_WORKERS)
+            if trace_data["config"].get("dispatch", settings.TRACE_DISPATCH) == "celery" and pending_orders:
+                order_results = self._process_orders_distributed(trace_data, pending_orders)
+            elif trace_data["config"].get("pipeline", settings.TRACE_PIPELINE) and len(pending_orders) > 1:
+                order_results = self._process_orders_pipelined(trace_data, pending_orders)
+            elif max_workers > 1 and len(pending_orders) > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    order_results = list(executor.map(
+                        lambda order: self._process_single_order(trace_data, order), pending_orders
+                    ))
+            else:
+                order_results = [self._process_single_order(trace_data, order) for order in pending_orders]
+            
+            # Registrar en el orden de la lista para que el resultado sea determinista
+            for order, order_result in zip(pending_orders, order_results):
+                self._record_order_result(trace_data, order, order_result)
+            
+            memo = self._trace_memos.pop(trace_id, None)
+            if memo:
+                trace_data["coalesced"]["shared_steps"] = memo.get_stats()
             
             # Finalizar traza
             trace_data["status"] = TraceStatus.COMPLETED
             trace_data["end_time"] = datetime.now()
+            self._finish_checkpoint(trace_id, TraceStatus.COMPLETED)
             
             return {
                 "success": True,
                 "processed": len(trace_data["processed_orders"]),
                 "failed": len(trace_data["failed_orders"]),
-                "human_intervention": len(trace_data["human_intervention_required"])
+                "human_intervention": len(trace_data["human_intervention_required"]),
+                "skipped": len(trace_data["skipped_orders"])
             }
             
         except Exception as e:
+            self._trace_memos.pop(trace_id, None)
             trace_data["status"] = TraceStatus.FAILED
             trace_data["error"] = str(e)
+            self._finish_checkpoint(trace_id, TraceStatus.FAILED)
             self.logger.error(f"Error procesando traza {trace_id}: {e}")
             return {"success": False, "error": str(e)}
+        
+        finally:
+            self._retire_trace(trace_id)
     
-    def _process_single_order(self, trace_data: Dict, order: Dict) -> Dict:
-        """Procesar un pedido individual siguiendo la traza completa"""
-        order_id = order.get("id", "unknown")
-        quantity = order.get("quantity", 0)
+    def _retire_trace(self, trace_id: str, timings: Dict = None):
+        """Pasar una traza terminada a su resumen compacto y liberar el detalle en memoria"""
+        trace_data = self.active_traces.get(trace_id)
+        if trace_data is None:
+            return
+        
+        if timings is None:
+            trace_timings = self.trace_timings.get(trace_id)
+            timings = trace_timings.snapshot() if trace_timings else {}
+        summary = TraceSummary(
+            trace_id=trace_id,
+            status=trace_data["status"],
+            start_time=trace_data["start_time"],
+            end_time=trace_data.get("end_time") or datetime.now(),
+            config=strip_credentials(trace_data["config"]),
+            progress=self._progress_snapshot(trace_data),
+            error=trace_data.get("error"),
+            details={key: trace_data[key] for key in self.SUMMARY_DETAILS if key in trace_data},
+            outcomes={key: list(trace_data[key]) for key in self.OUTCOME_LISTS},
+            timings=timings
+        )
         
+        # Primero el resumen, para que la traza nunca desaparezca de las consultas
+        spilled = self.completed_traces.add(summary)
+        self.active_traces.pop(trace_id, None)
+        self.trace_timings.pop(trace_id, None)
+        if spilled:
+            self.logger.debug(f"Trazas pasadas a disco: {spilled}")
+    
+    def _finish_checkpoint(self, trace_id: str, status: TraceStatus):
+        """Cerrar el punto de control de la traza y olvidar el estado de reanudación"""
+        self._resume_states.pop(trace_id, None)
+        if self.checkpoints:
+            self.checkpoints.finish_trace(trace_id, status.value)
+        self.purge_trace_history()
+    
+    def _run_sweeps(self):
+        while not self._sweep_stop.wait(settings.TRACE_SWEEP_SECONDS):
+            self.sweep()
+    
+    def sweep(self):
+        """Recoger las trazas remotas ya terminadas y caducar trazas y puntos de control antiguos"""
         try:
-            # Paso 1: Extraer EAN del pedido
-            ean = self._extract_ean_from_order(order)
-            if not ean:
-                return {"status": "failed", "error": "No se pudo extraer EAN", "order": order}
-            
-            # Paso 2: Consultar Binary Dashboard
-            binary_result = self._check_binary_dashboard(ean)
-            if not binary_result["success"]:
-                return {"status": "failed", "error": "Error consultando Binary", "order": order}
-            
-            product_info = binary_result["product_info"]
-            
-            # Paso 3: ¿Está en stock propio?
-            if product_info.get("own_stock", 0) > 0:
-                # Paso 4: ¿Es mayor que 1?
-                if product_info["own_stock"] > 1:
-                    # Stock suficiente - ir directo a gestión e imprimir
-                    return self._complete_order_processing(order, product_info, "own_stock")
-                
-                # Paso 5: ¿Es igual a 1?
-                elif product_info["own_stock"] == 1:
-                    # Alerta de factor humano
-                    self._log_human_factor_alert(order, product_info)
-                    return {"status": "requires_human_intervention", "reason": "stock_level_1", "order": order, "product_info": product_info}
-            
-            # Paso 6: No está en stock propio - ¿Tiene CN?
-            cn = product_info.get("cn")
-            if not cn:
-                # No tiene CN - ir a Actibios y comprar
-                return self._process_actibios_purchase(order, product_info)
-            
-            # Paso 7: Tiene CN - buscar en distribuidores
-            distributor_results = self._search_distributors_with_cn(cn)
-            
-            # Paso 8: ¿Tiene resultado en distribuidores?
-            if not distributor_results.get("has_results", False):
-                # No encontrado - dar de alta producto
-                registration_result = self._register_new_product_complete(product_info)
-                if not registration_result["success"]:
-                    return {"status": "failed", "error": "Error registrando producto", "order": order}
-            
-            # Paso 9: Ir a Farmatic y meter CN en cartera Promofarma
-            farmatic_result = self._add_to_promofarma_wallet(cn)
-            if not farmatic_result["success"]:
-                return {"status": "failed", "error": "Error añadiendo a cartera Promofarma", "order": order}
-            
-            # Paso 10: ¿Cartera Promofarma devuelve resultado?
-            promofarma_result = self._check_promofarma_result(cn)
-            if not promofarma_result["success"]:
-                # Dar de alta producto y reintentar
-                registration_result = self._register_new_product_complete(product_info)
-                if registration_result["success"]:
-                    promofarma_result = self._check_promofarma_result(cn)
-            
-            if not promofarma_result["success"]:
-                return {"status": "failed", "error": "No se pudo obtener resultado de Promofarma", "order": order}
-            
-            # Paso 11: Seleccionar mejor margen según prioridad
-            best_supplier = self._select_best_margin_supplier(promofarma_result["suppliers"])
-            
-            # Paso 12: Asignar proveedor, recargar y enviar
-            final_result = self._assign_supplier_and_complete(order, best_supplier)
-            
-            return final_result
+            for trace_id in [trace_id for trace_id, trace_data in list(self.active_traces.items())
+                             if "remote" in trace_data]:
+                self._collect_remote_trace(trace_id)
+            spilled = self.completed_traces.evict()
+            if spilled:
+                self.logger.debug(f"Trazas pasadas a disco: {spilled}")
+        except Exception as e:
+            self.logger.warning(f"Error en el barrido de trazas: {e}")
+        self.purge_trace_history()
+    
+    def close(self):
+        """Detener el barrido periódico (llamar al apagar)"""
+        self._sweep_stop.set()
+        if self._sweep_thread is not None:
+            self._sweep_thread.join(timeout=5)
+    
+    def purge_trace_history(self) -> Dict:
+        """Borrar de disco los puntos de control y las trazas archivadas más antiguos que TRACE_HISTORY_MAX_AGE"""
+        max_age = settings.TRACE_HISTORY_MAX_AGE
+        if max_age <= 0:
+            return {"checkpoints": 0, "archived": 0}
+        try:
+            purged = {
+                "checkpoints": self.checkpoints.purge(max_age, keep=list(self.active_traces))
+                if self.checkpoints else 0,
+                "archived": self.completed_traces.purge_archive(max_age)
+            }
+        except Exception as e:
+            self.logger.warning(f"No se pudo purgar el historial de trazas: {e}")
+            return {"checkpoints": 0, "archived": 0}
+        if any(purged.values()):
+            self.logger.info(f"Historial de trazas purgado: {purged}")
+        return purged
+    
+    def _record_order_result(self, trace_data: Dict, order: Dict, order_result: Dict):
+        """Clasificar el resultado de un pedido y actualizar el índice"""
+        # Solo se guarda el resultado compacto; el detalle completo queda en el punto de control
+        ean = self._extract_ean_from_order(order)
+        outcome = OrderOutcome.from_result(order, order_result, ean)
+        if order_result["status"] == "completed":
+            trace_data["processed_orders"].append(outcome)
+        elif order_result["status"] == "failed":
+            trace_data["failed_orders"].append(outcome)
+        elif order_result["status"] == "requires_human_intervention":
+            trace_data["human_intervention_required"].append(outcome)
+        
+        if order_result["status"] != "completed" and order.get("id"):
+            self.order_ledger.record_status(order["id"], ean, order_result["status"])
+    
+    def _is_already_processed(self, order: Dict) -> bool:
+        """Consultar el índice para no repetir pedidos completados en trazas anteriores"""
+        order_id = order.get("id")
+        return bool(order_id) and self.order_ledger.is_completed(order_id, self._extract_ean_from_order(order))
+    
+    def _set_step(self, step: TraceStep):
+        """Marcar el paso en curso del pedido que procesa este hilo"""
+        context = getattr(self._order_context, "value", None)
+        if context is not None:
+            trace_data, order = context
+            self._close_step_timing(trace_data)
+            trace_data["current_step"] = step
+            remote = getattr(self._order_context, "remote", None)
+            if remote is not None:
+                # Etapa de un trabajador: el paso se anota en la traza de la API
+                remote["current_step"] = step.value
+            elif self.checkpoints:
+                self.checkpoints.record_step(trace_data["trace_id"], self._order_key(order), step.value)
+            # El paso dura hasta la siguiente transición (o el final del pedido)
+            self._order_context.step_started = (step, time.perf_counter())
+    
+    def _close_step_timing(self, trace_data: Dict):
+        """Registrar la duración del paso que el hilo tenía en curso"""
+        started = getattr(self._order_context, "step_started", None)
+        if started is not None:
+            step, started_at = started
+            self._order_context.step_started = None
+            self._record_timing(trace_data["trace_id"], step, time.perf_counter() - started_at)
+    
+    def _record_timing(self, trace_id: str, step: TraceStep, seconds: float):
+        self.step_timings.record(step.value, seconds)
+        remote = getattr(self._order_context, "remote", None)
+        if remote is not None:
+            remote["timings"].append((step.value, seconds))
+        timings = self.trace_timings.get(trace_id)
+        if timings is not None:
+            timings.record(step.value, seconds)
+    
+    def _order_key(self, order: Dict) -> str:
+        """Identificador estable del pedido dentro de una traza"""
+        return f"{order.get('id')}|{self._extract_ean_from_order(order)}"
+    
+    def _durable_step(self, step: TraceStep, func, shared_key: Optional[str] = None) -> Dict:
+        """Ejecutar un paso salvo que ya esté hecho: guardado antes de una interrupción o,
+        si es común, resuelto por otro pedido del mismo producto en esta traza"""
+        context = getattr(self._order_context, "value", None)
+        if context is None:
+            return func()
+        
+        trace_data, order = context
+        trace_id = trace_data["trace_id"]
+        order_key = self._order_key(order)
+        
+        remote = getattr(self._order_context, "remote", None)
+        resume_state = self._resume_states.get(trace_id)
+        if remote is not None:
+            saved = remote["resumed_steps"].get(step.value)
+        elif resume_state:
+            saved = resume_state["step_results"].get(order_key, {}).get(step.value)
+        else:
+            saved = None
+        if saved is not None:
+            return saved
+        
+        memo = self._trace_memos.get(trace_id)
+        if memo is not None and shared_key:
+            result = memo.run((step.value, shared_key), func)
+        else:
+            result = func()
+        
+        if result.get("success"):
+            if remote is not None:
+                remote["step_results"][step.value] = result
+            elif self.checkpoints:
+                self.checkpoints.save_step_result(trace_id, order_key, step.value, result)
+        return result
+    
+    def _trace_priority(self, trace_data: Dict) -> float:
+        """Prioridad de la traza (config "priority"; número menor = más urgente)"""
+        priority = trace_data["config"].get("priority")
+        return settings.ORDER_PRIORITY_DEFAULT if priority is None else float(priority)
+    
+    def _order_priority(self, trace_data: Dict, order: Dict) -> float:
+        """Prioridad de un pedido: urgente si hay un cliente esperando, la suya propia o la de la traza"""
+        if order.get("urgent") or order.get("customer_waiting"):
+            return settings.ORDER_PRIORITY_URGENT
+        if order.get("priority") is not None:
+            return float(order["priority"])
+        return self._trace_priority(trace_data)
+    
+    def _process_single_order(self, trace_data: Dict, order: Dict) -> Dict:
+        """Procesar un pedido de principio a fin en el hilo actual"""
+        state = {"order": order, "priority": self._order_priority(trace_data, order)}
+        try:
+            stage = self.ORDER_STAGES[0]
+            while stage:
+                stage = self._run_order_stage(trace_data, state, stage)
+            return self._finish_order(trace_data, state)
+        finally:
+            with self.progress_lock:
+                trace_data["progress"]["done"] += 1
+    
+    def _process_orders_pipelined(self, trace_data: Dict, orders: List[Dict]) -> List[Dict]:
+        """Procesar los pedidos en etapas con cola propia, solapando web, Farmatic e impresión"""
+        stage_workers = {**settings.TRACE_STAGE_WORKERS, **trace_data["config"].get("stage_workers", {})}
+        
+        def finish(state):
+            try:
+                self._finish_order(trace_data, state)
+            finally:
+                with self.progress_lock:
+                    trace_data["progress"]["done"] += 1
+        
+        pipeline = StagePipeline(
+            [
+                (stage, lambda state, stage=stage: self._run_order_stage(trace_data, state, stage),
+                 stage_workers.get(stage, 1))
+                for stage in self.ORDER_STAGES
+            ],
+            on_done=finish,
+            name=trace_data["trace_id"],
+            priority=lambda state: state["priority"]
+        )
+        states = [{"order": order, "priority": self._order_priority(trace_data, order)} for order in orders]
+        trace_data["pipeline"] = pipeline.run(states)
+        return [state["result"] for state in states]
+    
+    def _process_orders_distributed(self, trace_data: Dict, orders: List[Dict]) -> List[Dict]:
+        """Enviar cada etapa de cada pedido a la cola de los trabajadores que tienen sus recursos"""
+        trace_id = trace_data["trace_id"]
+        config = {**trace_data["config"], "dispatch": "local"}
+        
+        resume_state = self._resume_states.get(trace_id)
+        
+        def drive(order):
+            state = {"order": order, "priority": self._order_priority(trace_data, order)}
+            if resume_state:
+                # Pasos hechos antes de la interrupción: el trabajador no los repite
+                state["resumed_steps"] = resume_state["step_results"].get(self._order_key(order), {})
+            try:
+                stage = self.ORDER_STAGES[0]
+                while stage:
+                    # Quien espera es la API, nunca otra tarea (run_remote_trace procesa en local)
+                    reply = dispatch_order_stage(trace_id, config, state, stage).get(
+                        timeout=settings.TRACE_DISPATCH_TIMEOUT, disable_sync_subtasks=False
+                    )
+                    self._merge_remote_stage(trace_data, order, reply)
+                    state, stage = reply["state"], reply["next_stage"]
+            except Exception as e:
+                self.logger.error(f"Error en trabajador remoto con el pedido {order.get('id', 'unknown')}: {e}")
+                state["result"] = {"status": "failed", "error": str(e), "order": order}
             
+            result = self._finish_order(trace_data, state)
+            # El libro está en el puesto de la etapa Excel; el índice local evita repetir el pedido
+            if result["status"] == "completed" and order.get("id"):
+                self.order_ledger.record_status(order["id"], self._extract_ean_from_order(order), "completed")
+            with self.progress_lock:
+                trace_data["progress"]["done"] += 1
+            return result
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(settings.TRACE_DISPATCH_INFLIGHT, len(orders)))) as executor:
+            return list(executor.map(drive, orders))
+    
+    def _run_order_stage(self, trace_data: Dict, state: Dict, stage: str) -> Optional[str]:
+        """Ejecutar una etapa de un pedido; devuelve la siguiente o None si el pedido terminó"""
+        order = state["order"]
+        self._order_context.value = (trace_data, order)
+        try:
+            # Las plazas de Farmatic, navegador, etc. se reparten según la prioridad del pedido
+            with self.resources.priority(state["priority"]):
+                return getattr(self, f"_stage_{stage}")(state)
         except Exception as e:
-            self.logger.error(f"Error procesando pedido {order_id}: {e}")
-            return {"status": "failed", "error": str(e), "order": order}
+            self.logger.error(f"Error procesando pedido {order.get('id', 'unknown')}: {e}")
+            return self._end_order(state, {"status": "failed", "error": str(e), "order": order})
+        finally:
+            # El tiempo en cola hasta la siguiente etapa no cuenta para ningún paso
+            self._close_step_timing(trace_data)
+            self._order_context.value = None
+    
+    def _end_order(self, state: Dict, result: Dict) -> None:
+        state["result"] = result
+        return None
+    
+    def _finish_order(self, trace_data: Dict, state: Dict) -> Dict:
+        """Guardar el resultado final del pedido en el punto de control"""
+        result = state["result"]
+        if self.checkpoints:
+            self.checkpoints.finish_order(
+                trace_data["trace_id"], self._order_key(state["order"]), result["status"], result
+            )
+        return result
+    
+    def _stage_lookup(self, state: Dict) -> Optional[str]:
+        """Etapa de consulta: EAN, Binary y stock propio"""
+        order = state["order"]
+        
+        # Paso 1: Extraer EAN del pedido
+        self._set_step(TraceStep.EXTRACT_EAN)
+        ean = self._extract_ean_from_order(order)
+        if not ean:
+            return self._end_order(state, {"status": "failed", "error": "No se pudo extraer EAN", "order": order})
+        
+        # Paso 2: Consultar Binary Dashboard
+        self._set_step(TraceStep.CHECK_BINARY_DASHBOARD)
+        binary_result = self._lookup_binary_product(ean)
+        if not binary_result["success"]:
+            return self._end_order(state, {"status": "failed", "error": "Error consultando Binary", "order": order})
+        
+        product_info = binary_result["product_info"]
+        state["product_info"] = product_info
+        
+        # Paso 3: ¿Está en stock propio?
+        self._set_step(TraceStep.CHECK_OWN_STOCK)
+        if product_info.get("own_stock", 0) > 0:
+            # Paso 4: ¿Es mayor que 1?
+            self._set_step(TraceStep.CHECK_STOCK_LEVEL)
+            if product_info["own_stock"] > 1:
+                # Stock suficiente - ir directo a gestión e imprimir
+                state["completion"] = (product_info, "own_stock")
+                return "excel"
+            
+            # Paso 5: ¿Es igual a 1?
+            elif product_info["own_stock"] == 1:
+                # Alerta de factor humano
+                self._log_human_factor_alert(order, product_info)
+                return self._end_order(state, {"status": "requires_human_intervention", "reason": "stock_level_1",
+                                               "order": order, "product_info": product_info})
+        
+        # Paso 6: No está en stock propio - ¿Tiene CN?
+        self._set_step(TraceStep.CHECK_CN_EXISTS)
+        state["cn"] = product_info.get("cn")
+        return "distributors"
+    
+    def _stage_distributors(self, state: Dict) -> Optional[str]:
+        """Etapa web: distribuidores, alta en Binary o compra en Actibios"""
+        order = state["order"]
+        product_info = state["product_info"]
+        cn = state["cn"]
+        
+        if not cn:
+            # No tiene CN - ir a Actibios y comprar
+            self._set_step(TraceStep.ACTIBIOS_PURCHASE)
+            purchase_result = self._durable_step(
+                TraceStep.ACTIBIOS_PURCHASE, lambda: self._purchase_actibios(order, product_info)
+            )
+            if not purchase_result["success"]:
+                return self._end_order(state, {"status": "failed", "error": "Error en compra Actibios", "order": order})
+            state["completion"] = (product_info, "actibios_purchase")
+            return "excel"
+        
+        # Paso 7: Tiene CN - buscar en distribuidores
+        self._set_step(TraceStep.SEARCH_DISTRIBUTORS)
+        distributor_results = self._durable_step(
+            TraceStep.SEARCH_DISTRIBUTORS, lambda: self._search_distributors_with_cn(cn), shared_key=cn
+        )
+        
+        # Paso 8: ¿Tiene resultado en distribuidores?
+        if not distributor_results.get("has_results", False):
+            # No encontrado - dar de alta producto
+            registration_result = self._durable_step(
+                TraceStep.REGISTER_NEW_PRODUCT, lambda: self._register_new_product_complete(product_info)
+            )
+            if not registration_result["success"]:
+                return self._end_order(state, {"status": "failed", "error": "Error registrando producto", "order": order})
+        
+        return "farmatic"
+    
+    def _stage_farmatic(self, state: Dict) -> Optional[str]:
+        """Etapa Farmatic: cartera Promofarma, proveedor, asignación y envío"""
+        order = state["order"]
+        product_info = state["product_info"]
+        cn = state["cn"]
+        
+        # Paso 9: Ir a Farmatic y meter CN en cartera Promofarma
+        self._set_step(TraceStep.ADD_PROMOFARMA_WALLET)
+        farmatic_result = self._durable_step(
+            TraceStep.ADD_PROMOFARMA_WALLET, lambda: self._add_to_promofarma_wallet(cn), shared_key=cn
+        )
+        if not farmatic_result["success"]:
+            return self._end_order(state, {"status": "failed", "error": "Error añadiendo a cartera Promofarma", "order": order})
+        
+        # Paso 10: ¿Cartera Promofarma devuelve resultado?
+        self._set_step(TraceStep.CHECK_PROMOFARMA_RESULT)
+        promofarma_result = self._durable_step(
+            TraceStep.CHECK_PROMOFARMA_RESULT, lambda: self._check_promofarma_result(cn), shared_key=cn
+        )
+        if not promofarma_result["success"]:
+            # Dar de alta producto y reintentar
+            registration_result = self._durable_step(
+                TraceStep.REGISTER_NEW_PRODUCT, lambda: self._register_new_product_complete(product_info)
+            )
+            if registration_result["success"]:
+                promofarma_result = self._check_promofarma_result(cn)
+        
+        if not promofarma_result["success"]:
+            return self._end_order(state, {"status": "failed", "error": "No se pudo obtener resultado de Promofarma", "order": order})
+        
+        # Paso 11: Seleccionar mejor margen según prioridad
+        self._set_step(TraceStep.SELECT_BEST_MARGIN)
+        best_supplier = self._select_best_margin_supplier(promofarma_result["suppliers"])
+        if best_supplier is None:
+            # Ningún proveedor alcanza su margen mínimo: decide una persona
+            return self._end_order(state, {"status": "requires_human_intervention", "reason": "no_supplier_above_minimum_margin",
+                                           "order": order, "product_info": product_info})
+        
+        # Paso 12: Asignar proveedor, recargar y enviar
+        self._set_step(TraceStep.ASSIGN_SUPPLIER)
+        assignment_result = self._durable_step(
+            TraceStep.ASSIGN_SUPPLIER, lambda: self._assign_supplier(order, best_supplier)
+        )
+        if not assignment_result["success"]:
+            return self._end_order(state, {"status": "failed", "error": "Error asignando proveedor", "order": order})
+        
+        self._set_step(TraceStep.RELOAD_AND_SEND)
+        reload_result = self._durable_step(
+            TraceStep.RELOAD_AND_SEND, lambda: self._reload_and_send(order)
+        )
+        if not reload_result["success"]:
+            return self._end_order(state, {"status": "failed", "error": "Error recargando y enviando", "order": order})
+        
+        state["completion"] = (best_supplier, "assigned_supplier")
+        return "excel"
+    
+    def _stage_excel(self, state: Dict) -> Optional[str]:
+        """Etapa de registro: libro de pedidos y, si está activo, Excel en vivo"""
+        order = state["order"]
+        product_info, completion_type = state["completion"]
+        
+        # Registrar en el libro de pedidos (el Excel se genera bajo demanda)
+        self._set_step(TraceStep.EXCEL_UPDATE)
+        excel_data = self._compile_order_data_for_excel(order, product_info, completion_type)
+        state["ledger_result"] = self._durable_step(
+            TraceStep.EXCEL_UPDATE,
+            lambda: self.order_ledger.append(excel_data, ean=self._extract_ean_from_order(order))
+        )
+        
+        # El pedido mueve el stock del producto
+        ean = self._extract_ean_from_order(order)
+        if ean:
+            self.binary_cache.invalidate(ean, ["own_stock"])
+        
+        state["excel_result"] = None
+        if settings.EXCEL_LIVE_LEDGER:
+            state["excel_result"] = self.automation_manager.excel_manager.append_row(
+                "./output/pedidos_procesados.xlsx",
+                excel_data
+            )
+        return "print"
+    
+    def _stage_print(self, state: Dict) -> Optional[str]:
+        """Etapa de impresión y cierre del pedido"""
+        order = state["order"]
+        product_info, completion_type = state["completion"]
+        
+        # Imprimir documentos
+        self._set_step(TraceStep.PRINT_DOCUMENTS)
+        print_result = self._durable_step(
+            TraceStep.PRINT_DOCUMENTS, lambda: self._print_order_documents(order, product_info)
+        )
+        
+        return self._end_order(state, {
+            "status": "completed",
+            "completion_type": completion_type,
+            "supplier": product_info.get("name") if completion_type == "assigned_supplier" else None,
+            "order": order,
+            "ledger_result": state["ledger_result"],
+            "excel_result": state["excel_result"],
+            "print_result": print_result
+        })
     
     def _get_order_list(self, trace_data: Dict) -> Dict:
         """Obtener lista de pedidos desde Farmatic"""
@@ -193,7 +923,8 @@ class TraceManager:
             }
             
             # Ejecutar búsqueda en Farmatic
-            result = self.automation_manager.farmatic_controller.get_order_list(farmatic_config)
+            with self.resources.acquire("farmatic"):
+                result = self.automation_manager.farmatic_controller.get_order_list(farmatic_config)
             
             return result
             
@@ -205,33 +936,100 @@ class TraceManager:
         # Implementar lógica para extraer EAN según estructura del pedido
         return order.get("ean") or order.get("barcode")
     
-    def _check_binary_dashboard(self, ean: str) -> Dict:
-        """Consultar Binary Dashboard"""
+    def _prefetch_binary_products(self, orders: List[Dict]) -> Dict:
+        """Cargar en caché las fichas de Binary de todos los pedidos con una consulta por bloques"""
         try:
+            eans = []
+            for order in orders:
+                ean = self._extract_ean_from_order(order)
+                if ean and ean not in eans and self.binary_cache.missing_fields(ean, self.BINARY_FIELDS):
+                    eans.append(ean)
+            
+            if not eans:
+                return {"success": True, "requested": 0, "loaded": 0}
+            
+            with self.resources.acquire("binary_http"):
+                result = self.automation_manager.web_controller.query_binary_dashboard_bulk(
+                    eans, self.BINARY_FIELDS
+                )
+            
+            for ean, product_info in result.get("products", {}).items():
+                self.binary_cache.put(ean, product_info, self.BINARY_FIELDS)
+            
+            return {
+                "success": result.get("success", False),
+                "requested": len(eans),
+                "loaded": len(result.get("products", {})),
+                "not_found": result.get("not_found", []),
+                "error": "; ".join(error["error"] for error in result.get("errors", [])) or None
+            }
+            
+        except Exception as e:
+            # Sin precarga cada pedido consulta su EAN por separado
+            self.logger.warning(f"No se pudo precargar Binary Dashboard: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def _lookup_binary_product(self, ean: str) -> Dict:
+        """Ficha de Binary del pedido: los datos maestros se comparten entre pedidos del mismo EAN,
+        el stock propio se lee para cada uno porque los pedidos anteriores lo han movido"""
+        shared = self._durable_step(
+            TraceStep.CHECK_BINARY_DASHBOARD, lambda: self._check_binary_dashboard(ean), shared_key=ean
+        )
+        if not shared["success"]:
+            return shared
+        
+        # Tras la etapa Excel de otro pedido el stock está invalidado en caché y se vuelve a consultar
+        stock = self._check_binary_dashboard(ean, ["own_stock"])
+        if not stock["success"]:
+            return stock
+        return {**shared, "product_info": {**shared["product_info"], "own_stock": stock["product_info"].get("own_stock")}}
+    
+    def _check_binary_dashboard(self, ean: str, fields: List[str] = None) -> Dict:
+        """Consultar Binary Dashboard (con caché por EAN)"""
+        try:
+            fields = fields or self.BINARY_FIELDS
+            
+            # Solo se consultan los campos que no estén vigentes en caché
+            cached = self.binary_cache.get(ean, fields)
+            if not cached["missing"]:
+                return {"success": True, "product_info": cached["product_info"], "cached": True}
+            
             # Configurar consulta a Binary Dashboard
             dashboard_config = {
                 "action": "product_lookup",
                 "ean": ean,
-                "fields": ["own_stock", "cn", "description", "iva", "laboratory", "family"]
+                "fields": cached["missing"]
             }
             
             # Ejecutar consulta
-            result = self.automation_manager.web_controller.query_binary_dashboard(dashboard_config)
+            with self.resources.acquire("binary_http"):
+                result = self.automation_manager.web_controller.query_binary_dashboard(dashboard_config)
+            
+            if result.get("success"):
+                self.binary_cache.put(ean, result["product_info"], cached["missing"])
+                result["product_info"] = {**cached["product_info"], **result["product_info"]}
             
             return result
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def invalidate_binary_cache(self, ean: str, fields: List[str] = None) -> bool:
+        """Invalidar la ficha en caché de un EAN (completa o solo algunos campos)"""
+        return self.binary_cache.invalidate(ean, fields)
+    
     def _search_distributors_with_cn(self, cn: str) -> Dict:
         """Buscar en distribuidores usando CN"""
         try:
             distributors = ["cofares", "alliance", "hefame", "bidafarma"]
+            
+            if settings.DISTRIBUTOR_FANOUT:
+                return self._fan_out_distributor_search(distributors, cn)
+            
             results = {}
             
             for distributor in distributors:
-                dist_result = self.automation_manager.web_controller.search_by_cn(distributor, cn)
-                results[distributor] = dist_result
+                results[distributor] = self._query_distributor(distributor, cn)
             
             # Verificar si algún distribuidor tiene resultados
             has_results = any(result.get("success") and result.get("found") for result in results.values())
@@ -245,8 +1043,128 @@ class TraceManager:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def _query_distributor(self, distributor: str, cn: str, priority: float = None,
+                           settled: threading.Event = None) -> Dict:
+        """Buscar un CN en un distribuidor ocupando una sesión de navegador solo mientras se busca"""
+        web_controller = self.automation_manager.web_controller
+        skipped = {"success": False, "skipped": True, "error": "No necesario"}
+        
+        # Un resultado en caché no necesita navegador ni esperar a que quede uno libre
+        cached = web_controller.cached_search_by_cn(distributor, cn)
+        if cached is not None:
+            return cached
+        
+        attempt = 0
+        while True:
+            # Con el circuito abierto se responde sin ocupar navegador
+            rejected = web_controller.distributor_unavailable(distributor)
+            if rejected is not None:
+                return rejected
+            
+            with self.resources.acquire("browser", priority):
+                # Si otro distribuidor ya resolvió la búsqueda mientras se esperaba la plaza, se libera sin buscar
+                if settled is not None and settled.is_set():
+                    return skipped
+                result = web_controller.search_by_cn(distributor, cn, attempt=attempt)
+                # Se marca antes de soltar la plaza para que el siguiente en espera ya lo vea
+                if settled is not None and result.get("success") and result.get("found"):
+                    settled.set()
+            
+            if "retry_in" not in result:
+                return result
+            
+            # La espera entre reintentos no retiene el navegador
+            delay = result.pop("retry_in")
+            if settled is None:
+                time.sleep(delay)
+            elif settled.wait(delay):
+                return skipped
+            attempt += 1
+    
+    def _fan_out_distributor_search(self, distributors: List[str], cn: str) -> Dict:
+        """Consultar los distribuidores a la vez y decidir con el primero que encuentre el CN"""
+        timeout = settings.DISTRIBUTOR_TIMEOUT
+        hedge_after = settings.DISTRIBUTOR_HEDGE_SECONDS
+        started = time.monotonic()
+        
+        # Los hilos del ejecutor no heredan la prioridad del pedido: se pasa explícitamente
+        priority = self.resources.current_priority()
+        # Una vez decidida la búsqueda, las peticiones que ya están en el ejecutor no ocupan el navegador
+        settled = threading.Event()
+        
+        attempts = {}  # futuro -> distribuidor
+        hedged = set()
+        for distributor in distributors:
+            attempts[self.distributor_executor.submit_with_priority(
+                priority, self._query_distributor, distributor, cn, priority, settled
+            )] = distributor
+        
+        results = {}
+        settled_by = None
+        pending = set(attempts)
+        
+        while pending and settled_by is None:
+            now = time.monotonic()
+            open_distributors = {attempts[f] for f in pending} - set(results)
+            if not open_distributors:
+                break
+            
+            # Próximo instante en el que hay que hacer algo: plazo vencido o duplicar petición lenta
+            wake_at = started + timeout
+            if hedge_after and open_distributors - hedged:
+                wake_at = min(wake_at, started + hedge_after)
+            
+            done, pending = wait(pending, timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                distributor = attempts[future]
+                if distributor in results:
+                    continue  # Ya respondió la otra petición (duplicada)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+                results[distributor] = result
+                if result.get("success") and result.get("found") and settled_by is None:
+                    settled_by = distributor
+            
+            elapsed = time.monotonic() - started
+            if settled_by is None and hedge_after and elapsed >= hedge_after:
+                for distributor in sorted(open_distributors - hedged - set(results)):
+                    hedged.add(distributor)
+                    hedge = self.distributor_executor.submit_with_priority(
+                        priority, self._query_distributor, distributor, cn, priority, settled
+                    )
+                    attempts[hedge] = distributor
+                    pending.add(hedge)
+            
+            if elapsed >= timeout:
+                break
+        
+        # Las peticiones que siguen en curso se ignoran; las que no empezaron se cancelan
+        # y las que esperan plaza de navegador terminan sin buscar
+        settled.set()
+        for future in pending:
+            future.cancel()
+        for distributor in distributors:
+            if distributor not in results:
+                results[distributor] = {
+                    "success": False,
+                    "skipped": settled_by is not None,
+                    "error": "No necesario" if settled_by else f"Sin respuesta en {timeout}s"
+                }
+        
+        return {
+            "success": True,
+            "has_results": settled_by is not None,
+            "settled_by": settled_by,
+            "distributor_results": results,
+            "elapsed_seconds": round(time.monotonic() - started, 3)
+        }
+    
     def _register_new_product_complete(self, product_info: Dict) -> Dict:
         """Dar de alta producto completo en Binary"""
+        self._set_step(TraceStep.REGISTER_NEW_PRODUCT)
         try:
             registration_data = {
                 "cn": product_info.get("cn"),
@@ -257,7 +1175,12 @@ class TraceManager:
                 "synonym_ean": product_info.get("ean")
             }
             
-            result = self.automation_manager.web_controller.register_product_binary(registration_data)
+            with self.resources.acquire("binary_http"):
+                result = self.automation_manager.web_controller.register_product_binary(registration_data)
+            
+            # El alta cambia la ficha en Binary
+            if product_info.get("ean"):
+                self.binary_cache.invalidate(product_info["ean"])
             
             return result
             
@@ -273,7 +1196,8 @@ class TraceManager:
                 "cn": cn
             }
             
-            result = self.automation_manager.farmatic_controller.manage_wallet(config)
+            with self.resources.acquire("farmatic"):
+                result = self.automation_manager.farmatic_controller.manage_wallet(config)
             
             return result
             
@@ -289,105 +1213,51 @@ class TraceManager:
                 "cn": cn
             }
             
-            result = self.automation_manager.farmatic_controller.check_wallet_result(config)
+            with self.resources.acquire("farmatic"):
+                result = self.automation_manager.farmatic_controller.check_wallet_result(config)
             
             return result
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def _select_best_margin_supplier(self, suppliers: List[Dict]) -> Dict:
-        """Seleccionar mejor margen según prioridades"""
-        if not suppliers:
-            return None
-        
-        # Ordenar por prioridad y margen
-        sorted_suppliers = sorted(
-            suppliers,
-            key=lambda x: (
-                self.supplier_priorities.get(x.get("name", ""), 999),
-                -x.get("margin", 0)
-            )
-        )
-        
-        return sorted_suppliers[0]
+    def _select_best_margin_supplier(self, suppliers: List[Dict]) -> Optional[Dict]:
+        """Seleccionar mejor margen según prioridades (None si ninguno llega a su margen mínimo)"""
+        return self.supplier_ranker.rank(suppliers)
     
-    def _assign_supplier_and_complete(self, order: Dict, supplier: Dict) -> Dict:
-        """Asignar proveedor, recargar y completar pedido"""
-        try:
-            # Asignar proveedor
-            assignment_result = self.automation_manager.farmatic_controller.assign_supplier(
-                order["id"], supplier
-            )
-            
-            if not assignment_result["success"]:
-                return {"status": "failed", "error": "Error asignando proveedor", "order": order}
-            
-            # Recargar y enviar
-            reload_result = self.automation_manager.farmatic_controller.reload_and_send(order["id"])
-            
-            if not reload_result["success"]:
-                return {"status": "failed", "error": "Error recargando y enviando", "order": order}
-            
-            # Completar con gestión Excel e impresión
-            return self._complete_order_processing(order, supplier, "assigned_supplier")
-            
-        except Exception as e:
-            return {"status": "failed", "error": str(e), "order": order}
+    def _assign_supplier(self, order: Dict, supplier: Dict) -> Dict:
+        """Asignar el proveedor al pedido en Farmatic"""
+        with self.resources.acquire("farmatic"):
+            return self.automation_manager.farmatic_controller.assign_supplier(order["id"], supplier)
     
-    def _complete_order_processing(self, order: Dict, product_info: Dict, completion_type: str) -> Dict:
-        """Completar procesamiento: Excel e impresión"""
-        try:
-            # Actualizar Excel
-            excel_data = self._compile_order_data_for_excel(order, product_info, completion_type)
-            excel_result = self.automation_manager.excel_manager.insert_row_data(
-                "./output/pedidos_procesados.xlsx",
-                excel_data
-            )
-            
-            # Imprimir documentos
-            print_result = self._print_order_documents(order, product_info)
-            
-            return {
-                "status": "completed",
-                "completion_type": completion_type,
-                "order": order,
-                "excel_result": excel_result,
-                "print_result": print_result
-            }
-            
-        except Exception as e:
-            return {"status": "failed", "error": str(e), "order": order}
+    def _reload_and_send(self, order: Dict) -> Dict:
+        """Recargar y enviar el pedido en Farmatic"""
+        with self.resources.acquire("farmatic"):
+            return self.automation_manager.farmatic_controller.reload_and_send(order["id"])
     
-    def _process_actibios_purchase(self, order: Dict, product_info: Dict) -> Dict:
-        """Procesar compra en Actibios para productos sin CN"""
-        try:
-            purchase_result = self.automation_manager.web_controller.purchase_actibios(
+    def _purchase_actibios(self, order: Dict, product_info: Dict) -> Dict:
+        """Comprar en Actibios ocupando una sesión de navegador"""
+        with self.resources.acquire("browser"):
+            return self.automation_manager.web_controller.purchase_actibios(
                 product_info.get("ean"), order.get("quantity", 1)
             )
-            
-            if purchase_result["success"]:
-                return self._complete_order_processing(order, product_info, "actibios_purchase")
-            else:
-                return {"status": "failed", "error": "Error en compra Actibios", "order": order}
-                
-        except Exception as e:
-            return {"status": "failed", "error": str(e), "order": order}
     
     def _log_human_factor_alert(self, order: Dict, product_info: Dict):
         """Registrar alerta de factor humano"""
+        context = getattr(self._order_context, "value", None)
         alert_data = {
             "timestamp": datetime.now(),
+            "trace_id": context[0]["trace_id"] if context else None,
             "order_id": order.get("id"),
+            "ean": product_info.get("ean"),
             "product_code": product_info.get("cn") or product_info.get("ean"),
             "reason": "stock_level_1",
             "stock_level": product_info.get("own_stock"),
             "message": f"Producto con stock = 1 requiere intervención humana"
         }
         
-        # Log a archivo
-        with open("./logs/human_factor_alerts.log", "a", encoding="utf-8") as f:
-            f.write(f"{alert_data}\n")
+        # Log a archivo (JSON por líneas e índice SQLite, sin esperar a disco)
+        self.alert_log.record(alert_data)
         
         self.logger.warning(f"Alerta factor humano: {alert_data}")
     
@@ -419,16 +1289,98 @@ class TraceManager:
             }
             
             # Imprimir etiqueta
-            print_result = self.automation_manager.printer_manager.print_promofarma_label(label_data)
+            with self.resources.acquire("printer"):
+                print_result = self.automation_manager.printer_manager.print_promofarma_label(label_data)
             
             return print_result
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def export_processed_orders(self, report_name: str = None,
+                                date_from: str = None, date_to: str = None) -> Dict:
+        """Exportar el libro de pedidos procesados a Excel"""
+        return self.order_ledger.export_to_excel(
+            self.automation_manager.excel_manager, report_name, date_from, date_to
+        )
+    
+    def lookup_order(self, order_id: str, ean: str = None) -> Optional[Dict]:
+        """Consultar si un pedido ya fue procesado y dónde quedó registrado"""
+        return self.order_ledger.lookup(order_id, ean)
+    
+    def get_cache_stats(self) -> Dict:
+        """Contadores de las cachés de la traza"""
+        return {"binary_dashboard": self.binary_cache.get_stats()}
+    
     def get_trace_status(self, trace_id: str) -> Optional[Dict]:
-        """Obtener estado de una traza"""
-        return self.active_traces.get(trace_id)
+        """Obtener estado de una traza con su progreso en vivo"""
+        self._collect_remote_trace(trace_id)
+        trace_data = self.active_traces.get(trace_id)
+        if trace_data is None:
+            summary = self.completed_traces.get(trace_id)
+            if summary is not None:
+                return summary.to_dict()
+            archived = self.completed_traces.load_archived(trace_id)
+            if archived is not None:
+                archived.pop("timings", None)
+            return archived
+        
+        # Copia superficial: la traza puede seguir avanzando en otro hilo
+        status = {key: value for key, value in trace_data.items() if key not in ("future", "remote", "config")}
+        status["config"] = strip_credentials(trace_data["config"])
+        status["orders"] = list(trace_data["orders"])
+        for key in self.OUTCOME_LISTS:
+            status[key] = [outcome.to_dict() for outcome in list(trace_data[key])]
+        status["progress"] = self._progress_snapshot(trace_data)
+        return status
+    
+    def _progress_snapshot(self, trace_data: Dict) -> Dict:
+        """Pedidos hechos, pendientes y tiempo estimado restante"""
+        total = trace_data["progress"]["total"]
+        done = trace_data["progress"]["done"]
+        progress = {
+            "total": total,
+            "done": done,
+            "remaining": max(total - done, 0),
+            "current_step": trace_data["current_step"].value,
+            "processed": len(trace_data["processed_orders"]),
+            "failed": len(trace_data["failed_orders"]),
+            "human_intervention": len(trace_data["human_intervention_required"]),
+            "skipped": len(trace_data["skipped_orders"]),
+            "eta_seconds": None
+        }
+        
+        run_start = trace_data.get("run_start_time")
+        if run_start and done and trace_data["status"] == TraceStatus.IN_PROGRESS:
+            elapsed = (datetime.now() - run_start).total_seconds()
+            progress["eta_seconds"] = round(elapsed / done * (total - done), 1)
+        elif trace_data["status"] == TraceStatus.COMPLETED:
+            progress["eta_seconds"] = 0
+        
+        return progress
+    
+    def query_alerts(self, date_from: str = None, date_to: str = None, order_id: str = None,
+                     product_code: str = None, limit: int = 100) -> List[Dict]:
+        """Consultar alertas de factor humano"""
+        return self.alert_log.query(date_from, date_to, order_id, product_code, limit)
+    
+    def get_trace_timings(self, trace_id: str) -> Optional[Dict]:
+        """Latencias por paso de una traza (recuento, p50, p95, p99 y máximo en segundos)"""
+        timings = self.trace_timings.get(trace_id)
+        if timings is not None:
+            return {"trace_id": trace_id, "steps": timings.snapshot()}
+        
+        summary = self.completed_traces.get(trace_id)
+        if summary is not None:
+            return {"trace_id": trace_id, "steps": summary.timings}
+        archived = self.completed_traces.load_archived(trace_id)
+        if archived is not None:
+            return {"trace_id": trace_id, "steps": archived.get("timings", {})}
+        return None
+    
+    def get_step_metrics(self) -> Dict:
+        """Latencias por paso acumuladas de todas las trazas"""
+        return {"steps": self.step_timings.snapshot()}
     
     def get_all_active_traces(self) -> Dict:
         """Obtener todas las trazas activas"""
@@ -0,0 +1,161 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from .database import connect
+
+@dataclass(slots=True)
+class OrderOutcome:
+    """Resultado de un pedido reducido a lo que se consulta después"""
+    order_id: Optional[str]
+    ean: Optional[str]
+    status: str
+    quantity: Any = None
+    reason: Optional[str] = None
+    error: Optional[str] = None
+    completion_type: Optional[str] = None
+    supplier: Optional[str] = None
+    ledger_id: Optional[int] = None
+
+    @classmethod
+    def from_result(cls, order: Dict, result: Dict, ean: Optional[str] = None) -> "OrderOutcome":
+        supplier = result.get("supplier")
+        ledger_result = result.get("ledger_result") or {}
+        return cls(
+            order_id=order.get("id"),
+            ean=ean,
+            status=result.get("status", "unknown"),
+            quantity=order.get("quantity"),
+            reason=result.get("reason"),
+            error=result.get("error"),
+            completion_type=result.get("completion_type"),
+            supplier=supplier if isinstance(supplier, str) else None,
+            ledger_id=ledger_result.get("ledger_id")
+        )
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class TraceSummary:
+    """Traza terminada: configuración sin credenciales, recuentos y resultados compactos"""
+    trace_id: str
+    status: Any  # TraceStatus
+    start_time: datetime
+    end_time: Optional[datetime]
+    config: Dict
+    progress: Dict
+    error: Optional[str] = None
+    details: Dict = field(default_factory=dict)
+    outcomes: Dict[str, List[OrderOutcome]] = field(default_factory=dict)
+    timings: Dict = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        data = {
+            "trace_id": self.trace_id,
+            "status": self.status,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "config": self.config,
+            "progress": self.progress,
+            "error": self.error,
+            **self.details
+        }
+        for key, outcomes in self.outcomes.items():
+            data[key] = [outcome.to_dict() for outcome in outcomes]
+        return data
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False,
+                      default=lambda item: item.value if isinstance(item, Enum) else str(item))
+
+
+class TraceRetention:
+    """Trazas terminadas en memoria acotada por número y antigüedad; las expulsadas pasan a SQLite"""
+
+    def __init__(self, database_url: str = None, max_traces: int = 100,
+                 max_age_seconds: float = 86400, clock=time.monotonic):
+        self.logger = logging.getLogger(__name__)
+        self.max_traces = max_traces
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self.summaries = OrderedDict()  # trace_id -> (TraceSummary, guardada_en)
+        self.lock = threading.Lock()
+        self.connection = connect(database_url)
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS trace_archive (
+                    trace_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    finished_at TEXT,
+                    summary TEXT NOT NULL
+                )
+            """)
+            self.connection.commit()
+
+    def add(self, summary: TraceSummary) -> List[str]:
+        """Guardar una traza terminada y expulsar las que sobren"""
+        with self.lock:
+            self.summaries.pop(summary.trace_id, None)
+            self.summaries[summary.trace_id] = (summary, self.clock())
+        return self.evict()
+
+    def evict(self) -> List[str]:
+        """Pasar a disco las trazas más antiguas que el límite de edad o de número"""
+        now = self.clock()
+        spilled = []
+        with self.lock:
+            while self.summaries:
+                summary, stored_at = next(iter(self.summaries.values()))
+                if len(self.summaries) <= self.max_traces and now - stored_at < self.max_age_seconds:
+                    break
+                self.summaries.popitem(last=False)
+                spilled.append(summary)
+
+            for summary in spilled:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO trace_archive (trace_id, status, finished_at, summary) VALUES (?, ?, ?, ?)",
+                    (summary.trace_id, getattr(summary.status, "value", summary.status),
+                     summary.end_time.isoformat() if summary.end_time else None,
+                     _dumps({**summary.to_dict(), "timings": summary.timings}))
+                )
+            if spilled:
+                self.connection.commit()
+
+        return [summary.trace_id for summary in spilled]
+
+    def get(self, trace_id: str) -> Optional[TraceSummary]:
+        # Caducar también al consultar, no solo al añadir trazas nuevas
+        self.evict()
+        with self.lock:
+            entry = self.summaries.get(trace_id)
+        return entry[0] if entry else None
+
+    def load_archived(self, trace_id: str) -> Optional[Dict]:
+        """Leer de disco una traza ya expulsada de memoria"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT summary FROM trace_archive WHERE trace_id = ?", (trace_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def purge_archive(self, max_age_seconds: float) -> int:
+        """Borrar de disco las trazas terminadas hace más de max_age_seconds"""
+        cutoff = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        with self.lock:
+            deleted = self.connection.execute(
+                "DELETE FROM trace_archive WHERE finished_at < ?", (cutoff,)
+            ).rowcount
+            self.connection.commit()
+        return deleted
+
+    def __len__(self) -> int:
+        return len(self.summaries)
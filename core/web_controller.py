@@ -4,10 +4,18 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
+import os
+import json
 import time
 import logging
+import threading
+import urllib.request
 from typing import Dict, List, Optional
 
+from config.settings import settings
+from .cache import TTLCache
+from .circuit_breaker import CircuitBreaker, RetryBudget
+
 class WebController:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
@@ -15,6 +23,23 @@ class WebController:
         self.wait = None
         self.setup_driver()
         
+        # Resultados de búsqueda por (distribuidor, CN); reloj de pared para poder persistirlos
+        self.cn_cache = TTLCache(settings.CN_CACHE_MAX_ENTRIES, settings.CN_CACHE_POSITIVE_TTL, clock=time.time)
+        self.cn_cache_lock = threading.Lock()
+        self.cn_cache_save_lock = threading.Lock()
+        self.cn_cache_unsaved = 0
+        self.load_cn_cache()
+        # Las búsquedas solo avisan; el volcado a disco lo hace este hilo, fuera del camino de las consultas
+        self.cn_cache_dirty = threading.Event()
+        self.cn_cache_closed = False
+        self.cn_cache_saver = threading.Thread(target=self._run_cn_cache_saver, name="cn-cache-saver", daemon=True)
+        self.cn_cache_saver.start()
+        
+        # Salud de cada distribuidor: circuito y presupuesto de reintentos
+        self.distributor_breakers = {}
+        self.distributor_retry_budgets = {}
+        self.distributor_lock = threading.Lock()
+        
     def setup_driver(self):
         """Configurar el driver de Chrome"""
         try:
@@ -37,9 +62,49 @@ class WebController:
     
     def close(self):
         """Cerrar el navegador"""
+        self.cn_cache_closed = True
+        self.cn_cache_dirty.set()
+        self.save_cn_cache()
         if self.driver:
             self.driver.quit()
     
+    def load_cn_cache(self):
+        """Recuperar la caché de búsquedas por CN guardada en disco"""
+        try:
+            if os.path.exists(settings.CN_CACHE_PATH):
+                with open(settings.CN_CACHE_PATH, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+                self.cn_cache.load([(tuple(key), value, expires_at) for key, value, expires_at in entries])
+        except Exception as e:
+            self.logger.error(f"Error cargando caché de CN: {e}")
+    
+    def save_cn_cache(self):
+        """Guardar la caché de búsquedas por CN en disco"""
+        with self.cn_cache_save_lock:
+            with self.cn_cache_lock:
+                entries = self.cn_cache.dump()
+                unsaved, self.cn_cache_unsaved = self.cn_cache_unsaved, 0
+            try:
+                directory = os.path.dirname(settings.CN_CACHE_PATH)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+                temp_path = settings.CN_CACHE_PATH + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(temp_path, settings.CN_CACHE_PATH)
+            except Exception as e:
+                with self.cn_cache_lock:
+                    self.cn_cache_unsaved += unsaved
+                self.logger.error(f"Error guardando caché de CN: {e}")
+    
+    def _run_cn_cache_saver(self):
+        while True:
+            self.cn_cache_dirty.wait()
+            self.cn_cache_dirty.clear()
+            if self.cn_cache_closed:
+                return
+            self.save_cn_cache()
+    
     # PROMOFARMA
     def login_promofarma(self, username: str, password: str) -> Dict:
         """Login en Promofarma"""
@@ -229,8 +294,151 @@ class WebController:
             self.logger.error(f"Error consultando Binary Dashboard: {e}")
             return {"success": False, "error": str(e)}
     
-    def search_by_cn(self, distributor: str, cn: str) -> Dict:
-        """Buscar por CN en distribuidor específico"""
+    def query_binary_dashboard_bulk(self, eans: List[str], fields: List[str] = None,
+                                    chunk_size: int = None) -> Dict:
+        """Consultar Binary Dashboard para una lista de EAN en peticiones por bloques"""
+        chunk_size = chunk_size or settings.BINARY_BULK_CHUNK_SIZE
+        unique_eans = list(dict.fromkeys(ean for ean in eans if ean))
+        products = {}
+        errors = []
+        
+        for start in range(0, len(unique_eans), chunk_size):
+            chunk = unique_eans[start:start + chunk_size]
+            try:
+                payload = json.dumps({"eans": chunk, "fields": fields or []}).encode("utf-8")
+                request = urllib.request.Request(
+                    settings.BINARY_DASHBOARD_URL,
+                    data=payload,
+                    headers={"Content-Type": "application/json", "Accept": "application/json"},
+                    method="POST"
+                )
+                with urllib.request.urlopen(request, timeout=settings.BINARY_DASHBOARD_TIMEOUT) as response:
+                    data = json.loads(response.read().decode("utf-8"))
+                
+                for product_info in data.get("products", []):
+                    if product_info.get("ean") in chunk:
+                        products[product_info["ean"]] = product_info
+                        
+            except Exception as e:
+                # Un bloque fallido no invalida los demás; sus EAN se consultarán uno a uno
+                self.logger.error(f"Error en consulta por bloques a Binary Dashboard: {e}")
+                errors.append({"eans": chunk, "error": str(e)})
+        
+        return {
+            "success": not errors or bool(products),
+            "products": products,
+            "not_found": [ean for ean in unique_eans if ean not in products and
+                          not any(ean in error["eans"] for error in errors)],
+            "errors": errors
+        }
+    
+    def cached_search_by_cn(self, distributor: str, cn: str) -> Optional[Dict]:
+        """Resultado vigente en caché de una búsqueda por CN (None si hay que ir al portal)"""
+        cached = self.cn_cache.get((distributor, cn))
+        return {**cached, "cached": True} if cached is not None else None
+    
+    def search_by_cn(self, distributor: str, cn: str, use_cache: bool = True, attempt: int = None) -> Dict:
+        """Buscar por CN en distribuidor específico (consultando antes la caché).
+        Con attempt se hace un solo intento y, si conviene reintentar, el resultado trae retry_in:
+        así quien ocupa un navegador lo suelta durante la espera"""
+        if use_cache:
+            cached = self.cached_search_by_cn(distributor, cn)
+            if cached is not None:
+                return cached
+        
+        if attempt is not None:
+            return self._search_by_cn_guarded(distributor, cn, attempt)
+        
+        attempt = 0
+        while True:
+            result = self._search_by_cn_guarded(distributor, cn, attempt)
+            if "retry_in" not in result:
+                return result
+            time.sleep(result.pop("retry_in"))
+            attempt += 1
+    
+    def invalidate_cn_cache(self, distributor: str = None, cn: str = None):
+        """Invalidar la caché de un CN en un distribuidor, en todos, o entera"""
+        if distributor is None and cn is None:
+            self.cn_cache.clear()
+            return
+        for key in [key for key, _, _ in self.cn_cache.dump()
+                    if (distributor is None or key[0] == distributor) and (cn is None or key[1] == cn)]:
+            self.cn_cache.invalidate(key)
+    
+    def _distributor_guard(self, distributor: str):
+        """Circuito y presupuesto de reintentos de un distribuidor"""
+        with self.distributor_lock:
+            if distributor not in self.distributor_breakers:
+                self.distributor_breakers[distributor] = CircuitBreaker(
+                    distributor,
+                    failure_threshold=settings.DISTRIBUTOR_BREAKER_FAILURES,
+                    reset_timeout=settings.DISTRIBUTOR_BREAKER_COOLDOWN
+                )
+                self.distributor_retry_budgets[distributor] = RetryBudget(
+                    ratio=settings.DISTRIBUTOR_RETRY_RATIO,
+                    max_tokens=settings.DISTRIBUTOR_RETRY_BURST,
+                    backoff_base=settings.DISTRIBUTOR_BACKOFF_BASE,
+                    backoff_max=settings.DISTRIBUTOR_BACKOFF_MAX
+                )
+            return self.distributor_breakers[distributor], self.distributor_retry_budgets[distributor]
+    
+    def distributor_unavailable(self, distributor: str) -> Optional[Dict]:
+        """Respuesta inmediata si el circuito del distribuidor está abierto (None si se puede consultar)"""
+        breaker, _ = self._distributor_guard(distributor)
+        return self._circuit_open_result(distributor) if breaker.fail_fast() else None
+    
+    def _circuit_open_result(self, distributor: str) -> Dict:
+        # Portal caído: se responde al momento en lugar de esperar al timeout de Selenium
+        return {
+            "success": False, "circuit_open": True,
+            "error": f"Distribuidor {distributor} no disponible temporalmente"
+        }
+    
+    def _search_by_cn_guarded(self, distributor: str, cn: str, attempt: int = 0) -> Dict:
+        """Un intento en el portal salvo que su circuito esté abierto; guarda el resultado y,
+        si es un error y queda presupuesto, indica en retry_in cuánto esperar antes de reintentar"""
+        breaker, budget = self._distributor_guard(distributor)
+        if attempt == 0:
+            budget.deposit()
+        if not breaker.allow():
+            return self._circuit_open_result(distributor)
+        
+        started = time.monotonic()
+        result = self._search_by_cn_uncached(distributor, cn)
+        slow = time.monotonic() - started >= settings.DISTRIBUTOR_SLOW_CALL_SECONDS
+        
+        if result.get("success") and not slow:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        
+        # Los errores no se guardan; "no encontrado" caduca antes que un resultado con precio
+        if result.get("success"):
+            ttl = settings.CN_CACHE_POSITIVE_TTL if result.get("found") else settings.CN_CACHE_NEGATIVE_TTL
+            self.cn_cache.set((distributor, cn), result, ttl)
+            with self.cn_cache_lock:
+                self.cn_cache_unsaved += 1
+                if self.cn_cache_unsaved >= settings.CN_CACHE_SAVE_EVERY:
+                    self.cn_cache_dirty.set()
+            # Una respuesta lenta pero válida se aprovecha; solo se reintentan los errores
+            return result
+        
+        if attempt < settings.DISTRIBUTOR_MAX_RETRIES and budget.try_spend():
+            return {**result, "retry_in": budget.backoff(attempt + 1)}
+        return result
+    
+    def get_distributor_health(self) -> Dict:
+        """Estado del circuito y de los reintentos de cada distribuidor consultado"""
+        with self.distributor_lock:
+            guards = list(self.distributor_breakers.items())
+        return {
+            distributor: {**breaker.get_status(), "retry_budget": self.distributor_retry_budgets[distributor].get_status()}
+            for distributor, breaker in guards
+        }
+    
+    def _search_by_cn_uncached(self, distributor: str, cn: str) -> Dict:
+        """Buscar por CN en el portal del distribuidor"""
         try:
             if distributor == "cofares":
                 return self._search_cofares_by_cn(cn)
@@ -4,6 +4,7 @@ from fastapi.staticfiles import StaticFiles
 import uvicorn
 from datetime import datetime
 import json
+from typing import Optional
 
 # Importar módulos personalizados
 from core.automation_manager import AutomationManager
@@ -37,6 +38,8 @@ app.include_router(automation_routes.router, prefix="/api/v1")
 # Instancias globales de los managers
 automation_manager = AutomationManager()
 trace_manager = TraceManager(automation_manager)  # NUEVO
+# Las rutas de /api/v1/tasks usan el mismo gestor
+app.state.automation_manager = automation_manager
 web_controller = WebController()
 excel_manager = ExcelManager()
 printer_manager = PrinterManager()
@@ -60,24 +63,113 @@ async def health_check():
             "excel": excel_manager.is_ready(),
             "printer": printer_manager.is_ready()
         },
+        "distributors": automation_manager.web_controller.get_distributor_health(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Guardar las filas Excel pendientes antes de apagar"""
+    trace_manager.trace_executor.shutdown(wait=False)
+    trace_manager.close()
+    automation_manager.executor.shutdown(wait=False)
+    automation_manager.web_controller.save_cn_cache()
+    trace_manager.alert_log.close()
+    automation_manager.excel_manager.close()
+    excel_manager.close()
+
 @app.post("/api/v1/trace/start")
 async def start_trace(trace_config: dict):
-    """Iniciar una traza completa"""
-    result = trace_manager.start_full_trace(trace_config)
+    """Iniciar una traza completa en segundo plano"""
+    result = trace_manager.start_trace_async(trace_config)
+    return result
+
+@app.post("/api/v1/trace/dispatch")
+def dispatch_trace(trace_config: dict):
+    """Enviar una traza completa a un trabajador Celery con Farmatic"""
+    # Síncrona: si el broker tarda o está caído, los reintentos de conexión esperan en el pool de hilos
+    result = trace_manager.start_trace_remote(trace_config)
+    if not result.get("success"):
+        raise HTTPException(status_code=503, detail=result.get("error"))
     return result
 
 @app.get("/api/v1/trace/{trace_id}")
-async def get_trace_status(trace_id: str):
+def get_trace_status(trace_id: str):
     """Obtener estado de una traza"""
+    # Síncrona: una traza remota consulta su resultado al backend de Celery y las archivadas a SQLite
     status = trace_manager.get_trace_status(trace_id)
     if status:
         return status
     else:
         raise HTTPException(status_code=404, detail="Traza no encontrada")
 
+@app.get("/api/v1/trace/{trace_id}/timings")
+def get_trace_timings(trace_id: str):
+    """Latencias por paso de una traza"""
+    timings = trace_manager.get_trace_timings(trace_id)
+    if timings:
+        return timings
+    else:
+        raise HTTPException(status_code=404, detail="Traza no encontrada")
+
+@app.get("/api/v1/metrics/steps")
+async def get_step_metrics():
+    """Latencias por paso de todas las trazas"""
+    return trace_manager.get_step_metrics()
+
+@app.post("/api/v1/trace/{trace_id}/resume")
+async def resume_trace(trace_id: str, config_overrides: Optional[dict] = None):
+    """Reanudar una traza interrumpida desde su último punto de control"""
+    result = trace_manager.resume_trace(trace_id, config_overrides)
+    if not result["success"]:
+        raise HTTPException(status_code=409, detail=result["error"])
+    return result
+
+@app.get("/api/v1/traces/resumable")
+async def list_resumable_traces():
+    """Trazas interrumpidas que se pueden reanudar"""
+    return {"traces": trace_manager.list_resumable_traces()}
+
+@app.get("/api/v1/alerts")
+def query_alerts(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                 order_id: Optional[str] = None, product_code: Optional[str] = None,
+                 limit: int = 100):
+    """Consultar alertas de factor humano por fecha (YYYY-MM-DD), pedido o producto"""
+    # Función síncrona: FastAPI la ejecuta en su pool de hilos y el volcado a disco no bloquea el bucle
+    alerts = trace_manager.query_alerts(date_from, date_to, order_id, product_code, limit)
+    return {"alerts": alerts, "count": len(alerts)}
+
+@app.get("/api/v1/cache/stats")
+async def get_cache_stats():
+    """Aciertos, fallos y desalojos de las cachés"""
+    return {
+        **trace_manager.get_cache_stats(),
+        "distributor_cn": automation_manager.web_controller.cn_cache.get_stats()
+    }
+
+@app.get("/api/v1/orders/{order_id}")
+async def get_order_index(order_id: str, ean: str = None):
+    """Consultar en el índice si un pedido ya fue procesado"""
+    entry = trace_manager.lookup_order(order_id, ean)
+    if entry:
+        return {"order_id": order_id, "ean": ean, **entry}
+    else:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado en el índice")
+
+@app.post("/api/v1/ledger/export")
+def export_ledger(export_config: dict = None):
+    """Generar el Excel de pedidos procesados desde el libro"""
+    # Síncrona a propósito: la exportación completa se hace en el pool de hilos, no en el bucle de eventos
+    export_config = export_config or {}
+    result = trace_manager.export_processed_orders(
+        export_config.get("report_name"),
+        export_config.get("date_from"),
+        export_config.get("date_to")
+    )
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,54 @@
+import json
+from datetime import datetime
+
+from core.alert_log import AlertLog
+
+
+def make_alert_log(tmp_path, **kwargs):
+    return AlertLog(
+        log_dir=str(tmp_path / "logs"),
+        database_url=f"sqlite:///{tmp_path / 'alerts.db'}",
+        **kwargs
+    )
+
+
+def test_alerts_are_written_in_batches_and_queryable(tmp_path):
+    """Las alertas se escriben como JSON por líneas y se consultan por pedido, producto y fecha"""
+    alert_log = make_alert_log(tmp_path, flush_interval=60)
+    alert_log.record({"timestamp": datetime(2026, 3, 1, 9, 0), "order_id": "PED001",
+                      "product_code": "123456", "reason": "stock_level_1"})
+    alert_log.record({"timestamp": datetime(2026, 3, 2, 18, 30), "order_id": "PED002",
+                      "product_code": "654321", "reason": "stock_level_1"})
+    alert_log.record({"timestamp": datetime(2026, 3, 2, 19, 0), "order_id": "PED003",
+                      "product_code": "123456", "reason": "stock_level_1"})
+
+    # Con un intervalo largo nada llega a disco hasta vaciar el lote
+    assert not (tmp_path / "logs" / "human_factor_alerts.jsonl").exists()
+
+    assert [a["order_id"] for a in alert_log.query(product_code="123456")] == ["PED003", "PED001"]
+    assert [a["order_id"] for a in alert_log.query(order_id="PED002")] == ["PED002"]
+    assert [a["order_id"] for a in alert_log.query(date_from="2026-03-02", date_to="2026-03-02")] == ["PED003", "PED002"]
+    assert len(alert_log.query(limit=1)) == 1
+
+    lines = (tmp_path / "logs" / "human_factor_alerts.jsonl").read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[0])["timestamp"] == "2026-03-01T09:00:00"
+    alert_log.close()
+
+
+def test_alert_file_rotates_by_size(tmp_path):
+    """El fichero rota al superar el tamaño máximo y conserva un número fijo de copias"""
+    alert_log = make_alert_log(tmp_path, max_bytes=200, backup_count=2, flush_interval=60)
+    for index in range(10):
+        alert_log.record({"timestamp": datetime(2026, 3, 1, 9, index), "order_id": f"PED{index:03d}",
+                          "product_code": "123456", "reason": "stock_level_1", "message": "x" * 100})
+        alert_log.flush()
+    alert_log.close()
+
+    log_dir = tmp_path / "logs"
+    assert sorted(path.name for path in log_dir.iterdir()) == [
+        "human_factor_alerts.jsonl", "human_factor_alerts.jsonl.1", "human_factor_alerts.jsonl.2"
+    ]
+    # El índice conserva todas las alertas aunque los ficheros antiguos se descarten
+    alert_log = make_alert_log(tmp_path)
+    assert len(alert_log.query(limit=100)) == 10
+    alert_log.close()
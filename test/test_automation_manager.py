@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+# Los controladores de Farmatic e impresora necesitan pywin32 (solo Windows)
+pytest.importorskip("win32gui")
+
+from core import automation_manager as automation_module
+
+
+class Dummy:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def is_ready(self):
+        return True
+
+
+def make_manager(monkeypatch):
+    for name in ("FarmaticController", "WebController", "ExcelManager", "PrinterManager"):
+        monkeypatch.setattr(automation_module, name, Dummy)
+    return automation_module.AutomationManager()
+
+
+def test_submit_task_returns_immediately_and_runs_in_background(monkeypatch):
+    """submit_task devuelve el identificador al momento y la tarea se ejecuta en el pool"""
+    manager = make_manager(monkeypatch)
+    release = threading.Event()
+    started = []
+
+    def slow_sync(config):
+        started.append(config["n"])
+        release.wait(5)
+        return {"success": True, "n": config["n"]}
+
+    monkeypatch.setattr(manager, "_execute_inventory_sync", slow_sync)
+    submitted = [manager.submit_task("inventory_sync", {"n": n}) for n in range(3)]
+
+    assert all(task["success"] and task["status"] == "queued" for task in submitted)
+    assert len({task["task_id"] for task in submitted}) == 3
+    # Las tres corren a la vez sin bloquear a quien las envió
+    for _ in range(500):
+        if len(started) == 3:
+            break
+        threading.Event().wait(0.01)
+    assert sorted(started) == [0, 1, 2]
+    assert {task["status"] for task in manager.list_tasks()} == {"running"}
+
+    release.set()
+    manager.executor.shutdown()
+    statuses = [manager.get_task_status(task["task_id"]) for task in submitted]
+    assert [status["status"] for status in statuses] == ["completed"] * 3
+    assert statuses[0]["result"] == {"success": True, "n": 0}
+
+
+def test_submit_task_rejects_unknown_type(monkeypatch):
+    """Un tipo desconocido no llega a encolarse"""
+    manager = make_manager(monkeypatch)
+
+    result = manager.submit_task("desconocida", {})
+
+    assert not result["success"]
+    assert manager.list_tasks() == []
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from api.routes import automation_routes
+from api.routes.automation_routes import TaskRequest
+
+
+class FakeAutomationManager:
+    """Cola de tareas mínima: registra lo encolado sin ejecutarlo"""
+
+    def __init__(self):
+        self.tasks = {}
+
+    def submit_task(self, task_type, task_config, priority=None):
+        if task_type == "desconocida":
+            return {"success": False, "error": f"Tipo de tarea no soportado: {task_type}"}
+        task_id = f"task_{len(self.tasks) + 1}"
+        self.tasks[task_id] = {"type": task_type, "priority": priority, "status": "queued"}
+        return {"success": True, "task_id": task_id, "status": "queued", "created_at": datetime.now()}
+
+    def get_task_status(self, task_id):
+        return self.tasks.get(task_id)
+
+    def list_tasks(self, status=None, limit=100):
+        tasks = [{**info, "task_id": task_id} for task_id, info in reversed(self.tasks.items())]
+        return [task for task in tasks if status is None or task["status"] == status][:limit]
+
+
+def make_request():
+    """Petición con el gestor en app.state, como lo deja main.py"""
+    manager = FakeAutomationManager()
+    return SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(automation_manager=manager))), manager
+
+
+def test_task_routes_use_the_automation_manager():
+    """Crear, consultar y listar tareas pasa por el gestor de app.state"""
+    request, manager = make_request()
+
+    created = asyncio.run(automation_routes.create_task(
+        TaskRequest(task_type="inventory_sync", config={}, priority=0), request
+    ))
+    assert created.status == "queued"
+    assert manager.tasks[created.task_id]["priority"] == 0
+
+    status = asyncio.run(automation_routes.get_task_status(created.task_id, request))
+    assert (status["task_id"], status["type"], status["status"]) == (created.task_id, "inventory_sync", "queued")
+
+    # Sin prioridad, el gestor aplica la prioridad por defecto (no se adelanta a pedidos y trazas)
+    default = asyncio.run(automation_routes.create_task(TaskRequest(task_type="print_labels", config={}), request))
+    assert manager.tasks[default.task_id]["priority"] is None
+    listing = asyncio.run(automation_routes.list_tasks(request))
+    assert listing["total"] == 2
+    assert [task["type"] for task in listing["tasks"]] == ["print_labels", "inventory_sync"]
+
+
+def test_task_routes_report_errors():
+    """Tipo desconocido -> 400; tarea inexistente -> 404; sin gestor -> 503"""
+    request, _ = make_request()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(automation_routes.create_task(TaskRequest(task_type="desconocida", config={}), request))
+    assert error.value.status_code == 400
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(automation_routes.get_task_status("no_existe", request))
+    assert error.value.status_code == 404
+
+    without_manager = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace()))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(automation_routes.list_tasks(without_manager))
+    assert error.value.status_code == 503
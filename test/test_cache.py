@@ -0,0 +1,51 @@
+from core.cache import TTLCache, BinaryProductCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_lru_eviction_and_expiry():
+    """La caché desaloja la entrada menos usada y caduca por tiempo"""
+    clock = FakeClock()
+    cache = TTLCache(max_entries=2, default_ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    clock.now = 11
+    assert cache.get("a") is None
+
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 2
+
+
+def test_binary_cache_field_ttls_and_invalidation():
+    """El stock caduca antes que los datos maestros y se puede invalidar por campo"""
+    clock = FakeClock()
+    cache = BinaryProductCache({"own_stock": 60, "cn": 3600}, default_ttl=60, clock=clock)
+    cache.put("847", {"ean": "847", "own_stock": 3, "cn": "123"})
+
+    assert cache.get("847", ["own_stock", "cn"])["missing"] == []
+
+    clock.now = 61
+    result = cache.get("847", ["own_stock", "cn"])
+    assert result["missing"] == ["own_stock"]
+    assert result["product_info"]["cn"] == "123"
+
+    cache.put("847", {"own_stock": 2}, ["own_stock"])
+    assert cache.get("847", ["own_stock", "cn"])["product_info"]["own_stock"] == 2
+
+    cache.invalidate("847", ["cn"])
+    assert cache.get("847", ["own_stock", "cn"])["missing"] == ["cn"]
+    assert cache.get_stats()["partial_hits"] == 2
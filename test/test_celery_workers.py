@@ -0,0 +1,110 @@
+import pytest
+from celery.contrib.testing.worker import start_worker
+
+from core import celery_app as workers
+from core.trace_manager import TraceStatus
+from test_trace_manager import make_trace_manager
+
+ORDERS = [
+    {"id": "PED001", "ean": "8470001234567", "quantity": 2},
+    {"id": "PED002", "ean": "8470001234568", "quantity": 1},
+    {"id": "PED003", "ean": "8470001234569", "quantity": 1},
+]
+STOCK = {"8470001234567": 5, "8470001234568": 1}
+
+
+@pytest.fixture
+def worker_trace_manager(tmp_path, monkeypatch):
+    """TraceManager del 'puesto' que ejecuta las tareas, con broker y resultados en memoria (sin Redis)"""
+    monkeypatch.setattr(workers.celery_app.conf, "broker_url", "memory://")
+    monkeypatch.setattr(workers.celery_app.conf, "result_backend", "cache+memory://")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    trace_manager = make_trace_manager(ORDERS, STOCK)
+    workers.configure_worker(trace_manager)
+    yield trace_manager
+    workers.configure_worker(None)
+
+
+def test_workers_only_consume_queues_of_their_resources():
+    """Un puesto sin navegador ni Excel no recibe esas etapas ni trazas completas"""
+    queues = workers.worker_queues(["farmatic", "printer"])
+    assert queues == ["autofarma", "autofarma.farmatic", "autofarma.printer"]
+    assert workers.queue_for(workers.TRACE_RESOURCES) in workers.worker_queues(
+        ["browser", "excel", "farmatic", "printer"]
+    )
+
+
+def test_long_tasks_are_not_redelivered_while_running():
+    """Las trazas se confirman al empezar y las etapas tienen plazo de visibilidad de sobra"""
+    assert workers.run_trace.acks_late is False
+    assert workers.run_order_stage.acks_late is True
+    visibility_timeout = workers.celery_app.conf.broker_transport_options["visibility_timeout"]
+    assert visibility_timeout > workers.settings.TRACE_DISPATCH_TIMEOUT
+
+
+def test_order_stages_run_on_workers_and_results_return_to_trace(worker_trace_manager, monkeypatch):
+    """Con dispatch=celery cada etapa va a un trabajador y el resultado se agrega en la traza local"""
+    monkeypatch.setattr(workers.celery_app.conf, "task_always_eager", True)
+    api_trace_manager = make_trace_manager(ORDERS, STOCK)
+
+    result = api_trace_manager.start_full_trace({"dispatch": "celery"})
+
+    summary = result["initial_result"]
+    assert (summary["processed"], summary["human_intervention"]) == (2, 1)
+    # Las consultas se hicieron en el puesto, no en el proceso de la API
+    assert worker_trace_manager.automation_manager.web_controller.binary_calls == 3
+    assert api_trace_manager.automation_manager.web_controller.binary_calls == 0
+    assert worker_trace_manager.order_ledger.count() == 2
+    # El índice local evita repetir los pedidos completados
+    assert api_trace_manager.lookup_order("PED001", "8470001234567")["status"] == "completed"
+    # Tiempos, paso en curso y puntos de control vuelven a la traza de la API
+    trace_id = result["trace_id"]
+    assert api_trace_manager.get_trace_timings(trace_id)["steps"]["check_binary_dashboard"]["count"] == 3
+    assert "print_documents" in api_trace_manager.get_step_metrics()["steps"]
+    assert api_trace_manager.get_trace_status(trace_id)["progress"]["current_step"] == "print_documents"
+    assert worker_trace_manager.get_step_metrics()["steps"]
+    saved = api_trace_manager.checkpoints.load_trace(trace_id)
+    assert saved["order_states"]["PED001|8470001234567"]["status"] == "completed"
+    assert "excel_update" in saved["step_results"]["PED001|8470001234567"]
+
+
+def test_remote_stage_reuses_steps_saved_before_interruption(worker_trace_manager):
+    """Al reanudar una traza repartida, el trabajador no repite los pasos que la API ya tenía guardados"""
+    farmatic = worker_trace_manager.automation_manager.farmatic_controller
+    wallet_calls = []
+    farmatic.manage_wallet = lambda config: wallet_calls.append(config) or {"success": True}
+    state = {
+        "order": ORDERS[2], "priority": 5, "cn": "CN4569",
+        "product_info": {"ean": "8470001234569", "cn": "CN4569", "own_stock": 0},
+        "resumed_steps": {"add_promofarma_wallet": {"success": True}}
+    }
+
+    reply = worker_trace_manager.run_remote_stage("trace_resumed", {}, state, "farmatic")
+
+    assert reply["next_stage"] == "excel"
+    assert wallet_calls == []
+    assert "add_promofarma_wallet" not in reply["step_results"]
+    assert "assign_supplier" in reply["step_results"]
+    assert reply["current_step"] == "reload_and_send"
+
+
+def test_full_trace_over_in_memory_broker(worker_trace_manager, monkeypatch):
+    """Una traza enviada por el broker en memoria la ejecuta el trabajador y su estado vuelve a la API"""
+    api_trace_manager = make_trace_manager([], {})
+
+    with start_worker(workers.celery_app, pool="solo", perform_ping_check=False,
+                      queues=workers.worker_queues(["browser", "excel", "farmatic", "printer"])):
+        trace_id = api_trace_manager.start_trace_remote({})["trace_id"]
+        api_trace_manager.active_traces[trace_id]["remote"].get(timeout=10)
+
+    # El barrido retira la traza terminada aunque nadie haya consultado su estado
+    api_trace_manager.sweep()
+    assert trace_id not in api_trace_manager.active_traces
+
+    status = api_trace_manager.get_trace_status(trace_id)
+    assert status["status"] == TraceStatus.COMPLETED
+    assert [outcome["order_id"] for outcome in status["processed_orders"]] == ["PED001", "PED003"]
+    assert status["human_intervention_required"][0]["order_id"] == "PED002"
+    assert api_trace_manager.get_trace_timings(trace_id)["steps"]["extract_ean"]["count"] == 3
+
@@ -0,0 +1,263 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+import openpyxl
+
+from config.settings import settings
+from core.excel_manager import ExcelManager
+from core.excel_rotation import RotationPolicy, ShardManifest
+
+
+def test_enqueued_rows_are_batched_and_flushed(tmp_path, monkeypatch):
+    """Las filas encoladas se guardan en lote y al cerrar no se pierde ninguna"""
+    monkeypatch.chdir(tmp_path)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "pedidos.xlsx")
+
+    futures = [manager.enqueue_row(file_path, [f"PED{i:03d}", i]) for i in range(5)]
+    assert manager.append_row(file_path, ["PED005", 5])["queued"]
+
+    manager.close()
+
+    assert [f.result()["row_number"] for f in futures] == [2, 3, 4, 5, 6]
+    worksheet = openpyxl.load_workbook(file_path).active
+    assert worksheet.max_row == 7
+    assert worksheet.cell(row=7, column=1).value == "PED005"
+
+
+def test_insert_row_data_continues_existing_file(tmp_path, monkeypatch):
+    """Al reabrir un libro existente se sigue desde la última fila"""
+    monkeypatch.chdir(tmp_path)
+    file_path = str(tmp_path / "pedidos.xlsx")
+
+    manager = ExcelManager()
+    manager.insert_row_data(file_path, ["PED001"])
+    manager.close()
+
+    manager = ExcelManager()
+    result = manager.insert_row_data(file_path, ["PED002"])
+    manager.close()
+
+    assert result["success"]
+    assert result["row_number"] == 3
+
+
+def test_concurrent_inserts_do_not_lose_rows(tmp_path, monkeypatch):
+    """Varios hilos escribiendo en el mismo libro no pierden ni repiten filas"""
+    monkeypatch.chdir(tmp_path)
+    file_path = str(tmp_path / "pedidos.xlsx")
+    manager = ExcelManager()
+    # Otro gestor simula un segundo escritor sobre el mismo fichero
+    other_manager = ExcelManager()
+
+    def worker(thread_id):
+        target = manager if thread_id % 2 else other_manager
+        return [target.insert_row_data(file_path, [thread_id, i])["row_number"] for i in range(10)]
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        row_numbers = [n for rows in executor.map(worker, range(6)) for n in rows]
+
+    manager.close()
+    other_manager.close()
+
+    assert sorted(row_numbers) == list(range(2, 62))
+    assert openpyxl.load_workbook(file_path).active.max_row == 61
+
+
+def test_streaming_report_from_generator(tmp_path, monkeypatch):
+    """El reporte en streaming acepta un generador y formatea cabeceras"""
+    monkeypatch.chdir(tmp_path)
+    manager = ExcelManager()
+
+    rows = ({"Código": f"CN{i}", "Stock": i} for i in range(250))
+    result = manager.create_pharmacy_report_streaming(rows, "stream.xlsx", sample_size=10)
+
+    assert result["success"]
+    assert result["records_count"] == 250
+
+    worksheet = openpyxl.load_workbook(result["file_path"]).active
+    assert [c.value for c in worksheet[1]] == ["Código", "Stock"]
+    assert worksheet[1][0].font.bold
+    assert worksheet.max_row == 251
+    assert worksheet.column_dimensions["A"].width == len("Código") + 2
+
+
+def test_rotation_by_rows_and_export_across_shards(tmp_path, monkeypatch):
+    """Los libros rotados se fragmentan y la exportación recorre todos los fragmentos"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "EXCEL_ROTATION", "daily")
+    monkeypatch.setattr(settings, "EXCEL_ROTATION_MAX_ROWS", 3)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "output" / "pedidos_procesados.xlsx")
+
+    results = [manager.insert_row_data(file_path, [f"PED{i}"]) for i in range(7)]
+
+    shards = manager.list_shards(file_path)
+    assert len(shards) == 3
+    assert results[0]["file_path"] == shards[0]
+    assert results[3]["file_path"] == shards[1]
+    assert datetime.now().strftime("%Y%m%d") in shards[0]
+    assert not os.path.exists(file_path)
+
+    export = manager.export_logical_file(file_path, "export.xlsx", columns=["Pedido"])
+    manager.close()
+
+    assert export["records_count"] == 7
+    worksheet = openpyxl.load_workbook(export["file_path"]).active
+    assert [row[0] for row in worksheet.iter_rows(min_row=2, values_only=True)] == [f"PED{i}" for i in range(7)]
+
+
+def test_legacy_workbook_is_read_with_new_shards(tmp_path, monkeypatch):
+    """El libro sin fragmentar de antes de la rotación sigue en el listado y en las lecturas"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "EXCEL_ROTATION", "daily")
+    manager = ExcelManager()
+    file_path = str(tmp_path / "output" / "pedidos_procesados.xlsx")
+    legacy = openpyxl.Workbook()
+    legacy.active.append(["PED_ANTIGUO"])
+    legacy.save(file_path)
+
+    manager.insert_row_data(file_path, ["PED_NUEVO"])
+
+    shards = manager.list_shards(file_path)
+    assert shards[0] == file_path
+    assert len(shards) == 2
+    assert [row[0] for row in manager.iter_logical_rows(file_path)] == ["PED_ANTIGUO", "PED_NUEVO"]
+    manager.close()
+
+
+def test_archive_closed_shards(tmp_path, monkeypatch):
+    """Los fragmentos cerrados de días anteriores se mueven a archivo"""
+    monkeypatch.chdir(tmp_path)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "output" / "pedidos_procesados.xlsx")
+    manager.insert_row_data(file_path, ["PED1"])
+    manager.close()
+
+    # Simular que el fragmento pertenece a un día ya cerrado
+    manifest = ShardManifest(file_path, RotationPolicy())
+    manifest.shards[0]["period"] = "20200101"
+    manifest.shards[0]["closed"] = True
+    manifest.save()
+
+    result = manager.archive_shards(file_path, before="20200102")
+
+    assert result["success"]
+    assert len(result["archived"]) == 1
+    assert "archivo" in result["archived"][0]
+    assert manager.list_shards(file_path) == result["archived"]
+
+
+def _failing_saves(monkeypatch, failures):
+    """Los primeros `failures` guardados del libro fallan (p. ej. abierto en Excel)"""
+    from core.excel_appender import ExcelAppender
+    original_flush = ExcelAppender.flush
+    remaining = {"count": failures}
+
+    def flush(self):
+        if remaining["count"] > 0:
+            remaining["count"] -= 1
+            raise PermissionError("Libro bloqueado")
+        return original_flush(self)
+
+    monkeypatch.setattr(ExcelAppender, "flush", flush)
+
+
+def test_failed_batch_is_retried_without_losing_rows(tmp_path, monkeypatch):
+    """Un guardado fallido devuelve las filas a la cola y se guardan en el siguiente intento"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "EXCEL_APPEND_FLUSH_SECONDS", 0.05)
+    _failing_saves(monkeypatch, 1)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "pedidos.xlsx")
+
+    futures = [manager.enqueue_row(file_path, [f"PED{i:03d}", i]) for i in range(3)]
+
+    assert [f.result(timeout=5)["row_number"] for f in futures] == [2, 3, 4]
+    assert manager.close()["success"]
+    assert openpyxl.load_workbook(file_path).active.max_row == 4
+
+
+def test_rows_saved_before_a_shard_switch_are_not_written_twice(tmp_path, monkeypatch):
+    """Si falla el guardado tras cambiar de fragmento, solo se reintentan las filas del nuevo"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "EXCEL_ROTATION_MAX_ROWS", 2)
+    monkeypatch.setattr(settings, "EXCEL_APPEND_FLUSH_SECONDS", 60)
+    from core.excel_appender import ExcelAppender
+    original_flush = ExcelAppender.flush
+    calls = {"count": 0}
+
+    def flush(self):
+        calls["count"] += 1
+        if calls["count"] == 2:
+            raise PermissionError("Libro bloqueado")
+        return original_flush(self)
+
+    monkeypatch.setattr(ExcelAppender, "flush", flush)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "output" / "pedidos_procesados.xlsx")
+
+    futures = [manager.enqueue_row(file_path, [f"PED{i}"]) for i in range(3)]
+    assert manager.flush_appenders()["success"] is False
+    assert manager.flush_appenders()["success"]
+
+    assert all(future.result(timeout=5)["success"] for future in futures)
+    assert [row[0] for row in manager.iter_logical_rows(file_path)] == ["PED0", "PED1", "PED2"]
+    manager.close()
+
+
+def test_insert_row_data_gives_up_when_writer_is_stuck(tmp_path, monkeypatch):
+    """Un hilo escritor atascado no deja colgado a quien inserta una fila"""
+    monkeypatch.chdir(tmp_path)
+    manager = ExcelManager()
+    monkeypatch.setattr(manager.writer, "timeout", 0.05)
+    monkeypatch.setattr(manager.writer, "submit", lambda *args, **kwargs: Future())
+
+    result = manager.insert_row_data(str(tmp_path / "pedidos.xlsx"), ["PED001"])
+
+    assert not result["success"]
+    assert result["queued"]
+
+
+def test_rows_that_keep_failing_are_spilled_and_replayed(tmp_path, monkeypatch):
+    """Agotados los intentos, las filas pasan al fichero de pendientes y se reintentan al volver a arrancar"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "EXCEL_APPEND_FLUSH_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "EXCEL_WRITE_ATTEMPTS", 2)
+    _failing_saves(monkeypatch, 2)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "pedidos.xlsx")
+
+    result = manager.enqueue_row(file_path, ["PED001", 1]).result(timeout=5)
+
+    assert not result["success"]
+    assert result["spilled_to"] == file_path + ".pendientes.jsonl"
+    assert os.path.exists(result["spilled_to"])
+    manager.close()
+
+    # Un nuevo escritor del mismo libro recupera la fila antes que las nuevas
+    manager = ExcelManager()
+    assert manager.enqueue_row(file_path, ["PED002", 2]).result(timeout=5)["row_number"] == 3
+    manager.close()
+    worksheet = openpyxl.load_workbook(file_path).active
+    assert [worksheet.cell(row=row, column=1).value for row in (2, 3)] == ["PED001", "PED002"]
+    assert not os.path.exists(file_path + ".pendientes.jsonl")
+
+
+def test_flush_gives_up_after_timeout(tmp_path, monkeypatch):
+    """Vaciar la cola nunca bloquea indefinidamente"""
+    monkeypatch.chdir(tmp_path)
+    manager = ExcelManager()
+    file_path = str(tmp_path / "pedidos.xlsx")
+    writer = manager.writer._get_writer(file_path)
+    # Escritor atascado: la petición de vaciado nunca se completa
+    monkeypatch.setattr(writer, "flush", Future)
+
+    started = datetime.now()
+    result = manager.writer.flush(timeout=0.1)
+
+    assert not result["success"]
+    assert result["unsaved_files"] == [file_path]
+    assert (datetime.now() - started).total_seconds() < 1
+    manager.close()
@@ -0,0 +1,71 @@
+import openpyxl
+
+from core.excel_manager import ExcelManager
+from core.inventory_engine import InventoryEngine
+
+
+def test_compute_from_columnar_input(tmp_path):
+    """Diferencias, estados y totales por proveedor sobre entrada columnar"""
+    engine = InventoryEngine(str(tmp_path / "snapshot.pkl"))
+    result = engine.process({
+        "code": ["A", "B", "C"],
+        "old_stock": [5, 3, 2],
+        "new_stock": [7, 0, 2],
+        "price": [1.0, 2.0, 3.0],
+        "supplier": ["cofares", "cofares", "hefame"],
+    })
+
+    df = result["inventory"]
+    assert df["Diferencia"].tolist() == [2, -3, 0]
+    assert df["Estado"].tolist() == ["sube", "agotado", "sin_cambio"]
+    assert df["Fecha_Actualización"].nunique() == 1
+
+    totals = result["supplier_totals"].set_index("Proveedor")
+    assert totals.loc["cofares", "Productos"] == 2
+    assert totals.loc["cofares", "Valor_Diferencia"] == -4.0
+    assert totals.loc["cofares", "Agotados"] == 1
+
+
+def test_diff_against_previous_snapshot(tmp_path):
+    """Sin stock anterior explícito se compara con la sincronización previa"""
+    engine = InventoryEngine(str(tmp_path / "snapshot.pkl"))
+    engine.process([{"code": "A", "new_stock": 10}, {"code": "B", "new_stock": 4}])
+
+    df = engine.process([{"code": "A", "new_stock": 6}, {"code": "C", "new_stock": 1}])["inventory"]
+
+    assert df["Stock_Anterior"].tolist() == [10, 0]
+    assert df["Diferencia"].tolist() == [-4, 1]
+    assert df["Nuevo_Producto"].tolist() == [False, True]
+
+
+def test_partial_update_keeps_baseline_of_missing_products(tmp_path):
+    """Una actualización parcial no hace perder el stock de referencia de los demás productos"""
+    engine = InventoryEngine(str(tmp_path / "snapshot.pkl"))
+    engine.process([{"code": "A", "new_stock": 10}, {"code": "B", "new_stock": 4}])
+    engine.process([{"code": "A", "new_stock": 6}])
+
+    df = engine.process([{"code": "B", "new_stock": 3}])["inventory"]
+
+    assert df["Stock_Anterior"].tolist() == [4]
+    assert df["Nuevo_Producto"].tolist() == [False]
+    assert engine.load_snapshot().set_index("Código")["Stock_Nuevo"].to_dict() == {"A": 6, "B": 3}
+
+
+def test_update_inventory_excel_writes_report(tmp_path, monkeypatch):
+    """El reporte de inventario se genera desde el motor vectorizado"""
+    monkeypatch.chdir(tmp_path)
+    manager = ExcelManager()
+
+    result = manager.update_inventory_excel([
+        {"code": "A", "name": "Producto A", "old_stock": 1, "new_stock": 3, "price": 2.5, "supplier": "cofares"}
+    ])
+
+    assert result["success"]
+    assert result["supplier_totals"][0]["Proveedor"] == "cofares"
+    worksheet = openpyxl.load_workbook(result["file_path"]).active
+    header = [c.value for c in worksheet[1]]
+    assert header[:8] == [
+        "Código", "Nombre", "Stock_Anterior", "Stock_Nuevo", "Diferencia",
+        "Precio", "Proveedor", "Fecha_Actualización"
+    ]
+    assert worksheet.cell(row=2, column=header.index("Diferencia") + 1).value == 2
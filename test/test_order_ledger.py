@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import openpyxl
+
+from core.excel_manager import ExcelManager
+from core.order_ledger import OrderLedger, LEDGER_COLUMNS
+
+
+def test_ledger_append_and_export(tmp_path, monkeypatch):
+    """El libro acepta filas y exporta el Excel en una pasada"""
+    monkeypatch.chdir(tmp_path)
+    ledger = OrderLedger(f"sqlite:///{tmp_path / 'ledger.db'}")
+
+    for i in range(3):
+        result = ledger.append([datetime(2024, 1, 1, 10, i), f"PED{i}", 1, "847000", "123456",
+                                "Producto", "own_stock", "", "", "Procesado automáticamente"])
+        assert result["success"]
+
+    assert ledger.count() == 3
+    rows = list(ledger.iter_rows(date_from="2024-01-01T10:01"))
+    assert [row[1] for row in rows] == ["PED1", "PED2"]
+    assert isinstance(rows[0][0], datetime)
+    # Una fecha sin hora incluye todo ese día
+    assert len(list(ledger.iter_rows(date_to="2024-01-01"))) == 3
+    assert list(ledger.iter_rows(date_to="2023-12-31")) == []
+    assert [row[1] for row in ledger.iter_rows(date_to="2024-01-01T10:01:00")] == ["PED0", "PED1"]
+
+    export = ledger.export_to_excel(ExcelManager(), "pedidos.xlsx")
+    assert export["success"]
+    assert export["records_count"] == 3
+
+    worksheet = openpyxl.load_workbook(export["file_path"]).active
+    assert [c.value for c in worksheet[1]] == LEDGER_COLUMNS
+    assert worksheet.cell(row=4, column=2).value == "PED2"
+
+
+def test_order_index_memory_is_bounded(tmp_path):
+    """Solo las entradas recientes del índice quedan en memoria; las demás se leen de SQLite"""
+    database_url = f"sqlite:///{tmp_path / 'ledger.db'}"
+    ledger = OrderLedger(database_url, index_cache_entries=5)
+
+    for i in range(50):
+        ledger.append([datetime(2024, 1, 1), f"PED{i:03d}", 1, "847000", "", "", "own_stock"], ean="847000")
+    ledger.record_status("PED100", "847001", "failed")
+
+    assert len(ledger.index.entries) <= 5
+    assert ledger.is_completed("PED000", "847000")
+    assert ledger.lookup("PED100", "847001")["status"] == "failed"
+    assert ledger.lookup("PED999", "847000") is None
+
+    # Al arrancar no se carga el histórico: cada consulta va por clave primaria
+    restarted = OrderLedger(database_url, index_cache_entries=5)
+    assert len(restarted.index.entries) == 0
+    assert restarted.lookup("PED010", "847000")["status"] == "completed"
+    # Un reintento fallido no deshace un pedido completado fuera de la caché
+    restarted.record_status("PED020", "847000", "failed")
+    assert restarted.is_completed("PED020", "847000")
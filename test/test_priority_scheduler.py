@@ -0,0 +1,66 @@
+import threading
+import time
+
+from core.priority_scheduler import AgingPriorityQueue, PriorityExecutor
+from core.resource_limiter import ResourceLimiter
+
+
+def test_queue_serves_urgent_first_but_ages_old_work():
+    """Lo urgente se adelanta, pero lo que lleva mucho esperando acaba saliendo antes"""
+    now = [0.0]
+    work = AgingPriorityQueue(aging_seconds=10, clock=lambda: now[0])
+    work.put("lote-1", priority=5)
+    work.put("lote-2", priority=5)
+    now[0] = 20.0
+    work.put("urgente", priority=0)   # clave 20 < 50
+    now[0] = 100.0
+    work.put("reciente", priority=3)  # clave 130: el lote lleva 100 s y ya va antes
+
+    assert [work.get() for _ in range(4)] == ["urgente", "lote-1", "lote-2", "reciente"]
+
+
+def test_executor_runs_most_urgent_pending_task_first():
+    """Con el único hilo ocupado, la tarea urgente encolada la última es la siguiente en ejecutarse"""
+    executor = PriorityExecutor(max_workers=1, aging_seconds=60)
+    gate = threading.Event()
+    order = []
+    executor.submit(gate.wait)
+    futures = [executor.submit_with_priority(priority, order.append, name)
+               for name, priority in [("normal", 5), ("baja", 9), ("urgente", 0)]]
+
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    executor.shutdown()
+    assert order == ["urgente", "normal", "baja"]
+
+
+def test_resource_slot_goes_to_most_urgent_waiter():
+    """Al liberarse la plaza de Farmatic la ocupa el pedido urgente aunque haya llegado después"""
+    limiter = ResourceLimiter({"farmatic": 1}, aging_seconds=60)
+    order = []
+    release = threading.Event()
+
+    def holder():
+        with limiter.acquire("farmatic"):
+            release.wait()
+
+    def waiter(name, priority):
+        with limiter.priority(priority):
+            with limiter.acquire("farmatic"):
+                order.append(name)
+
+    threads = [threading.Thread(target=holder)]
+    threads[0].start()
+    for name, priority in [("lote", 5), ("urgente", 0)]:
+        thread = threading.Thread(target=waiter, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        while limiter.get_status()["farmatic"]["waiting"] < len(threads) - 1:
+            time.sleep(0.001)
+
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == ["urgente", "lote"]
+    assert limiter.get_status()["farmatic"] == {"limit": 1, "in_use": 0, "waiting": 0}
@@ -0,0 +1,36 @@
+import pytest
+
+from core.stage_pipeline import StagePipeline
+
+
+def test_items_follow_their_own_route_through_stages():
+    """Cada elemento decide su siguiente etapa y al terminar se notifica"""
+    done = []
+
+    def first(item):
+        item["route"] = ["first"]
+        return "second" if item["n"] % 2 else None
+
+    def second(item):
+        item["route"].append("second")
+        return None
+
+    pipeline = StagePipeline([("first", first, 2), ("second", second, 1)], on_done=done.append)
+    items = [{"n": n} for n in range(6)]
+    stats = pipeline.run(items)
+
+    assert len(done) == 6
+    assert [item["route"] for item in items] == [["first"], ["first", "second"]] * 3
+    assert stats["stages"]["first"]["items"] == 6
+    assert stats["stages"]["second"]["items"] == 3
+
+
+def test_fatal_error_stops_pipeline_and_is_raised():
+    """Una interrupción grave detiene el trabajo nuevo y se propaga al llamante"""
+    def stage(item):
+        if item == 2:
+            raise KeyboardInterrupt()
+        return None
+
+    with pytest.raises(KeyboardInterrupt):
+        StagePipeline([("only", stage, 1)]).run(list(range(5)))
@@ -0,0 +1,29 @@
+from core.step_timings import LatencyHistogram, StepTimings
+
+
+def test_histogram_percentiles_are_close_to_exact():
+    """Los percentiles aproximados quedan dentro del error de la cubeta"""
+    histogram = LatencyHistogram()
+    samples = [i / 1000 for i in range(1, 1001)]  # 1 ms .. 1 s
+    for sample in samples:
+        histogram.record(sample)
+
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    assert summary["max"] == 1.0
+    for percent, exact in ((50, 0.5), (95, 0.95), (99, 0.99)):
+        assert abs(summary[f"p{percent}"] - exact) / exact < 0.06
+
+
+def test_step_timings_snapshot_orders_by_total_time():
+    """El resumen pone primero el paso que más tiempo acumula"""
+    timings = StepTimings()
+    timings.record("print_documents", 0.01)
+    timings.record("search_distributors", 2.0)
+    timings.record("search_distributors", 3.0)
+
+    snapshot = timings.snapshot()
+    assert list(snapshot) == ["search_distributors", "print_documents"]
+    assert snapshot["search_distributors"]["count"] == 2
+    assert snapshot["search_distributors"]["max"] == 3.0
+    assert LatencyHistogram().summary()["p99"] == 0.0
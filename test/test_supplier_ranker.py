@@ -0,0 +1,50 @@
+import os
+
+from core.supplier_ranker import SupplierRanker
+
+
+CONFIG = """
+SUPPLIER_PRIORITIES = {{"promofarma": 1, "cofares": 2, "alliance": 3}}
+MINIMUM_MARGINS = {{"promofarma": {promofarma}, "cofares": 0.12, "alliance": 0.10}}
+"""
+
+
+def write_config(path, promofarma_margin):
+    path.write_text(CONFIG.format(promofarma=promofarma_margin), encoding="utf-8")
+
+
+def test_rank_filters_minimum_margin_and_orders_by_priority(tmp_path):
+    """Se descartan los proveedores bajo su margen mínimo y gana la mayor prioridad"""
+    config_path = tmp_path / "supplier_priorities.py"
+    write_config(config_path, 0.15)
+    ranker = SupplierRanker(str(config_path))
+
+    suppliers = [
+        {"name": "alliance", "margin": 0.30},
+        {"name": "promofarma", "margin": 0.14},
+        {"name": "cofares", "margin": 0.12},
+    ]
+    assert ranker.rank(suppliers)["name"] == "cofares"
+    assert ranker.rank([{"name": "cofares", "margin": 0.05}]) is None
+    # Un proveedor sin configurar no tiene mínimo pero va detrás de los conocidos
+    assert ranker.rank([{"name": "otro", "margin": 0.5}, {"name": "alliance", "margin": 0.1}])["name"] == "alliance"
+
+
+def test_config_changes_are_hot_reloaded(tmp_path):
+    """Un cambio en el fichero de prioridades se aplica sin reiniciar"""
+    config_path = tmp_path / "supplier_priorities.py"
+    write_config(config_path, 0.15)
+    ranker = SupplierRanker(str(config_path), check_interval=0)
+    suppliers = [{"name": "promofarma", "margin": 0.14}, {"name": "cofares", "margin": 0.13}]
+    assert ranker.rank(suppliers)["name"] == "cofares"
+
+    write_config(config_path, 0.10)
+    stat = os.stat(config_path)
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert ranker.rank(suppliers)["name"] == "promofarma"
+
+    # Un fichero roto no sustituye la configuración buena
+    config_path.write_text("SUPPLIER_PRIORITIES = {", encoding="utf-8")
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+    assert ranker.rank(suppliers)["name"] == "promofarma"
@@ -0,0 +1,42 @@
+import json
+
+from benchmarks.fake_controllers import LatencyProfile
+from benchmarks.trace_throughput import generate_orders, load_orders, run_benchmark
+
+
+def test_benchmark_reports_throughput_steps_and_memory(tmp_path, monkeypatch):
+    """La traza simulada informa de pedidos por minuto, tiempo por paso y pico de memoria"""
+    monkeypatch.chdir(tmp_path)
+    orders, stock_by_ean = generate_orders(20, distinct_products=8, seed=1)
+
+    report = run_benchmark(orders, stock_by_ean, mode="pipeline", time_scale=0)
+
+    assert report["success"]
+    assert sum(report["results"].values()) == 20
+    assert report["orders_per_minute"] > 0
+    assert report["peak_memory_mb"] > 0
+    assert report["steps"]["check_binary_dashboard"]["count"] == 20
+    # Todo se escribe en un directorio temporal
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_benchmark_injects_failures_and_loads_recorded_orders(tmp_path):
+    """Los fallos simulados llegan a los resultados y los pedidos grabados se pueden reproducir"""
+    orders_file = tmp_path / "pedidos.json"
+    orders_file.write_text(json.dumps({
+        "orders": [{"id": f"PED{i}", "ean": "8470001234567", "quantity": 1} for i in range(5)],
+        "stock": {"8470001234567": 3}
+    }), encoding="utf-8")
+    orders, stock_by_ean = load_orders(str(orders_file))
+
+    report = run_benchmark(
+        orders, stock_by_ean, mode="sequential", time_scale=0, track_memory=False,
+        profiles={
+            "query_binary_dashboard_bulk": LatencyProfile(0.0, failure_rate=1.0),
+            "query_binary_dashboard": LatencyProfile(0.0, failure_rate=1.0)
+        }
+    )
+
+    assert report["results"]["failed"] == 5
+    assert report["simulated"]["failures"]["query_binary_dashboard"] == 5
+    assert report["peak_memory_mb"] is None
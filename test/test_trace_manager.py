@@ -0,0 +1,730 @@
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from config.settings import settings
+from core.excel_manager import ExcelManager
+from core.trace_checkpoints import TraceCheckpointStore
+from core.trace_retention import TraceRetention, TraceSummary
+from core.trace_manager import TraceManager, TraceStatus
+
+
+class FakeFarmatic:
+    def __init__(self, orders):
+        self.orders = orders
+
+    def get_order_list(self, config):
+        return {"success": True, "orders": self.orders}
+
+    def manage_wallet(self, config):
+        return {"success": True}
+
+    def check_wallet_result(self, config):
+        return {"success": True, "suppliers": [
+            {"name": "promofarma", "price": 25.50, "margin": 0.15},
+            {"name": "cofares", "price": 26.00, "margin": 0.12}
+        ]}
+
+    def assign_supplier(self, order_id, supplier):
+        return {"success": True}
+
+    def reload_and_send(self, order_id):
+        return {"success": True}
+
+
+class FakeWeb:
+    def __init__(self, stock_by_ean=None):
+        self.stock_by_ean = stock_by_ean or {}
+        self.binary_calls = 0
+
+    def query_binary_dashboard(self, config):
+        self.binary_calls += 1
+        ean = config["ean"]
+        return {"success": True, "product_info": {
+            "ean": ean, "own_stock": self.stock_by_ean.get(ean, 0), "cn": "CN" + ean[-4:],
+            "description": "Producto", "iva": 21, "laboratory": "Lab", "family": "Medicamentos"
+        }}
+
+    def cached_search_by_cn(self, distributor, cn):
+        return None
+
+    def distributor_unavailable(self, distributor):
+        return None
+
+    def search_by_cn(self, distributor, cn, attempt=None):
+        return {"success": True, "found": distributor != "hefame", "price": 25.0}
+
+    def register_product_binary(self, data):
+        return {"success": True}
+
+    def purchase_actibios(self, ean, quantity):
+        return {"success": True}
+
+
+class FakePrinter:
+    def print_promofarma_label(self, label_data):
+        return {"success": True}
+
+
+def make_trace_manager(orders, stock_by_ean=None):
+    automation_manager = SimpleNamespace(
+        farmatic_controller=FakeFarmatic(orders),
+        web_controller=FakeWeb(stock_by_ean),
+        excel_manager=ExcelManager(),
+        printer_manager=FakePrinter()
+    )
+    return TraceManager(automation_manager)
+
+
+def test_full_trace_records_orders_in_ledger(tmp_path, monkeypatch):
+    """Una traza completa deja los pedidos en el libro SQLite"""
+    monkeypatch.chdir(tmp_path)
+    orders = [
+        {"id": "PED001", "ean": "8470001234567", "quantity": 2},
+        {"id": "PED002", "ean": "8470001234568", "quantity": 1},
+    ]
+    trace_manager = make_trace_manager(orders, {"8470001234567": 5})
+
+    result = trace_manager.start_full_trace({"order_filters": {}})
+
+    assert result["success"]
+    assert result["initial_result"]["processed"] == 2
+    assert trace_manager.order_ledger.count() == 2
+
+
+def test_rerun_skips_orders_already_processed(tmp_path, monkeypatch):
+    """Una segunda traza no repite los pedidos completados en la primera"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    orders = [
+        {"id": "PED001", "ean": "8470001234567", "quantity": 2},
+        {"id": "PED002", "ean": "8470001234568", "quantity": 1},
+    ]
+    trace_manager = make_trace_manager(orders, {"8470001234567": 5, "8470001234568": 1})
+    first = trace_manager.start_full_trace({})["initial_result"]
+    assert first["processed"] == 1
+    assert first["human_intervention"] == 1
+
+    # Nuevo gestor: el índice se recupera del disco
+    trace_manager = make_trace_manager(orders, {"8470001234567": 5, "8470001234568": 1})
+    second = trace_manager.start_full_trace({})["initial_result"]
+
+    assert second["skipped"] == 1
+    assert second["processed"] == 0
+    assert second["human_intervention"] == 1
+    assert trace_manager.automation_manager.web_controller.binary_calls == 1
+    assert trace_manager.lookup_order("PED001", "8470001234567")["status"] == "completed"
+    assert trace_manager.lookup_order("PED002", "8470001234568")["status"] == "requires_human_intervention"
+
+
+def test_human_factor_alert_is_queryable(tmp_path, monkeypatch):
+    """La alerta por stock = 1 queda registrada con su traza y se puede consultar por pedido"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": "PED002", "ean": "8470001234568", "quantity": 1}]
+    trace_manager = make_trace_manager(orders, {"8470001234568": 1})
+    trace_id = trace_manager.start_full_trace({})["trace_id"]
+
+    alerts = trace_manager.query_alerts(order_id="PED002")
+    assert len(alerts) == 1
+    assert alerts[0]["trace_id"] == trace_id
+    assert alerts[0]["reason"] == "stock_level_1"
+    assert (tmp_path / "logs" / "human_factor_alerts.jsonl").exists()
+
+
+def test_concurrent_mode_respects_farmatic_slot(tmp_path, monkeypatch):
+    """En modo concurrente la GUI de Farmatic nunca se usa por dos pedidos a la vez"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": f"PED{i:03d}", "ean": f"847000123{i:04d}", "quantity": 1} for i in range(12)]
+    trace_manager = make_trace_manager(orders)
+
+    farmatic = trace_manager.automation_manager.farmatic_controller
+    web = trace_manager.automation_manager.web_controller
+    state = {"active": 0, "max_active": 0}
+    lock = threading.Lock()
+
+    def guarded(func):
+        def wrapper(*args, **kwargs):
+            with lock:
+                state["active"] += 1
+                state["max_active"] = max(state["max_active"], state["active"])
+            time.sleep(0.002)
+            with lock:
+                state["active"] -= 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    farmatic.manage_wallet = guarded(farmatic.manage_wallet)
+    farmatic.assign_supplier = guarded(farmatic.assign_supplier)
+    original_query = web.query_binary_dashboard
+    web.query_binary_dashboard = lambda config: (time.sleep(0.01), original_query(config))[1]
+
+    result = trace_manager.start_full_trace({"max_workers": 6})
+
+    assert result["initial_result"]["processed"] == 12
+    assert state["max_active"] == 1
+    trace = trace_manager.get_trace_status(result["trace_id"])
+    assert [r["order_id"] for r in trace["processed_orders"]] == [o["id"] for o in orders]
+
+
+def test_async_trace_returns_immediately_and_reports_progress(tmp_path, monkeypatch):
+    """La traza en segundo plano devuelve el id al momento y expone su progreso"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": f"PED{i:03d}", "ean": f"847000123{i:04d}", "quantity": 1} for i in range(5)]
+    trace_manager = make_trace_manager(orders, {o["ean"]: 5 for o in orders})
+    web = trace_manager.automation_manager.web_controller
+    original_query = web.query_binary_dashboard
+    web.query_binary_dashboard = lambda config: (time.sleep(0.05), original_query(config))[1]
+
+    started = time.monotonic()
+    result = trace_manager.start_trace_async({})
+    assert result["success"]
+    assert time.monotonic() - started < 0.05
+
+    status = trace_manager.get_trace_status(result["trace_id"])
+    assert status["progress"]["done"] < 5
+
+    deadline = time.monotonic() + 5
+    while trace_manager.get_trace_status(result["trace_id"])["status"] != TraceStatus.COMPLETED:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    progress = trace_manager.get_trace_status(result["trace_id"])["progress"]
+    assert progress["done"] == progress["total"] == 5
+    assert progress["processed"] == 5
+    assert progress["eta_seconds"] == 0
+    assert progress["current_step"] == "print_documents"
+
+
+def test_binary_lookups_are_cached_between_traces(tmp_path, monkeypatch):
+    """Las fichas de Binary se reutilizan y el stock se refresca tras cada pedido"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": "PED001", "ean": "8470001234567", "quantity": 1}]
+    trace_manager = make_trace_manager(orders, {"8470001234567": 5})
+    web = trace_manager.automation_manager.web_controller
+    requested_fields = []
+    original_query = web.query_binary_dashboard
+    web.query_binary_dashboard = lambda config: (requested_fields.append(config["fields"]), original_query(config))[1]
+
+    trace_manager.start_full_trace({"skip_processed": False})
+    trace_manager.start_full_trace({"skip_processed": False})
+
+    # Segunda consulta: solo el stock, que se invalidó al completar el pedido
+    assert requested_fields[1] == ["own_stock"]
+    assert trace_manager.get_cache_stats()["binary_dashboard"]["partial_hits"] == 1
+
+
+def _slow_distributors(web, delays, found):
+    calls = []
+
+    def search_by_cn(distributor, cn, attempt=None):
+        calls.append(distributor)
+        delay = delays[distributor]
+        time.sleep(delay.pop(0) if isinstance(delay, list) else delay)
+        return {"success": True, "found": distributor in found}
+
+    web.search_by_cn = search_by_cn
+    return calls
+
+
+def test_distributor_fan_out_returns_on_first_hit(tmp_path, monkeypatch):
+    """La búsqueda en paralelo termina con el primer distribuidor que tiene el CN"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "BROWSER_SESSIONS", 4)
+    trace_manager = make_trace_manager([])
+    _slow_distributors(trace_manager.automation_manager.web_controller,
+                       {"cofares": 0.5, "alliance": 0.02, "hefame": 0.5, "bidafarma": 0.5},
+                       found={"cofares", "alliance"})
+
+    started = time.monotonic()
+    result = trace_manager._search_distributors_with_cn("123456")
+
+    assert time.monotonic() - started < 0.3
+    assert result["has_results"]
+    assert result["settled_by"] == "alliance"
+    assert result["distributor_results"]["hefame"]["skipped"]
+
+
+def test_distributor_fan_out_frees_browser_once_settled(tmp_path, monkeypatch):
+    """Con un solo navegador, las búsquedas que esperaban plaza no se hacen tras encontrar el CN"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "BROWSER_SESSIONS", 1)
+    trace_manager = make_trace_manager([])
+    calls = _slow_distributors(trace_manager.automation_manager.web_controller,
+                               {"cofares": 0.01, "alliance": 0.01, "hefame": 0.5, "bidafarma": 0.5},
+                               found={"alliance", "hefame", "bidafarma"})
+
+    result = trace_manager._search_distributors_with_cn("123456")
+
+    assert result["settled_by"] == "alliance"
+    assert result["elapsed_seconds"] < 0.3
+    # Las que ya estaban en el ejecutor terminan sin llegar al portal
+    time.sleep(0.2)
+    assert calls == ["cofares", "alliance"]
+    assert trace_manager.resources.get_status()["browser"]["in_use"] == 0
+
+
+def test_cached_distributor_result_does_not_wait_for_browser(tmp_path, monkeypatch):
+    """Un CN en caché se responde aunque el único navegador esté ocupado"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "BROWSER_SESSIONS", 1)
+    trace_manager = make_trace_manager([])
+    web = trace_manager.automation_manager.web_controller
+    web.cached_search_by_cn = lambda distributor, cn: {"success": True, "found": True, "cached": True}
+    browser_taken, release = threading.Event(), threading.Event()
+
+    def busy_browser():
+        with trace_manager.resources.acquire("browser"):
+            browser_taken.set()
+            release.wait(2)
+
+    threading.Thread(target=busy_browser).start()
+    browser_taken.wait(1)
+    started = time.monotonic()
+    result = trace_manager._query_distributor("alliance", "123456")
+    release.set()
+
+    assert result["cached"]
+    assert time.monotonic() - started < 0.1
+
+
+def test_distributor_backoff_and_open_circuit_do_not_hold_browser(tmp_path, monkeypatch):
+    """El circuito abierto se responde sin plaza de navegador y la espera entre reintentos la deja libre"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "BROWSER_SESSIONS", 1)
+    trace_manager = make_trace_manager([])
+    web = trace_manager.automation_manager.web_controller
+    browser_in_use = []
+
+    def search_by_cn(distributor, cn, attempt=None):
+        browser_in_use.append(trace_manager.resources.get_status()["browser"]["in_use"])
+        if attempt == 0:
+            return {"success": False, "error": "timeout", "retry_in": 0.05}
+        return {"success": True, "found": True}
+
+    def sleep(delay):
+        browser_in_use.append(trace_manager.resources.get_status()["browser"]["in_use"])
+
+    web.search_by_cn = search_by_cn
+    monkeypatch.setattr("core.trace_manager.time.sleep", sleep)
+
+    assert trace_manager._query_distributor("alliance", "123456")["found"]
+    # Búsqueda, espera (sin navegador) y reintento
+    assert browser_in_use == [1, 0, 1]
+
+    web.distributor_unavailable = lambda distributor: {"success": False, "circuit_open": True}
+    with trace_manager.resources.acquire("browser"):
+        # El único navegador está ocupado y aun así responde al momento
+        assert trace_manager._query_distributor("alliance", "654321")["circuit_open"]
+
+
+def test_distributor_fan_out_deadline_and_hedging(tmp_path, monkeypatch):
+    """Los distribuidores lentos se duplican y el plazo corta la espera"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "BROWSER_SESSIONS", 8)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_TIMEOUT", 0.3)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_HEDGE_SECONDS", 0.05)
+    trace_manager = make_trace_manager([])
+    calls = _slow_distributors(trace_manager.automation_manager.web_controller,
+                               {"cofares": 1.0, "alliance": 0.01, "hefame": 0.01, "bidafarma": [1.0, 0.01]},
+                               found={"bidafarma"})
+
+    result = trace_manager._search_distributors_with_cn("123456")
+
+    # La petición duplicada a bidafarma responde antes que la original
+    assert result["settled_by"] == "bidafarma"
+    assert calls.count("bidafarma") == 2
+    assert result["elapsed_seconds"] < 0.3
+
+    monkeypatch.setattr(settings, "DISTRIBUTOR_HEDGE_SECONDS", 0)
+    _slow_distributors(trace_manager.automation_manager.web_controller,
+                       {"cofares": 1.0, "alliance": 0.01, "hefame": 0.01, "bidafarma": 1.0},
+                       found={"cofares"})
+    result = trace_manager._search_distributors_with_cn("123456")
+
+    assert not result["has_results"]
+    assert "Sin respuesta" in result["distributor_results"]["cofares"]["error"]
+    assert result["distributor_results"]["alliance"]["success"]
+
+
+def test_trace_prefetches_binary_products_in_bulk(tmp_path, monkeypatch):
+    """La traza resuelve todas las fichas de Binary con una consulta por bloques"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": f"PED{i:03d}", "ean": f"847000123456{i}", "quantity": 1} for i in range(4)]
+    orders.append({"id": "PED004", "ean": "8470001234560", "quantity": 1})
+    trace_manager = make_trace_manager(orders, {order["ean"]: 5 for order in orders})
+    web = trace_manager.automation_manager.web_controller
+    bulk_calls = []
+
+    def query_binary_dashboard_bulk(eans, fields):
+        bulk_calls.append(list(eans))
+        return {"success": True, "products": {
+            ean: web.query_binary_dashboard({"ean": ean, "fields": fields})["product_info"] for ean in eans
+        }, "not_found": [], "errors": []}
+
+    web.query_binary_dashboard_bulk = query_binary_dashboard_bulk
+
+    result = trace_manager.start_full_trace({})
+
+    assert result["initial_result"]["processed"] == 5
+    assert bulk_calls == [[order["ean"] for order in orders[:4]]]
+    # Las cuatro fichas de la precarga; el EAN repetido solo vuelve a leer el stock que movió su primer pedido
+    assert web.binary_calls == 5
+    assert trace_manager.get_trace_status(result["trace_id"])["prefetch"]["loaded"] == 4
+
+
+def test_duplicate_products_share_lookups_within_trace(tmp_path, monkeypatch):
+    """Los pedidos del mismo producto comparten Binary, distribuidores y cartera"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": f"PED{i:03d}", "ean": "8470001234567" if i % 2 else "8470001234568", "quantity": 1}
+              for i in range(6)]
+    trace_manager = make_trace_manager(orders)
+    farmatic = trace_manager.automation_manager.farmatic_controller
+    web = trace_manager.automation_manager.web_controller
+    calls = {"wallet": 0, "check": 0, "assign": 0, "search": 0}
+    lock = threading.Lock()
+
+    def counted(name, func):
+        def wrapper(*args, **kwargs):
+            with lock:
+                calls[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    farmatic.manage_wallet = counted("wallet", farmatic.manage_wallet)
+    farmatic.check_wallet_result = counted("check", farmatic.check_wallet_result)
+    farmatic.assign_supplier = counted("assign", farmatic.assign_supplier)
+    web.search_by_cn = counted("search", web.search_by_cn)
+
+    static_lookups = []
+    original_query = web.query_binary_dashboard
+    web.query_binary_dashboard = lambda config: (
+        static_lookups.append(config["ean"]) if "cn" in config["fields"] else None, original_query(config)
+    )[1]
+
+    result = trace_manager.start_full_trace({"max_workers": 4, "prefetch_binary": False})
+
+    assert result["initial_result"]["processed"] == 6
+    # Los datos maestros una vez por producto; el stock se relee tras cada pedido
+    assert sorted(static_lookups) == ["8470001234567", "8470001234568"]
+    assert calls["wallet"] == calls["check"] == 2
+    assert calls["search"] <= 2 * 4
+    # La asignación sigue siendo por pedido
+    assert calls["assign"] == 6
+    coalesced = trace_manager.get_trace_status(result["trace_id"])["coalesced"]
+    assert coalesced["products"] == 2
+    assert coalesced["shared_steps"]["reused"] == 4 * 4
+
+
+def test_shared_binary_lookup_rereads_own_stock_per_order(tmp_path, monkeypatch):
+    """Dos pedidos del mismo producto con stock 2: el segundo ve el stock que dejó el primero"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    orders = [{"id": f"PED00{i}", "ean": "8470001234567", "quantity": 1} for i in range(2)]
+    trace_manager = make_trace_manager(orders, {"8470001234567": 2})
+    web = trace_manager.automation_manager.web_controller
+    original_append = trace_manager.order_ledger.append
+
+    def append(row, ean=None):
+        # Servir desde stock propio lo rebaja en Binary
+        web.stock_by_ean[ean] -= 1
+        return original_append(row, ean=ean)
+
+    trace_manager.order_ledger.append = append
+
+    result = trace_manager.start_full_trace({"pipeline": False, "prefetch_binary": False})["initial_result"]
+
+    assert result["processed"] == 1
+    assert result["human_intervention"] == 1
+
+
+class SimulatedCrash(BaseException):
+    """Interrupción del proceso a mitad de traza"""
+
+
+def test_interrupted_trace_resumes_from_checkpoints(tmp_path, monkeypatch):
+    """Al reanudar no se repiten los pasos de Farmatic ya hechos antes de la caída"""
+    monkeypatch.chdir(tmp_path)
+    orders = [
+        {"id": "PED001", "ean": "8470001234567", "quantity": 1},
+        {"id": "PED002", "ean": "8470001234568", "quantity": 1},
+    ]
+    trace_manager = make_trace_manager(orders)
+
+    def crash_on_second_order(order_id):
+        if order_id == "PED002":
+            raise SimulatedCrash()
+        return {"success": True}
+
+    trace_manager.automation_manager.farmatic_controller.reload_and_send = crash_on_second_order
+    try:
+        trace_manager.start_full_trace({"skip_processed": True, "pipeline": False, "farmatic_password": "secreto"})
+    except SimulatedCrash:
+        pass
+
+    # Reinicio: nuevo gestor sobre la misma base de datos
+    restarted = make_trace_manager(orders)
+    farmatic = restarted.automation_manager.farmatic_controller
+    calls = []
+    for name in ("get_order_list", "manage_wallet", "assign_supplier", "reload_and_send"):
+        original = getattr(farmatic, name)
+        setattr(farmatic, name, lambda *args, _name=name, _original=original: (calls.append(_name), _original(*args))[1])
+
+    resumable = restarted.list_resumable_traces()
+    assert len(resumable) == 1
+    trace_id = resumable[0]["trace_id"]
+    assert resumable[0]["finished_orders"] == 1
+
+    result = restarted.resume_trace(trace_id, run_async=False)
+
+    assert result["initial_result"]["processed"] == 2
+    assert calls == ["reload_and_send"]
+    assert restarted.order_ledger.count() == 2
+    assert restarted.list_resumable_traces() == []
+    assert "farmatic_password" not in restarted.checkpoints.load_trace(trace_id)["config"]
+    assert not restarted.resume_trace(trace_id)["success"]
+
+
+def test_trace_interrupted_while_printing_resumes_and_prints(tmp_path, monkeypatch):
+    """Un pedido ya anotado en el libro pero sin imprimir no se da por procesado al reanudar"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": "PED001", "ean": "8470001234567", "quantity": 1}]
+    trace_manager = make_trace_manager(orders)
+
+    def crash(label_data):
+        raise SimulatedCrash()
+
+    trace_manager.automation_manager.printer_manager.print_promofarma_label = crash
+    try:
+        trace_manager.start_full_trace({"skip_processed": True, "pipeline": False})
+    except SimulatedCrash:
+        pass
+    assert trace_manager.order_ledger.count() == 1
+
+    restarted = make_trace_manager(orders)
+    printed = []
+    restarted.automation_manager.printer_manager.print_promofarma_label = (
+        lambda label_data: printed.append(label_data) or {"success": True}
+    )
+    trace_id = restarted.list_resumable_traces()[0]["trace_id"]
+
+    result = restarted.resume_trace(trace_id, run_async=False)
+
+    assert (result["initial_result"]["processed"], result["initial_result"]["skipped"]) == (1, 0)
+    assert len(printed) == 1
+    assert restarted.order_ledger.count() == 1
+
+
+class CountingConnection:
+    """Conexión SQLite que cuenta los commits"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        return self.connection.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def test_step_transitions_are_committed_with_the_next_result(tmp_path, monkeypatch):
+    """Los cambios de paso no hacen commit propio: van en el del siguiente resultado guardado"""
+    monkeypatch.chdir(tmp_path)
+    store = TraceCheckpointStore()
+    store.start_trace("trace_1", {}, "in_progress")
+    store.connection = CountingConnection(store.connection)
+
+    for step in ("extract_ean", "check_binary_dashboard", "add_promofarma_wallet"):
+        store.record_step("trace_1", "PED001|1", step)
+    store.record_step("trace_1", "PED002|2", "extract_ean")
+    assert store.connection.commits == 0
+
+    store.save_step_result("trace_1", "PED001|1", "add_promofarma_wallet", {"success": True})
+    assert store.connection.commits == 1
+
+    store.record_step("trace_1", "PED002|2", "check_binary_dashboard")
+    saved = store.load_trace("trace_1")
+    assert saved["order_states"]["PED001|1"]["current_step"] == "add_promofarma_wallet"
+    assert saved["order_states"]["PED002|2"]["current_step"] == "check_binary_dashboard"
+    store.close()
+
+
+def test_step_timings_per_trace_and_global(tmp_path, monkeypatch):
+    """Cada paso de cada pedido queda medido en la traza y en el acumulado global"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": f"PED{i:03d}", "ean": f"847000123456{i}", "quantity": 1} for i in range(3)]
+    trace_manager = make_trace_manager(orders)
+    farmatic = trace_manager.automation_manager.farmatic_controller
+    original_assign = farmatic.assign_supplier
+    farmatic.assign_supplier = lambda *args: (time.sleep(0.02), original_assign(*args))[1]
+
+    trace_id = trace_manager.start_full_trace({})["trace_id"]
+    trace_manager.start_full_trace({"skip_processed": False})
+
+    timings = trace_manager.get_trace_timings(trace_id)["steps"]
+    assert timings["get_order_list"]["count"] == 1
+    assert timings["assign_supplier"]["count"] == 3
+    assert timings["assign_supplier"]["p50"] >= 0.02
+    assert timings["print_documents"]["count"] == 3
+    assert list(timings)[0] == "assign_supplier"
+    assert trace_manager.get_step_metrics()["steps"]["assign_supplier"]["count"] == 6
+    assert trace_manager.get_trace_timings("desconocida") is None
+
+
+def test_finished_traces_are_compacted_and_spilled_to_disk(tmp_path, monkeypatch):
+    """Las trazas terminadas se resumen sin credenciales y las más antiguas pasan a disco"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "TRACE_RETENTION_MAX_TRACES", 2)
+    orders = [{"id": "PED001", "ean": "8470001234567", "quantity": 1}]
+    trace_manager = make_trace_manager(orders)
+
+    trace_ids = [
+        trace_manager.start_full_trace({"skip_processed": False, "credentials": {"password": "x"}})["trace_id"]
+        for _ in range(3)
+    ]
+
+    assert trace_manager.active_traces == {}
+    assert len(trace_manager.completed_traces) == 2
+    assert trace_manager.trace_timings == {}
+
+    recent = trace_manager.get_trace_status(trace_ids[-1])
+    assert recent["status"] == TraceStatus.COMPLETED
+    assert recent["processed_orders"][0]["supplier"] == "promofarma"
+    assert "credentials" not in recent["config"]
+
+    archived = trace_manager.get_trace_status(trace_ids[0])
+    assert archived["status"] == "completed"
+    assert archived["progress"]["processed"] == 1
+    assert archived["processed_orders"][0]["order_id"] == "PED001"
+    assert trace_manager.get_trace_timings(trace_ids[0])["steps"]["print_documents"]["count"] == 1
+
+
+def test_old_summaries_expire_on_reads_without_new_traces(tmp_path, monkeypatch):
+    """Las trazas caducadas pasan a disco al consultarlas, aunque no terminen trazas nuevas"""
+    monkeypatch.chdir(tmp_path)
+    now = [0.0]
+    retention = TraceRetention(max_traces=10, max_age_seconds=60, clock=lambda: now[0])
+    retention.add(TraceSummary(trace_id="trace_1", status="completed", start_time=datetime.now(),
+                               end_time=datetime.now(), config={}, progress={}))
+
+    now[0] = 61
+
+    assert retention.get("trace_1") is None
+    assert len(retention) == 0
+    assert retention.load_archived("trace_1")["trace_id"] == "trace_1"
+
+
+def test_old_checkpoints_and_archived_traces_are_purged(tmp_path, monkeypatch):
+    """Los puntos de control y las trazas archivadas caducan y se borran al terminar otra traza o al arrancar"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "TRACE_RETENTION_MAX_TRACES", 0)
+    orders = [{"id": "PED001", "ean": "8470001234567", "quantity": 1}]
+    trace_manager = make_trace_manager(orders)
+    old_trace = trace_manager.start_full_trace({"skip_processed": False})["trace_id"]
+    assert trace_manager.checkpoints.load_trace(old_trace) is not None
+    assert trace_manager.completed_traces.load_archived(old_trace) is not None
+
+    monkeypatch.setattr(settings, "TRACE_HISTORY_MAX_AGE", 0.05)
+    time.sleep(0.1)
+    new_trace = trace_manager.start_full_trace({"skip_processed": False})["trace_id"]
+
+    assert trace_manager.checkpoints.load_trace(old_trace) is None
+    assert trace_manager.completed_traces.load_archived(old_trace) is None
+    assert trace_manager.checkpoints.load_trace(new_trace)["status"] == "completed"
+
+    time.sleep(0.1)
+    restarted = make_trace_manager(orders)
+    assert restarted.checkpoints.load_trace(new_trace) is None
+
+
+def test_order_without_supplier_above_minimum_margin_needs_human(tmp_path, monkeypatch):
+    """Si ningún proveedor llega a su margen mínimo el pedido pasa a revisión humana"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": "PED001", "ean": "8470001234567", "quantity": 1}]
+    trace_manager = make_trace_manager(orders)
+    trace_manager.automation_manager.farmatic_controller.check_wallet_result = lambda config: {
+        "success": True, "suppliers": [{"name": "promofarma", "price": 25.0, "margin": 0.02}]
+    }
+
+    result = trace_manager.start_full_trace({})
+
+    assert result["initial_result"]["human_intervention"] == 1
+    trace = trace_manager.get_trace_status(result["trace_id"])
+    assert trace["human_intervention_required"][0]["reason"] == "no_supplier_above_minimum_margin"
+
+
+def test_default_trace_processes_orders_one_at_a_time(tmp_path, monkeypatch):
+    """Sin configurar nada, los pedidos se procesan de uno en uno, como antes de las etapas"""
+    monkeypatch.chdir(tmp_path)
+    orders = [{"id": f"PED{i:03d}", "ean": f"84700012345{i:02d}", "quantity": 1} for i in range(4)]
+    trace_manager = make_trace_manager(orders)
+    web = trace_manager.automation_manager.web_controller
+    original_query = web.query_binary_dashboard
+    running, overlaps = [], []
+
+    def query(config):
+        running.append(config)
+        overlaps.append(len(running))
+        time.sleep(0.01)
+        running.pop()
+        return original_query(config)
+
+    web.query_binary_dashboard = query
+    result = trace_manager.start_full_trace({"prefetch_binary": False})
+
+    assert result["initial_result"]["processed"] == 4
+    assert max(overlaps) == 1
+    assert "pipeline" not in trace_manager.get_trace_status(result["trace_id"])
+
+
+def test_pipeline_overlaps_web_lookups_with_farmatic(tmp_path, monkeypatch):
+    """Por etapas, las consultas web del siguiente pedido se solapan con Farmatic sin romper las ramas"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    orders = [{"id": f"PED{i:03d}", "ean": f"84700012345{i:02d}", "quantity": 1} for i in range(8)]
+    trace_manager = make_trace_manager(orders, {"8470001234503": 1})
+    farmatic = trace_manager.automation_manager.farmatic_controller
+    web = trace_manager.automation_manager.web_controller
+    original_query = web.query_binary_dashboard
+    web.query_binary_dashboard = lambda config: (time.sleep(0.05), original_query(config))[1]
+    farmatic.assign_supplier = lambda order_id, supplier: (time.sleep(0.05), {"success": True})[1]
+    farmatic.reload_and_send = lambda order_id: {"success": order_id != "PED005"}
+
+    started = time.monotonic()
+    result = trace_manager.start_full_trace(
+        {"pipeline": True, "prefetch_binary": False, "stage_workers": {"lookup": 2}}
+    )
+    elapsed = time.monotonic() - started
+
+    summary = result["initial_result"]
+    assert (summary["processed"], summary["failed"], summary["human_intervention"]) == (6, 1, 1)
+    # Secuencial serían 8 * 0.05 de Binary más 7 * 0.05 de Farmatic
+    assert elapsed < 0.6
+    trace = trace_manager.get_trace_status(result["trace_id"])
+    assert [r["order_id"] for r in trace["processed_orders"]] == ["PED000", "PED001", "PED002", "PED004", "PED006", "PED007"]
+    assert trace["failed_orders"][0]["error"] == "Error recargando y enviando"
+    assert trace["pipeline"]["stages"]["farmatic"]["items"] == 7
+    assert trace["pipeline"]["stages"]["lookup"]["workers"] == 2
+
+
+def test_urgent_orders_are_processed_first(tmp_path, monkeypatch):
+    """Los pedidos con cliente esperando o prioridad alta pasan delante del lote"""
+    monkeypatch.chdir(tmp_path)
+    orders = [
+        {"id": "PED001", "ean": "8470001234567", "quantity": 1},
+        {"id": "PED002", "ean": "8470001234568", "quantity": 1, "priority": 2},
+        {"id": "PED003", "ean": "8470001234569", "quantity": 1, "customer_waiting": True},
+    ]
+    trace_manager = make_trace_manager(orders, {ean: 5 for ean in ("8470001234567", "8470001234568", "8470001234569")})
+    processed = []
+    original = trace_manager._process_single_order
+    monkeypatch.setattr(trace_manager, "_process_single_order",
+                        lambda trace_data, order: processed.append(order["id"]) or original(trace_data, order))
+
+    result = trace_manager.start_full_trace({"pipeline": False, "max_workers": 1})
+
+    assert result["initial_result"]["processed"] == 3
+    assert processed == ["PED003", "PED002", "PED001"]
@@ -0,0 +1,203 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from config.settings import settings
+from core.web_controller import WebController
+
+
+def make_web_controller(monkeypatch, tmp_path, calls):
+    """Controlador web sin navegador que cuenta las búsquedas reales por CN"""
+    monkeypatch.setattr(settings, "CN_CACHE_PATH", str(tmp_path / "cn_cache.json"))
+    # Sin reintentos: cada error es una única búsqueda real
+    monkeypatch.setattr(settings, "DISTRIBUTOR_MAX_RETRIES", 0)
+    monkeypatch.setattr(WebController, "setup_driver", lambda self: None)
+
+    def fake_search(self, distributor, cn):
+        calls.append((distributor, cn))
+        if distributor == "hefame":
+            return {"success": True, "found": False}
+        if distributor == "alliance":
+            return {"success": False, "error": "timeout"}
+        return {"success": True, "found": True, "price": 25.0}
+
+    monkeypatch.setattr(WebController, "_search_by_cn_uncached", fake_search)
+    return WebController()
+
+
+def test_cn_cache_keeps_prices_and_negatives_but_not_errors(tmp_path, monkeypatch):
+    """Precios y "no encontrado" se cachean por distribuidor; los errores no"""
+    calls = []
+    web = make_web_controller(monkeypatch, tmp_path, calls)
+    monkeypatch.setattr(settings, "CN_CACHE_NEGATIVE_TTL", 0)
+
+    for _ in range(2):
+        assert web.search_by_cn("cofares", "123456")["price"] == 25.0
+        assert not web.search_by_cn("hefame", "123456")["found"]
+        assert not web.search_by_cn("alliance", "123456")["success"]
+
+    assert web.search_by_cn("cofares", "123456")["cached"]
+    # El negativo con TTL 0 y el error se vuelven a consultar
+    assert calls.count(("cofares", "123456")) == 1
+    assert calls.count(("hefame", "123456")) == 2
+    assert calls.count(("alliance", "123456")) == 2
+
+    web.invalidate_cn_cache(distributor="cofares")
+    web.search_by_cn("cofares", "123456")
+    assert calls.count(("cofares", "123456")) == 2
+
+
+def test_cn_cache_survives_restart(tmp_path, monkeypatch):
+    """La caché guardada al cerrar se recupera en el siguiente arranque"""
+    calls = []
+    web = make_web_controller(monkeypatch, tmp_path, calls)
+    web.search_by_cn("cofares", "654321")
+    web.search_by_cn("hefame", "654321")
+    web.close()
+
+    restarted = make_web_controller(monkeypatch, tmp_path, calls)
+    assert restarted.search_by_cn("cofares", "654321")["cached"]
+    assert restarted.search_by_cn("hefame", "654321")["cached"]
+    assert len(calls) == 2
+
+
+def test_cn_cache_is_saved_in_background_not_during_lookups(tmp_path, monkeypatch):
+    """Al llegar al umbral de cambios la caché se guarda desde su hilo, no desde la búsqueda"""
+    calls = []
+    web = make_web_controller(monkeypatch, tmp_path, calls)
+    monkeypatch.setattr(settings, "CN_CACHE_SAVE_EVERY", 2)
+    original_save = WebController.save_cn_cache
+    saved_from = []
+    saved = threading.Event()
+
+    def save_cn_cache(self):
+        saved_from.append(threading.current_thread().name)
+        original_save(self)
+        saved.set()
+
+    monkeypatch.setattr(WebController, "save_cn_cache", save_cn_cache)
+    web.search_by_cn("cofares", "111111")
+    web.search_by_cn("cofares", "222222")
+
+    assert saved.wait(5)
+    assert saved_from == ["cn-cache-saver"]
+    assert web.cn_cache_unsaved == 0
+    assert len(json.loads((tmp_path / "cn_cache.json").read_text())) == 2
+    web.close()
+
+
+def test_bulk_binary_lookup_against_stub_server(tmp_path, monkeypatch):
+    """La consulta por bloques resuelve varios EAN con pocas peticiones HTTP"""
+    requests = []
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests.append(body)
+            products = [{"ean": ean, "own_stock": 3, "cn": "CN" + ean[-4:]}
+                        for ean in body["eans"] if ean != "0000000000000"]
+            payload = json.dumps({"products": products}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        web = make_web_controller(monkeypatch, tmp_path, [])
+        monkeypatch.setattr(settings, "BINARY_DASHBOARD_URL", f"http://127.0.0.1:{server.server_port}/api/products")
+
+        eans = [f"847000123456{i}" for i in range(5)] + ["0000000000000", "8470001234560"]
+        result = web.query_binary_dashboard_bulk(eans, ["own_stock", "cn"], chunk_size=4)
+    finally:
+        server.shutdown()
+
+    assert result["success"]
+    assert len(requests) == 2
+    assert requests[0]["fields"] == ["own_stock", "cn"]
+    assert sorted(result["products"]) == sorted(eans[:5])
+    assert result["not_found"] == ["0000000000000"]
+    assert result["products"]["8470001234562"]["cn"] == "CN4562"
+
+
+def test_distributor_circuit_opens_and_probes_half_open(tmp_path, monkeypatch):
+    """Tras varios fallos el distribuidor responde al instante sin buscar, y pasado el enfriamiento se prueba de nuevo"""
+    calls = []
+    web = make_web_controller(monkeypatch, tmp_path, calls)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_BREAKER_COOLDOWN", 60)
+
+    for index in range(10):
+        result = web.search_by_cn("alliance", f"CN{index}")
+        assert not result["success"]
+
+    assert len(calls) == 3
+    assert result["circuit_open"]
+    health = web.get_distributor_health()["alliance"]
+    assert health["state"] == "open"
+    assert health["rejected"] == 7
+
+    # Enfriamiento cumplido: una sola prueba; si falla vuelve a abrirse
+    breaker, _ = web._distributor_guard("alliance")
+    breaker.opened_at -= 60
+    web.search_by_cn("alliance", "CN99")
+    assert len(calls) == 4
+    assert web.get_distributor_health()["alliance"]["state"] == "open"
+
+    # Si la prueba sale bien se cierra
+    breaker.opened_at -= 60
+    monkeypatch.setattr(WebController, "_search_by_cn_uncached",
+                        lambda self, distributor, cn: {"success": True, "found": True, "price": 24.5})
+    assert web.search_by_cn("alliance", "CN100")["success"]
+    assert web.get_distributor_health()["alliance"]["state"] == "closed"
+
+
+def test_distributor_retries_are_bounded_by_budget(tmp_path, monkeypatch):
+    """Los errores se reintentan con espera, pero nunca más que el presupuesto disponible"""
+    calls = []
+    web = make_web_controller(monkeypatch, tmp_path, calls)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_MAX_RETRIES", 2)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_RETRY_BURST", 3)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_RETRY_RATIO", 0)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_BREAKER_FAILURES", 100)
+    sleeps = []
+    monkeypatch.setattr("core.web_controller.time.sleep", sleeps.append)
+
+    web.search_by_cn("alliance", "CN1")
+    assert len(calls) == 3  # búsqueda + 2 reintentos
+    web.search_by_cn("alliance", "CN2")
+    assert len(calls) == 5  # solo quedaba un reintento
+    web.search_by_cn("alliance", "CN3")
+    assert len(calls) == 6
+
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= settings.DISTRIBUTOR_BACKOFF_MAX for delay in sleeps)
+    assert web.get_distributor_health()["alliance"]["retry_budget"]["denied"] == 2
+
+
+def test_single_attempt_leaves_backoff_and_open_circuit_to_caller(tmp_path, monkeypatch):
+    """Con attempt no se duerme dentro de la búsqueda y el circuito abierto se comprueba sin buscar"""
+    calls = []
+    web = make_web_controller(monkeypatch, tmp_path, calls)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_MAX_RETRIES", 1)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(settings, "DISTRIBUTOR_BREAKER_COOLDOWN", 60)
+    sleeps = []
+    monkeypatch.setattr("core.web_controller.time.sleep", sleeps.append)
+
+    assert web.distributor_unavailable("alliance") is None
+    first = web.search_by_cn("alliance", "CN1", attempt=0)
+    assert 0 <= first["retry_in"] <= settings.DISTRIBUTOR_BACKOFF_MAX
+    second = web.search_by_cn("alliance", "CN1", attempt=1)
+    assert "retry_in" not in second
+    assert sleeps == []
+
+    # Dos fallos seguidos abren el circuito: se rechaza antes de ocupar nada
+    assert web.distributor_unavailable("alliance")["circuit_open"]
+    assert len(calls) == 2
+    assert web.get_distributor_health()["alliance"]["rejected"] == 1